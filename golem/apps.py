@@ -1,3 +1,5 @@
+import logging
+
 from django.apps import AppConfig
 
 
@@ -5,6 +7,8 @@ class GolemConfig(AppConfig):
     name = 'golem'
 
     def ready(self):
-        print('Init webhooks @ GolemConfig')
+        from golem.core.logging.chat_log import configure_logging
+        configure_logging()
+        logging.debug('Init webhooks @ GolemConfig')
         from golem.core.interfaces.all import init_webhooks
         init_webhooks()
@@ -0,0 +1,63 @@
+"""
+Micro benchmarks of the hot paths of the dialog manager.
+Run them with `python manage.py benchmark <name>`, see BENCHMARKS for available names.
+"""
+import time
+
+BENCHMARKS = {
+    'context_memory': 'golem.benchmarks.context_memory',
+    'context_serialization': 'golem.benchmarks.context_serialization',
+    'entity_query': 'golem.benchmarks.entity_query',
+    'intent_routing': 'golem.benchmarks.intent_routing',
+    'message_preprocessing': 'golem.benchmarks.message_preprocessing',
+}
+
+
+class BenchmarkDialog:
+    """Minimal stand-in for DialogManager, enough to build a Context."""
+
+    def __init__(self, state_name='default.root'):
+        self.current_state_name = state_name
+
+
+def make_context(entities=40, depth=30, state_name='default.root'):
+    """
+    Builds a context with a deep history of entity values, as it looks like in a long-lived chat.
+    :param entities:    number of distinct entities
+    :param depth:       number of values of each entity
+    """
+    from datetime import datetime, timedelta
+    from django.utils import timezone
+    from golem.core.context import Context
+
+    context = Context(dialog=BenchmarkDialog(state_name), entities={}, history=[], counter=0, max_depth=depth)
+    now = datetime(2018, 3, 1, 12, tzinfo=timezone.utc)
+    for i in range(depth):
+        context.counter += 1
+        context.add_state('flow_{}.state_{}'.format(i % 7, i % 3))
+        for e in range(entities):
+            if e % 10 == 0:
+                value = {'value': (now + timedelta(days=i), now + timedelta(days=i + 1)), 'grain': 'day',
+                         'formatted': 'the {}th'.format(i)}
+            elif e % 3 == 0:
+                value = {'value': i * e, 'confidence': 0.87}
+            else:
+                value = {'value': 'value_{}_{}'.format(e, i), 'confidence': 0.93, 'metadata': None}
+            context.add_entity_dict('entity_{}'.format(e), value)
+    return context
+
+
+def measure(fn, repeat) -> float:
+    """Returns the average duration of a function call in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(name, **kwargs) -> dict:
+    import importlib
+    if name not in BENCHMARKS:
+        raise ValueError("Unknown benchmark {}, use one of: {}".format(name, ', '.join(sorted(BENCHMARKS))))
+    module = importlib.import_module(BENCHMARKS[name])
+    return module.run(**kwargs)
@@ -0,0 +1,28 @@
+"""
+Measures memory held by a loaded context and the time it takes to load it.
+"""
+import tracemalloc
+
+from golem.benchmarks import BenchmarkDialog, make_context, measure
+from golem.core.context import Context
+from golem.core.serialize import binary_dumps, json_dumps, loads_context
+
+
+def load(blob):
+    return Context.from_dict(dialog=BenchmarkDialog(), data=loads_context(blob))
+
+
+def run(entities=40, depth=30, repeat=50) -> dict:
+    data = make_context(entities=entities, depth=depth).to_dict()
+    report = {}
+    for name, blob in [('json', json_dumps(data)), ('binary', binary_dumps(data))]:
+        tracemalloc.start()
+        context = load(blob)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[name] = {
+            'context_bytes': size,
+            'bytes_per_value': size // max(1, sum(len(values) for values in context.entities.values())),
+            'load_ms': measure(lambda: load(blob), repeat),
+        }
+    return report
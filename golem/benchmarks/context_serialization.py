@@ -0,0 +1,40 @@
+"""
+Compares encoding and decoding of contexts in the legacy JSON format and in the binary format.
+The cycle is what happens with a context when a message is processed: it is loaded,
+an action reads a few entities and adds a new value, and the context is saved again.
+"""
+from functools import partial
+
+from golem.benchmarks import BenchmarkDialog, make_context, measure
+from golem.core.context import Context
+from golem.core.serialize import binary_dumps, binary_loads, json_dumps, json_loads
+
+FORMATS = {
+    'json': (json_dumps, json_loads),
+    'binary': (binary_dumps, binary_loads),
+    'binary_lazy': (binary_dumps, partial(binary_loads, lazy=True)),
+}
+
+
+def cycle(blob, dumps, loads):
+    context = Context.from_dict(dialog=BenchmarkDialog(), data=loads(blob))
+    context.counter += 1
+    context.get('entity_1')
+    context.get('entity_2', max_age=0)
+    context.set_value('entity_3', 'foo')
+    return dumps(context.to_dict())
+
+
+def run(entities=40, depth=30, repeat=50) -> dict:
+    context = make_context(entities=entities, depth=depth)
+    data = context.to_dict()
+    report = {}
+    for name, (dumps, loads) in FORMATS.items():
+        blob = dumps(data)
+        report[name] = {
+            'bytes': len(blob.encode('utf-8') if isinstance(blob, str) else blob),
+            'encode_ms': measure(lambda: dumps(data), repeat),
+            'decode_ms': measure(lambda: loads(blob), repeat),
+            'cycle_ms': measure(lambda: cycle(blob, dumps, loads), repeat),
+        }
+    return report
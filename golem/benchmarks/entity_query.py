@@ -0,0 +1,55 @@
+"""
+Measures filters of entity queries over a deep history of values.
+Scans are the previous implementation, looking up each value in the whole history of the other entity,
+or sorting all values to get the latest one.
+"""
+import re
+
+from golem.benchmarks import BenchmarkDialog, measure
+from golem.core.context import Context
+
+
+def make_context(depth):
+    context = Context(dialog=BenchmarkDialog(), entities={}, history=[], counter=0, max_depth=depth)
+    for i in range(depth):
+        context.counter += 1
+        context.product = 'product_{}'.format(i)
+        context.action = 'buy' if i % 2 else 'sell'
+    return context
+
+
+def scan_set_with(context, name, entity, value):
+    filtered = []
+    for item in context.entities[name]:
+        for other in context.entities.get(entity, []):
+            if other.counter == item.counter and other.value == value:
+                filtered.append(item)
+                break
+    return filtered
+
+
+def scan_newer_than(context, name, messages):
+    return [x for x in context.entities[name] if context.counter - x.counter < messages]
+
+
+def scan_latest(context, name, regex):
+    items = [x for x in context.entities[name] if re.match(regex, x.state_set)]
+    return sorted(items, key=lambda x: x.timestamp, reverse=True)[0]
+
+
+def run(depth=1000, repeat=20) -> dict:
+    context = make_context(depth)
+    return {
+        'set_with': {
+            'scan_ms': measure(lambda: scan_set_with(context, 'product', 'action', 'buy'), repeat),
+            'index_ms': measure(lambda: context.product.set_with('action', 'buy').count(), repeat),
+        },
+        'newer_than': {
+            'scan_ms': measure(lambda: scan_newer_than(context, 'product', 10), repeat),
+            'index_ms': measure(lambda: context.product.newer_than(messages=10).count(), repeat),
+        },
+        'latest': {
+            'scan_ms': measure(lambda: scan_latest(context, 'product', '.*'), repeat),
+            'index_ms': measure(lambda: context.product.include_flow('.*').latest(), repeat),
+        },
+    }
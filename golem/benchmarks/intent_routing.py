@@ -0,0 +1,42 @@
+"""
+Compares finding the flow of an intent by scanning all flows with the precompiled intent router.
+"""
+import re
+
+from golem.benchmarks import measure
+from golem.core.flow import Flow, State
+from golem.core.intent_router import FlowIntentRouter
+
+
+def make_flows(count=150):
+    """Builds flows with intents named after them and every tenth one with a custom intent."""
+    flows = {}
+    for i in range(count):
+        name = 'flow_{:04d}'.format(i)
+        intent = 'intent_{:04d}'.format(i) if i % 10 == 0 else None
+        flows[name] = Flow(name=name, states={'root': State('root', action=None)}, intent=intent)
+    return flows
+
+
+def scan(flows, intent):
+    for flow in flows.values():
+        if re.match(intent, flow.intent):
+            return flow.name + '.root'
+    return None
+
+
+def run(flows=150, repeat=2000) -> dict:
+    flows = make_flows(flows)
+    router = FlowIntentRouter((flow.intent, flow.name + '.root') for flow in flows.values())
+    intents = ['flow_{:04d}'.format(len(flows) - 1), 'intent_{:04d}'.format(len(flows) - 10), 'intent_.*9', 'unknown']
+    for intent in intents:
+        if router.route(intent) != scan(flows, intent):
+            raise ValueError('Router and scan disagree on intent {}'.format(intent))
+    report = {}
+    for intent in intents:
+        report[intent] = {
+            'scan_ms': measure(lambda: scan(flows, intent), repeat),
+            'router_cold_ms': measure(lambda: router._route(intent), repeat),
+            'router_ms': measure(lambda: router.route(intent), repeat),
+        }
+    return report
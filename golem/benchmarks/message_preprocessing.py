@@ -0,0 +1,49 @@
+"""
+Compares extraction of emoji and smileys from user messages with the previous implementation,
+which compiled its patterns and demojized the text on every message.
+"""
+import re
+
+import emoji
+
+from golem.benchmarks import measure
+from golem.core.message_parser import parse_additional_entities
+
+# most messages are plain text, some contain diacritics, smileys or emoji
+MESSAGES = [
+    'hi', 'Hello, I would like to order a pizza', 'what time is it?', 'yes', 'no thanks',
+    'show me flights to London tomorrow at 10:30', 'help', '/intent/greeting/', 'ok :)', 'that is bad :(',
+    'Dobrý den, chtěl bych si objednat pizzu', 'kolik to stojí?', 'díky (y)', 'I love it <3',
+    'great \U0001f44d', '\U0001f602\U0001f602\U0001f602', 'see you :D', 'Ďakujem pekne \U0001f600',
+    'can you send me the menu?', 'where is the nearest restaurant',
+]
+
+
+def legacy_parse_additional_entities(text):
+    entities = {}
+    chars = {':)': ':slightly_smiling_face:', '(y)': ':thumbs_up_sign:', ':(': ':disappointed_face:',
+             ':*': ':kissing_face:', ':O': ':face_with_open_mouth:', ':D': ':grinning_face:',
+             '<3': ':heavy_black_heart:️', ':P': ':face_with_stuck-out_tongue:'}
+    demojized = emoji.demojize(text)
+    char_emojis = re.compile(
+        r'(' + '|'.join(chars.keys()).replace('(', r'\(').replace(')', r'\)').replace('*', r'\*') + r')')
+    demojized = char_emojis.sub(lambda x: chars[x.group()], demojized)
+    if demojized != text:
+        match = re.compile(r':([a-zA-Z_0-9]+):')
+        for emoji_name in re.findall(match, demojized):
+            if 'emoji' not in entities:
+                entities['emoji'] = []
+            entities['emoji'].append({'value': emoji_name})
+    return entities
+
+
+def run(repeat=200) -> dict:
+    def parse_all(fn):
+        for message in MESSAGES:
+            fn(message)
+
+    return {
+        'messages': len(MESSAGES),
+        'legacy_ms': measure(lambda: parse_all(legacy_parse_additional_entities), repeat),
+        'precompiled_ms': measure(lambda: parse_all(parse_additional_entities), repeat),
+    }
@@ -1,5 +1,8 @@
 import logging
 import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import islice
 from typing import Union
 
 from collections import Iterable
@@ -8,28 +11,36 @@ from functools import reduce
 from golem.core.entity_query import EntityQuery
 from golem.core.entity_value import EntityValue
 
+logger = logging.getLogger(__name__)
+
 
 class Context(object):
 
-    def __init__(self, dialog, entities, history, counter, max_depth=30, history_restart_minutes=30):
+    def __init__(self, dialog, entities, history, counter, max_depth=30, history_restart_minutes=30,
+                 entity_depths=None):
         self.counter = counter
         self.entities = entities
         self.history = history
         self.max_depth = max_depth
+        self.entity_depths = entity_depths or {}  # entity name -> max number of values kept, overrides max_depth
         self.dialog = dialog
         self.history_restart_minutes = history_restart_minutes
+        self.changes = []  # added values and cleared entities since last save, see add_value() and clear()
+        self._indexes = {}  # entity name -> EntityIndex
 
     def __getattr__(self, item):
-        if item in ['counter', 'entities', 'history', 'max_depth', 'dialog', 'history_restart_minutes']:
+        if item in ['counter', 'entities', 'history', 'max_depth', 'entity_depths', 'dialog', 'history_restart_minutes',
+                    'changes', '_indexes']:
             return super().__getattribute__(item)
-        return EntityQuery(self, item, self.entities.get(item, []))
+        return EntityQuery(self, item, self.entities.get(item, []), ordered=True)
 
     def __setattr__(self, key, value):
-        if key in ['counter', 'entities', 'history', 'max_depth', 'dialog', 'history_restart_minutes']:
+        if key in ['counter', 'entities', 'history', 'max_depth', 'entity_depths', 'dialog', 'history_restart_minutes',
+                    'changes', '_indexes']:
             return super().__setattr__(key, value)
         if not isinstance(value, EntityValue):
             value = EntityValue(self, key, value=value)
-        self.entities.setdefault(key, []).insert(0, value)
+        self.add_value(key, value)
 
     def __contains__(self, key: Union[str, Iterable]):
         if isinstance(key, str):
@@ -46,11 +57,12 @@ class Context(object):
         }
 
     @staticmethod
-    def from_dict(dialog, data):
+    def from_dict(dialog, data, max_depth=30, entity_depths=None):
         history = data.get("history", [])
         counter = int(data.get("counter", 0))
         entities = data.get("entities", {})
-        return Context(dialog=dialog, entities=entities, history=history, counter=counter)
+        return Context(dialog=dialog, entities=entities, history=history, counter=counter, max_depth=max_depth,
+                       entity_depths=entity_depths)
 
     def add_entities(self, new_entities):
         if new_entities is None:
@@ -77,14 +89,43 @@ class Context(object):
 
         if 'value' in entity_dict:
             entity = EntityValue(self, entity_name, raw=entity_dict)
-            self.entities.setdefault(entity_name, []).insert(0, entity)
+            self.add_value(entity_name, entity)
 
         if 'values' in entity_dict:  # compound entities
             for item in entity_dict['values']:
                 for role, entity in item.items():
                     canon_name = entity_name + "__" + role
                     entity = EntityValue(self, canon_name, value=entity)
-                    self.entities.setdefault(canon_name, []).insert(0, entity)
+                    self.add_value(canon_name, entity)
+
+    def add_value(self, entity_name, entity: EntityValue):
+        """Prepends a value to values of an entity, all new values should be added using this method."""
+        values = self.entities.get(entity_name)
+        if not isinstance(values, EntityHistory):
+            # values loaded from storage are plain lists
+            values = self.entities[entity_name] = EntityHistory(values or (), self.get_max_depth(entity_name))
+        values.appendleft(entity)
+        self.changes.append((entity_name, entity))
+
+    def get_max_depth(self, entity_name) -> int:
+        """Returns the max number of values of an entity that are kept."""
+        return self.entity_depths.get(entity_name, self.max_depth)
+
+    def get_index(self, entity_name) -> 'EntityIndex':
+        """Returns index of values of an entity by message counter, it's rebuilt when the values change."""
+        values = self.entities.get(entity_name, [])
+        index = self._indexes.get(entity_name)
+        if index is None or not index.is_valid(values):
+            index = self._indexes[entity_name] = EntityIndex(values)
+        return index
+
+    def trim(self):
+        """Drops values of entities older than max_depth, lazily loaded entities are left as they are."""
+        entities = getattr(self.entities, 'decoded', self.entities)
+        for entity_name, values in entities.items():
+            max_depth = self.get_max_depth(entity_name)
+            if len(values) > max_depth:
+                entities[entity_name] = EntityHistory(values, max_depth)
 
     def add_state(self, state_name):
         timestamp = int(time.time())
@@ -101,6 +142,7 @@ class Context(object):
         for entity in entities:
             if entity in self.entities:
                 del self.entities[entity]
+                self.changes.append((entity, None))
 
     def get_min_entity_age(self, entities):
         ages = [self.get_age(entity)[1] for entity in entities]
@@ -116,9 +158,20 @@ class Context(object):
         return self.dialog.current_state_name
         # return self.history[-1] if len(self.history) > 0 else None
 
+    def is_outdated(self, entity, max_age) -> bool:
+        """
+        Checks whether all values of an entity are older than max_age.
+        Lazily loaded entities are checked without being decoded, otherwise it returns False.
+        """
+        latest_counter = getattr(self.entities, 'latest_counter', None)
+        if max_age is None or latest_counter is None:
+            return False
+        latest = latest_counter(entity)
+        return latest is None or self.counter - latest > max_age
+
     def get_all(self, entity, max_age=None, limit=None, ignored_values=tuple()) -> list:
         values = []
-        if entity not in self.entities:
+        if entity not in self.entities or self.is_outdated(entity, max_age):
             return values
         for entity_obj in self.entities[entity]:  # type: EntityValue
             age = self.counter - entity_obj.counter
@@ -127,7 +180,7 @@ class Context(object):
                 break
             v = entity_obj.value
             if v in ignored_values:
-                logging.info('Skipping ignored entity value: {} == {}'.format(entity, v))
+                logger.debug('Skipping ignored entity value: %s == %s', entity, v)
                 continue
 
             values.append(entity_obj)
@@ -136,14 +189,41 @@ class Context(object):
                 break
         return values
     
-    def debug(self, max_age=5):
-        logging.info('-- HEAD of Context (max age {}): --'.format(max_age))
-        for entity in self.entities:
-            entities = self.get_all_first(entity, max_age=max_age)
-            if entities:
-                vs = [entity.value for entity in entities]
-                logging.info('{} (age {}): {}'.format(entity, self.counter - entities[0].counter, vs if len(vs) > 1 else vs[0]))
-        logging.info('----------------------------------')
+    def debug(self, max_age=5, level=logging.DEBUG):
+        """Logs values of the latest message of each entity, if the logger is enabled for the level."""
+        if not logger.isEnabledFor(level):
+            return
+        logger.log(level, '-- HEAD of Context (max age %s): --', max_age)
+        for entity, values in self.snapshot(max_age=max_age, first_only=True)['entities'].items():
+            vs = [value['value'] for value in values]
+            logger.log(level, '%s (age %d): %s', entity, values[0]['age'], vs if len(vs) > 1 else vs[0])
+        logger.log(level, '----------------------------------')
+
+    def snapshot(self, max_age=None, first_only=False) -> dict:
+        """
+        Returns a dict describing the context, for debugging and inspecting chats.
+        :param max_age:     skip values older than max_age messages
+        :param first_only:  include just the values set in the latest message of each entity
+        """
+        entities = {}
+        for entity in list(self.entities):
+            if first_only:
+                values = self.get_all_first(entity, max_age=max_age)
+            else:
+                values = self.get_all(entity, max_age=max_age)
+            if values:
+                entities[entity] = [{
+                    'value': value.value,
+                    'age': self.counter - value.counter,
+                    'counter': value.counter,
+                    'state_set': value.state_set,
+                    'timestamp': value.timestamp,
+                } for value in values]
+        return {
+            'counter': self.counter,
+            'history': list(self.history),
+            'entities': entities,
+        }
 
     def get(self, entity, max_age=None, ignored_values=tuple()) -> EntityValue or None:
         values = self.get_all(entity, max_age=max_age, limit=1, ignored_values=ignored_values)
@@ -152,7 +232,7 @@ class Context(object):
         return values[0]
 
     def get_value(self, entity, max_age=None, ignored_values=tuple()) -> object:
-        values = self.get_all(entity, max_age, ignored_values)
+        values = self.get_all(entity, max_age=max_age, limit=1, ignored_values=ignored_values)
         if not values:
             return None
         return values[0].value
@@ -165,7 +245,7 @@ class Context(object):
 
     def get_all_first(self, entity_name, max_age=None):
         values = []
-        if entity_name not in self.entities:
+        if entity_name not in self.entities or self.is_outdated(entity_name, max_age):
             return values
         found_age = None
         existing = []
@@ -189,13 +269,11 @@ class Context(object):
             raise ValueError('Use a dict to set a context value, e.g. {"value":"foo"}. Call multiple times to add more.')
         value_dict['counter'] = self.counter
         entity_obj = EntityValue(self, entity_name, raw=value_dict)
-        self.entities.setdefault(entity_name, []).insert(0, entity_obj)
-        self.entities[entity_name] = self.entities[entity_name][:self.max_depth - 1]
+        self.add_value(entity_name, entity_obj)
 
     def set_value(self, entity_name, value):
         entity_obj = EntityValue(self, entity_name, value=value)
-        self.entities.setdefault(entity_name, []).insert(0, entity_obj)
-        self.entities[entity_name] = self.entities[entity_name][:self.max_depth - 1]
+        self.add_value(entity_name, entity_obj)
 
     def has_any(self, entities, max_age=None):  # TODO
         for entity in entities:
@@ -208,3 +286,61 @@ class Context(object):
             if not self.get(entity, max_age=max_age):
                 return False
         return True
+
+
+class EntityHistory(deque):
+    """
+    Values of an entity, newest first. Adding a value with appendleft() is O(1),
+    and the oldest value is dropped once there are maxlen values.
+    """
+
+    def __init__(self, values=(), maxlen=None):
+        # keep the newest values, the deque would keep the last ones
+        super().__init__(islice(values, maxlen) if maxlen is not None else values, maxlen)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step is None and (index.start or 0) >= 0 and (index.stop is None or index.stop >= 0):
+                return list(islice(self, index.start, index.stop))
+            return list(self)[index]
+        return super().__getitem__(index)
+
+    def __reduce__(self):
+        return self.__class__, (list(self), self.maxlen)
+
+
+class EntityIndex:
+    """
+    Index of values of an entity by message counter.
+    Values are stored newest first, so their counters are non-increasing and can be bisected.
+    """
+
+    def __init__(self, values: list):
+        self.values = values
+        self.length = len(values)
+        self.newest = values[0] if values else None
+        self.by_counter = {}
+        for entity in values:
+            self.by_counter.setdefault(entity.counter, []).append(entity)
+        # negated counters are in ascending order, as bisect needs
+        self.neg_counters = [-entity.counter for entity in values]
+        self.is_sorted = all(a <= b for a, b in zip(self.neg_counters, self.neg_counters[1:]))
+
+    def is_valid(self, values: list) -> bool:
+        """Checks whether the index was built from a list of values, and they haven't been added or removed since."""
+        # histories drop the oldest value when a new one is added, so the newest one is compared too
+        return values is self.values and len(values) == self.length and (not values or values[0] is self.newest)
+
+    def at(self, counter) -> list:
+        """Returns values set at a message counter."""
+        return self.by_counter.get(counter, [])
+
+    def newer_than(self, counter) -> list:
+        """Returns values with counter greater than a counter, newest first."""
+        return self.values[:bisect_left(self.neg_counters, -counter)]
+
+    def older_than(self, counter) -> list:
+        return self.values[bisect_right(self.neg_counters, -counter):]
+
+    def exactly(self, counter) -> list:
+        return self.values[bisect_left(self.neg_counters, -counter):bisect_right(self.neg_counters, -counter)]
@@ -2,90 +2,99 @@ import json
 import logging
 import time
 
-import os
 from django.conf import settings
 
 from golem.core.chat_session import ChatSession
 from golem.core.responses import LinkButton
 from golem.core.responses.responses import TextMessage
 from golem.tasks import accept_inactivity_callback, accept_schedule_callback
+from . import metrics
 from .context import Context
-from .flow import load_flows_from_definitions
+from .flow_registry import get_flow_registry, read_flow_definitions
 from .logger import MessageLogging
-from .persistence import get_redis
-from .serialize import json_deserialize, json_serialize
+from .logging.chat_log import ChatLogger
+from .persistence import SessionStore, get_round_trips, get_session_store, reset_round_trips
+from .serialize import apply_context_deltas, dumps_context, dumps_context_delta, loads_context
 from .tests import ConversationTestRecorder
 
+logger = logging.getLogger(__name__)
+
 
 class DialogManager:
     version = '1.34'
 
-    def __init__(self, session: ChatSession):
+    def __init__(self, session: ChatSession, store: SessionStore = None):
         self.session = session
         self.uid = session.chat_id  # for backwards compatibility
         self.logger = MessageLogging(self)
-        self.db = get_redis()
+        self.log = ChatLogger(logger, session.chat_id, stage='init')
+        self.store = store or get_session_store()  # type: SessionStore
         self.context = None  # type: Context
+        self.defer_saving = False  # if True, save_state() just marks the state as changed
+        self.save_pending = False
+        self.active_time = None
+        reset_round_trips()
 
         self.should_log_messages = settings.GOLEM_CONFIG.get('SHOULD_LOG_MESSAGES', False)
         self.error_message_text = settings.GOLEM_CONFIG.get('ERROR_MESSAGE_TEXT')
+        self.lazy_context = settings.GOLEM_CONFIG.get('CONTEXT_LAZY_LOADING', False)
+        # save just the changes of context, and the whole context once in a number of saves
+        self.delta_persistence = settings.GOLEM_CONFIG.get('CONTEXT_DELTA_PERSISTENCE', False)
+        self.compact_after = settings.GOLEM_CONFIG.get('CONTEXT_COMPACT_AFTER', 20)
+        self.context_log_length = None  # number of deltas saved since the whole context, None if not saved yet
+        self.max_depth = settings.GOLEM_CONFIG.get('CONTEXT_MAX_DEPTH', 30)
+        self.entity_depths = settings.GOLEM_CONFIG.get('CONTEXT_ENTITY_DEPTHS', {})
 
         context_dict = {}
-        version = self.db.get('dialog_version')
-        logging.info('Initializing dialog for chat %s...' % session.chat_id)
+        stored = self.store.load_session(self.session.chat_id)
+        self.log.debug('Initializing dialog')
         self.current_state_name = None
         self.init_flows()
 
-        if version and version.decode('utf-8') == DialogManager.version and \
-                self.db.hexists('session_context', self.session.chat_id):
+        if stored['version'] == DialogManager.version and stored['context'] is not None:
 
-            state = self.db.hget('session_state', self.session.chat_id).decode('utf-8')
-            logging.info('Session exists at state %s' % state)
+            state = stored['state']
+            self.log.debug('Session exists at state %s', state)
 
             if not state:
-                logging.error("State was NULL, sending user to default.root!")
+                self.log.error("State was NULL, sending user to default.root!")
                 state = 'default.root'
             elif state.endswith(':'):
                 state = state[:-1]  # to avoid infinite loop
 
             self.move_to(state, initializing=True)
-            context_string = self.db.hget('session_context', self.session.chat_id)
-            context_dict = json.loads(context_string.decode('utf-8'), object_hook=json_deserialize)
+            context_dict = loads_context(stored['context'], lazy=self.lazy_context)
+            if stored['log']:
+                apply_context_deltas(context_dict, stored['log'],
+                                     lambda name: self.entity_depths.get(name, self.max_depth))
+            # a session loaded from a legacy layout is migrated by saving the whole context
+            self.context_log_length = None if stored.get('legacy') else len(stored['log'])
         else:
             self.current_state_name = 'default.root'
-            logging.info('Creating new session...')
+            self.log.info('Creating new session')
             self.logger.log_user(self.session)
 
 
-        self.context = Context.from_dict(dialog=self, data=context_dict)  # type: Context
+        self.context = Context.from_dict(dialog=self, data=context_dict, max_depth=self.max_depth,
+                                         entity_depths=self.entity_depths)  # type: Context
+        self.log.extra['state'] = self.current_state_name
 
     def init_flows(self):
-        flow_definitions = self.create_flows()
-        self.flows = load_flows_from_definitions(flow_definitions)
+        self.flow_registry = get_flow_registry()
+        self.flows = self.flow_registry.flows
         self.current_state_name = 'default.root'
 
     def create_flows(self):
-        import yaml
-        flows = {}  # a dict with all the flows loaded from YAML
-        BOTS = settings.GOLEM_CONFIG.get('BOTS', [])
-        for filename in BOTS:
-            try:
-                with open(os.path.join(settings.BASE_DIR, filename)) as f:
-                    file_flows = yaml.load(f)
-                    for flow in file_flows:
-                        if flow in flows:
-                            raise Exception("Error: duplicate flow {}".format(flow))
-                        flows[flow] = file_flows[flow]
-                        flows[flow]['relpath'] = os.path.dirname(filename)  # directory of relative imports
-            except OSError as e:
-                raise ValueError("Unable to open definition {}".format(filename)) from e
-        return flows
+        return read_flow_definitions()
+
+    @property
+    def db(self):
+        """The session store, for backwards compatibility."""
+        return self.store
 
     @staticmethod
-    def clear_chat(chat_id):
-        db = get_redis()
-        db.hdel('session_state', chat_id)
-        db.hdel('session_context', chat_id)
+    def clear_chat(chat_id, store: SessionStore = None):
+        (store or get_session_store()).delete_session(chat_id)
 
     def process(self, message_type, entities):
         self.session.interface.processing_start(self.session)
@@ -95,47 +104,56 @@ class DialogManager:
         if message_type not in ['message', 'postback', 'schedule']:
             return
 
-        logging.info('>>> Received user message')
+        self.log.extra['stage'] = 'receive'
+        self.log.debug('Received user message')
 
-        # if message_type != 'schedule':
-        # TODO don't increment when @ requires -> input and it's valid
-        # TODO what to say and do on invalid requires -> input?
-        self.context.counter += 1
+        # save the state just once after the whole message is processed
+        self.defer_saving = True
+        try:
+            # if message_type != 'schedule':
+            # TODO don't increment when @ requires -> input and it's valid
+            # TODO what to say and do on invalid requires -> input?
+            self.context.counter += 1
 
-        entities = self.context.add_entities(entities)
-        # remove keys with empty values
-        entities = {k: v for k, v in entities.items() if v is not None}
+            entities = self.context.add_entities(entities)
+            # remove keys with empty values
+            entities = {k: v for k, v in entities.items() if v is not None}
 
-        if self.test_record_message(message_type, entities):
-            return
-        elif self.special_message(message_type, entities):
-            return
+            if self.test_record_message(message_type, entities):
+                return
+            elif self.special_message(message_type, entities):
+                return
 
-        if message_type != 'schedule':
-            self.save_inactivity_callback()
+            if message_type != 'schedule':
+                self.save_inactivity_callback()
 
-        logging.info('>>> Processing message')
+            self.log.extra['stage'] = 'process'
+            self.log.debug('Processing message')
 
-        if not self.check_state_transition() \
-            and not self.check_intent_transition(entities) \
-            and not self.check_entity_transition(entities):
+            # the state doesn't change unless a transition is made, so check this just once
+            supported = self.get_state().is_supported(entities.keys())
+            if not self.check_state_transition() \
+                and not self.check_intent_transition(entities, supported=supported) \
+                and not self.check_entity_transition(entities, supported=supported):
 
-                if self.get_state().is_supported(entities.keys()):
-                    self.run_accept(save_identical=True)
-                    self.save_state()
-                else:
-                    # run 'unsupported' action of the state
-                    entities['_unsupported'] = [{"value": True}]
-
-                    if self.get_state().unsupported:
-                        self.run_action(self.get_state().unsupported)
-                    # if not provided, run 'unsupported' action of the flow
-                    elif self.get_flow().unsupported:
-                        self.run_action(self.get_flow().unsupported)
-                    # if not provided, give up and go to default.root
+                    if supported:
+                        self.run_accept(save_identical=True)
+                        self.save_state()
                     else:
-                        self.move_to("default.root:")
-                    self.save_state()
+                        # run 'unsupported' action of the state
+                        entities['_unsupported'] = [{"value": True}]
+
+                        if self.get_state().unsupported:
+                            self.run_action(self.get_state().unsupported)
+                        # if not provided, run 'unsupported' action of the flow
+                        elif self.get_flow().unsupported:
+                            self.run_action(self.get_flow().unsupported)
+                        # if not provided, give up and go to default.root
+                        else:
+                            self.move_to("default.root:")
+                        self.save_state()
+        finally:
+            self.flush_state()
 
         self.session.interface.processing_end(self.session)
 
@@ -143,7 +161,7 @@ class DialogManager:
         self.logger.log_user_message(message_type, entities, accepted_time, accepted_state)
 
     def schedule(self, callback_name, at=None, seconds=None):
-        logging.info('Scheduling callback "{}": at {} / seconds: {}'.format(callback_name, at, seconds))
+        self.log.info('Scheduling callback "%s": at %s / seconds: %s', callback_name, at, seconds)
         if at:
             if at.tzinfo is None or at.tzinfo.utcoffset(at) is None:
                 raise Exception('Use datetime with timezone, e.g. "from django.utils import timezone"')
@@ -154,13 +172,15 @@ class DialogManager:
             raise Exception('Specify either "at" or "seconds" parameter')
 
     def inactive(self, callback_name, seconds):
-        logging.info('Setting inactivity callback "{}" after {} seconds'.format(callback_name, seconds))
+        self.log.debug('Setting inactivity callback "%s" after %s seconds', callback_name, seconds)
         accept_inactivity_callback.apply_async(
             (self.session.to_json(), self.context.counter, callback_name, seconds),
             countdown=seconds)
 
     def save_inactivity_callback(self):
-        self.db.hset('session_active', self.session.chat_id, time.time())
+        # persisted with the rest of the state
+        self.active_time = time.time()
+        self.save_state()
         callbacks = settings.GOLEM_CONFIG.get('INACTIVE_CALLBACKS')
         if not callbacks:
             return
@@ -211,13 +231,13 @@ class DialogManager:
             self.run_action(requirement.action)
         else:
             if not state.action:
-                logging.warning('State {} does not have an action.'.format(self.current_state_name))
+                self.log.warning('State %s does not have an action.', self.current_state_name)
                 return
             self.run_action(state.action)
 
     def run_action(self, fn):
         if not callable(fn):
-            logging.error("Error: Trying to run a function of type {}".format(type(fn)))
+            self.log.error("Trying to run a function of type %s", type(fn))
             return
         # run the action
         retval = fn(dialog=self)
@@ -233,13 +253,15 @@ class DialogManager:
             return self.move_to(new_state_name)
         return False
 
-    def check_intent_transition(self, entities: dict):
+    def check_intent_transition(self, entities: dict, supported=None):
         """Checks if intent wasn't parsed from current message (and moves by intent)"""
         intent = self.context.intent.current_v()
         if not intent:
             return False
 
-        if self.get_state().is_supported(entities.keys()):
+        if supported is None:
+            supported = self.get_state().is_supported(entities.keys())
+        if supported:
             return False
 
         # move to the flow whose 'intent' field matches intent
@@ -250,37 +272,32 @@ class DialogManager:
 
         # Check accepted intent of all flows
         if not new_state_name:
-            for flow in self.flows.values():
-                if flow.matches_intent(intent):
-                    new_state_name = flow.name + '.root'
-                    break
+            new_state_name = self.flow_registry.get_state_for_intent(intent)
 
         if not new_state_name:
-            logging.error('Error! Found intent "%s" but no flow present for it!' % intent)
+            self.log.error('Found intent "%s" but no flow present for it!', intent)
             return False
 
-        logging.info('Moving based on intent %s...' % intent)
+        self.log.debug('Moving based on intent %s', intent)
         return self.move_to(new_state_name + ":")  # : runs the action
 
-    def check_entity_transition(self, entities: dict):
+    def check_entity_transition(self, entities: dict, supported=None):
         """ Checks if entity was parsed from current message (and moves if associated state exists)"""
         # FIXME somehow it also uses older entities
         # first check if supported, if yes, abort
-        if self.get_state().is_supported(entities.keys()):
+        if supported is None:
+            supported = self.get_state().is_supported(entities.keys())
+        if supported:
             return False
 
         # TODO check states of current flow for 'accepted' first
 
-        new_state_name = None
-
         # then check if there is a flow that would accept the entity
-        for flow in self.flows.values():
-            if flow.accepts_message(entities.keys()):
-                new_state_name = flow.name + '.root'  # TODO might use a state that accepts it instead?
-                break
+        # TODO might use a state that accepts it instead?
+        new_state_name = self.flow_registry.get_state_for_entities(entities.keys())
 
         if new_state_name:
-            logging.info("Moving by entity")
+            self.log.debug("Moving by entity")
             return self.move_to(new_state_name + ":")
 
         # AND THEN? a) default.root don't understand b) remain in the same state
@@ -292,17 +309,23 @@ class DialogManager:
     def get_flow(self, flow_name=None):
         """Returns a flow by name, or current flow if no name is specified."""
         if not flow_name:
+            resolved = self.flow_registry.resolve_state(self.current_state_name)
+            if resolved:
+                return resolved.flow
             flow_name, _ = self.current_state_name.split('.', 1)
         return self.flows.get(flow_name)
 
     def get_state(self, flow_state_name=None):
+        resolved = self.flow_registry.resolve_state(flow_state_name or self.current_state_name)
+        if resolved:
+            return resolved.state
         flow_name, state_name = (flow_state_name or self.current_state_name).split('.', 1)
         flow = self.get_flow(flow_name)
         return flow.get_state(state_name) if flow else None
 
     def move_to(self, new_state_name, initializing=False, save_identical=False):
         """Moves to a state by its full name."""
-        logging.info("Trying to move to {}".format(new_state_name))
+        self.log.debug("Trying to move to %s", new_state_name)
 
         # if flow prefix is not present, add the current one
         if isinstance(new_state_name, int):
@@ -311,16 +334,14 @@ class DialogManager:
         if not new_state_name:
             new_state_name = self.current_state_name
 
-        if new_state_name.count(':'):
-            new_state_name, action = new_state_name.split(':', 1)
-            action = True
+        current = self.flow_registry.resolve_state(self.current_state_name)
+        resolved = self.flow_registry.resolve_state(new_state_name, current.flow.name if current else None)
+        if resolved:
+            new_state_name, action = resolved.name, resolved.run_action
         else:
-            action = False
-
-        if ('.' not in new_state_name):
-            new_state_name = self.current_state_name.split('.')[0] + '.' + new_state_name
+            new_state_name, action = self._parse_state_name(new_state_name)
         if not self.get_state(new_state_name):
-            logging.warning('Error: State %s does not exist! Staying at %s.' % (new_state_name, self.current_state_name))
+            self.log.warning('State %s does not exist! Staying at %s.', new_state_name, self.current_state_name)
             return False
         identical = new_state_name == self.current_state_name
         if not initializing and (not identical or save_identical):
@@ -329,6 +350,7 @@ class DialogManager:
             return False
         previous_state = self.current_state_name
         self.current_state_name = new_state_name
+        self.log.extra['state'] = new_state_name
         if not initializing:
 
             # notify the interface that the state was changed
@@ -339,33 +361,31 @@ class DialogManager:
 
             try:
                 if previous_state != new_state_name and action:
-                    logging.info("Moving from {} to {} and executing action".format(
-                        previous_state, new_state_name
-                    ))
+                    self.log.info("Moving from %s to %s and executing action", previous_state, new_state_name)
                     self.run_accept()
                 elif action:
-                    logging.info("Staying in state {} and executing action".format(previous_state))
+                    self.log.info("Staying in state %s and executing action", previous_state)
                     self.run_accept()
                 elif previous_state != new_state_name:
-                    logging.info("Moving from {} to {} and doing nothing".format(previous_state, new_state_name))
+                    self.log.info("Moving from %s to %s and doing nothing", previous_state, new_state_name)
                 else:
-                    logging.info("Staying in state {} and doing nothing".format(previous_state))
+                    self.log.debug("Staying in state %s and doing nothing", previous_state)
 
             except Exception as e:
 
                 context_debug = "(can't load context)"
                 try:
-                    context_debug = self.context.debug()
+                    context_debug = self.context.snapshot(max_age=5, first_only=True)['entities']
                 except:
                     pass
 
-                logging.exception(
+                self.log.exception(
                               '*****************************************************\n'
-                              'Exception occurred while running action {} of state {}\n'
-                              'Chat id: {}\n'
-                              'Context: {}\n'
-                              '*****************************************************'
-                              .format(action, new_state_name, self.session.chat_id, context_debug)
+                              'Exception occurred while running action %s of state %s\n'
+                              'Chat id: %s\n'
+                              'Context: %s\n'
+                              '*****************************************************',
+                              action, new_state_name, self.session.chat_id, context_debug
                 )
 
                 if self.error_message_text:
@@ -378,19 +398,57 @@ class DialogManager:
         self.save_state()
         return True
 
+    def _parse_state_name(self, name):
+        """:return: (full state name, whether to run its action) of names that are not resolved by the registry"""
+        if name.count(':'):
+            name, _ = name.split(':', 1)
+            action = True
+        else:
+            action = False
+        if '.' not in name:
+            name = self.current_state_name.split('.')[0] + '.' + name
+        return name, action
+
     def save_state(self):
         if not self.context:
             return
-        logging.info('Saving state at %s' % (self.current_state_name))
-        self.db.hset('session_state', self.session.chat_id, self.current_state_name)
-        context_json = json.dumps(self.context.to_dict(), default=json_serialize)
-        self.db.hset('session_context', self.session.chat_id, context_json)
-        self.db.hset('session_interface', self.session.chat_id, self.session.interface.name)
-        self.db.set('dialog_version', DialogManager.version)
-
-        # save chat session to redis, TODO
-        session = json.dumps(self.session.to_json())
-        self.db.hset("chat_session", self.session.chat_id, session)
+        if self.defer_saving:
+            self.save_pending = True
+            return
+        self.log.debug('Saving state at %s', self.current_state_name)
+        fields = {
+            'version': DialogManager.version,
+            'state': self.current_state_name,
+            'interface': self.session.interface.name,
+            'session': json.dumps(self.session.to_json()),
+        }
+        if self.active_time is not None:
+            fields['active'] = self.active_time
+            self.active_time = None
+        log_entry = None
+        if self.delta_persistence and self.context_log_length is not None \
+                and self.context_log_length < self.compact_after:
+            log_entry = dumps_context_delta(self.context.counter, self.context.history, self.context.changes)
+            metrics.observe('context.delta_size_bytes', len(log_entry))
+            self.context_log_length += 1
+        else:
+            # compact the log into a new snapshot of the whole context
+            self.context.trim()
+            fields['context'] = dumps_context(self.context.to_dict())
+            metrics.observe('context.size_bytes', len(fields['context']))
+            self.context_log_length = 0
+        self.store.save_session(self.session.chat_id, fields, log_entry=log_entry)
+        self.context.changes = []
+
+    def flush_state(self):
+        """Stops deferring saves and saves the state if it has changed since."""
+        self.defer_saving = False
+        if self.save_pending:
+            self.save_pending = False
+            self.save_state()
+        round_trips = get_round_trips()
+        metrics.observe('redis.round_trips_per_message', round_trips)
+        self.log.debug('Processed message with %d Redis round trips', round_trips)
 
     def send_response(self, responses):
         """
@@ -401,7 +459,8 @@ class DialogManager:
         if responses is None:
             return
 
-        logging.info('>>> Sending chatbot message')
+        self.log.extra['stage'] = 'respond'
+        self.log.debug('Sending chatbot message')
 
         if not (isinstance(responses, list) or isinstance(responses, tuple)):
             return self.send_response([responses])
@@ -431,7 +490,7 @@ class DialogManager:
         utterance = self.context.get("_message_text", max_age=0)
         nlu = golem_extractor.GOLEM_NLU
         if not nlu or not utterance:
-            print("NLU instance and message text can't be None")
+            self.log.warning("NLU instance and message text can't be None")
             return
         intent = nlu.parse_entity(utterance, 'intent', threshold=0.5)
         if intent:
@@ -1,13 +1,26 @@
-import time
-
 import re
+import time
+from itertools import chain
+from datetime import timedelta
 
 
 class EntityQuery:
-    def __init__(self, context, name, items):
+    """
+    Query of entity values in context. Filters are applied lazily as generators,
+    so that latest(), current() and truth testing only evaluate them up to the first match.
+    """
+
+    def __init__(self, context, name, items, ordered=False):
+        """
+        :param context:  Context of the values
+        :param name:     entity name
+        :param items:    iterable of EntityValue
+        :param ordered:  whether the items are newest first, as context stores them
+        """
         self.context = context
         self.name = name or ""
         self.items = items or []
+        self.ordered = ordered
 
     # TODO filter by roles
 
@@ -24,13 +37,16 @@ class EntityQuery:
             raise ValueError("Please use either message count, timedelta or absolute time")
         if messages is not None:
             counter_now = self.context.counter
-            self.items = filter(lambda x: counter_now - x.counter < messages, self.items)
+            index = self._get_index()
+            if index:
+                self.items = index.newer_than(counter_now - messages)
+            else:
+                self.items = (x for x in self.items if counter_now - x.counter < messages)
         elif delta is not None:
             time_min = time.time() - delta.total_seconds()
-            self.items = filter(lambda x: x.timestamp > time_min, self.items)
+            self.items = (x for x in self.items if x.timestamp > time_min)
         elif abs_time is not None:
-            self.items = filter(lambda x: x.timestamp > abs_time, self.items)
-        self.items = list(self.items)
+            self.items = (x for x in self.items if x.timestamp > abs_time)
         return self
 
     def older_than(self, messages=None, delta=None, abs_time=None):
@@ -46,13 +62,16 @@ class EntityQuery:
             raise ValueError("Please use either message count, timedelta or absolute time")
         if messages is not None:
             counter_now = self.context.counter
-            self.items = filter(lambda x: counter_now - x.counter > messages, self.items)
+            index = self._get_index()
+            if index:
+                self.items = index.older_than(counter_now - messages)
+            else:
+                self.items = (x for x in self.items if counter_now - x.counter > messages)
         elif delta is not None:
             time_max = time.time() - delta.total_seconds()
-            self.items = filter(lambda x: x.timestamp < time_max, self.items)
+            self.items = (x for x in self.items if x.timestamp < time_max)
         elif abs_time is not None:
-            self.items = filter(lambda x: x.timestamp < abs_time, self.items)
-        self.items = list(self.items)
+            self.items = (x for x in self.items if x.timestamp < abs_time)
         return self
 
     def exactly(self, messages=None, delta=None, abs_time=None):
@@ -68,57 +87,68 @@ class EntityQuery:
             raise ValueError("Please use either message count, timedelta or absolute time")
         if messages is not None:
             counter_now = self.context.counter
-            self.items = filter(lambda x: counter_now - x.counter == messages, self.items)
+            index = self._get_index()
+            if index:
+                self.items = index.exactly(counter_now - messages)
+            else:
+                self.items = (x for x in self.items if counter_now - x.counter == messages)
         elif delta is not None:
             time_max = time.time() - delta.total_seconds()
-            self.items = filter(lambda x: abs(x.timestamp - time_max) < 1.0, self.items)
+            self.items = (x for x in self.items if abs(x.timestamp - time_max) < 1.0)
         elif abs_time is not None:
-            self.items = filter(lambda x: abs(x.timestamp - abs_time) < 1.0, self.items)
-        self.items = list(self.items)
+            self.items = (x for x in self.items if abs(x.timestamp - abs_time) < 1.0)
         return self
 
-    def include_flow(self, regex: str):
-        """Include just entities that were set in a state that matches the regex."""
-        self.items = list(filter(lambda x: re.match(regex, x.state_set), self.items))
+    def include_flow(self, regex):
+        """Include just entities that were set in a state that matches the regex (a string or compiled pattern)."""
+        pattern = re.compile(regex)
+        self.items = (x for x in self.items if pattern.match(x.state_set))
         return self
 
-    def exclude_flow(self, regex: str):
-        """Exclude all entities that were set in a state that matches the regex."""
-        self.items = list(filter(lambda x: re.match(regex, x.state_set) is None, self.items))
+    def exclude_flow(self, regex):
+        """Exclude all entities that were set in a state that matches the regex (a string or compiled pattern)."""
+        pattern = re.compile(regex)
+        self.items = (x for x in self.items if pattern.match(x.state_set) is None)
         return self
 
+    def _get_index(self):
+        """Returns index of the items if they are all values of the entity, as stored in context."""
+        if self.name not in self.context.entities or self.items is not self.context.entities[self.name]:
+            return None
+        index = self.context.get_index(self.name)
+        return index if index.is_sorted else None
+
+    def _is_set_with(self, item, index, value) -> bool:
+        return any(entity.value == value for entity in index.at(item.counter))
+
     def set_with(self, entity: str, value):
-        # FIXME make lookups by age effective
-        filtered = []
-        for item in self.items:
-            counter = item.counter
-            entity_arr = self.context.entities.get(entity, [])
-            for entity in entity_arr:
-                if entity.counter == counter and entity.value == value:
-                    filtered.append(item)
-                    break
-        self.items = filtered
+        """Filter to values set in the same message as a value of another entity."""
+        index = self.context.get_index(entity)
+        self.items = (item for item in self.items if self._is_set_with(item, index, value))
         return self
 
     def not_set_with(self, entity: str, value):
-        # FIXME make lookups by age effective
-        filtered = []
-        for item in self.items:
-            counter = item.counter
-            entity_arr = self.context.entities.get(entity, [])
-            has_match = False
-            for entity in entity_arr:
-                if entity.counter == counter and entity.value == value:
-                    has_match = True
-                    break
-            if not has_match:
-                filtered.append(entity)
-        self.items = filtered
+        """Filter to values not set in the same message as a value of another entity."""
+        index = self.context.get_index(entity)
+        self.items = (item for item in self.items if not self._is_set_with(item, index, value))
         return self
 
+    def _first(self):
+        """Returns the first item without consuming the others, evaluating lazy filters only up to it."""
+        if isinstance(self.items, list):
+            return self.items[0] if self.items else None
+        iterator = iter(self.items)
+        for first in iterator:
+            self.items = chain((first,), iterator)
+            return first
+        self.items = []
+        return None
+
     def latest(self):
-        self.items = sorted(self.items, key=lambda x: x.timestamp, reverse=True)
-        return self.items[0] if len(self.items) > 0 else None
+        if self.ordered:
+            return self._first()
+        self.items = list(self.items)
+        return max(self.items, key=lambda x: x.timestamp, default=None)
 
     def latest_v(self):
         item = self.latest()
@@ -131,8 +161,10 @@ class EntityQuery:
         return self.latest_v()
 
     def get_age(self):
-        self.items = sorted(self.items, key=lambda x: x.timestamp, reverse=True)
-        return self.items[0].value, (self.items[0].counter - self.context.counter) if len(self.items) > 0 else None
+        item = self.latest()
+        if item is None:
+            return None, None
+        return item.value, item.counter - self.context.counter
 
     def current(self):
         item = self.latest()
@@ -143,6 +175,7 @@ class EntityQuery:
         return item.value if item else None
 
     def all(self):
+        self.items = list(self.items)
         return list(self.items)
 
     def all_v(self):
@@ -152,8 +185,10 @@ class EntityQuery:
         self.items = list(self.items)
         return len(self.items)
 
-    def __nonzero__(self):
-        return self.count() > 0
+    def __bool__(self):
+        return self._first() is not None
+
+    __nonzero__ = __bool__
 
     def __or__(self, other):
         # WARNING: This method allows you to mix up arbitrary entities and EntityValue subclasses!
@@ -163,6 +198,8 @@ class EntityQuery:
             raise ValueError("Refusing to do OR operation, other query's context is not the same")
 
         new_name = '|'.join([self.name, other.name])
+        # materialize the lazy filters first, so that both queries can still be used afterwards
+        self.items, other.items = list(self.items), list(other.items)
         new_items = set(self.items).union(other.items)
         return EntityQuery(self.context, new_name, new_items)
 
@@ -172,46 +209,94 @@ class EntityQuery:
         elif self.context != other.context:
             raise ValueError("Refusing to do OR operation, other query's context is not the same")
 
-        new_items = set(self.items).intersection(set(other.items))
+        self.items, other.items = list(self.items), list(other.items)
+        new_items = set(self.items).intersection(other.items)
         return EntityQuery(self.context, self.name, new_items)
 
 
     @staticmethod
     def from_yaml(context, name: str, yml: list):
-        # TODO catch and log errors
-        eq = EntityQuery(context, name, context.entities.get(name, []))
+        return PreparedFilter.from_yaml(yml).query(context, name)
+
+
+class PreparedFilter:
+    """
+    Entity filter compiled from its YAML definition, so that it can be applied to contexts repeatedly.
+    The definition is a list of single-key dicts, applied in order:
+
+    - or: list of filters, keeps values matching any of them
+    - set-with, not-set-with: "entity, value"
+    - include-flow, exclude-flow: regex of the state name the value was set in
+    - newer, older, exactly: number of messages, or a dict with messages, seconds, minutes, hours or days
+    """
+
+    def __init__(self, steps: list):
+        """
+        :param steps:   list of functions that apply a filter to an EntityQuery
+        """
+        self.steps = steps
+
+    @staticmethod
+    def from_yaml(yml: list) -> 'PreparedFilter':
+        steps = []
         for item in yml:
             key, values = list(item.items())[0]
             if key == 'or':
-                or_eq = None
-                for arg in values:
-                    if not isinstance(arg, list):
-                        arg = [arg]
-                    if or_eq:
-                        or_eq = or_eq.__or__(EntityQuery.from_yaml(context, name, arg))
-                    else:
-                        or_eq = EntityQuery.from_yaml(context, name, arg)
-                eq = eq and or_eq
-            elif key == 'set-with':
+                branches = [PreparedFilter.from_yaml(arg if isinstance(arg, list) else [arg]) for arg in values]
+                steps.append(PreparedFilter._make_or(branches))
+            elif key in ('set-with', 'not-set-with'):
                 entity, value = values.split(', ', maxsplit=1)
-                eq.set_with(entity, value)
-            elif key == 'not-set-with':
-                entity, value = values.split(', ', maxsplit=1)
-                eq.not_set_with(entity, value)
-            elif key == 'include-flow':
-                flow = values
-                eq.include_flow(flow)
-            elif key == 'exclude-flow':
-                flow = values
-                eq.exclude_flow(flow)
-            elif key == 'newer':
-                raise NotImplementedError("TO DO")
-            elif key == 'older':
-                raise NotImplementedError("TO DO")
-            elif key == 'exactly':
-                raise NotImplementedError("TO DO")
+                method = EntityQuery.set_with if key == 'set-with' else EntityQuery.not_set_with
+                steps.append(lambda eq, method=method, entity=entity, value=value: method(eq, entity, value))
+            elif key in ('include-flow', 'exclude-flow'):
+                regex = re.compile(values)
+                method = EntityQuery.include_flow if key == 'include-flow' else EntityQuery.exclude_flow
+                steps.append(lambda eq, method=method, regex=regex: method(eq, regex))
+            elif key in ('newer', 'older', 'exactly'):
+                kwargs = PreparedFilter._parse_age(values)
+                method = {'newer': EntityQuery.newer_than, 'older': EntityQuery.older_than,
+                          'exactly': EntityQuery.exactly}[key]
+                steps.append(lambda eq, method=method, kwargs=kwargs: method(eq, **kwargs))
+            else:
+                raise ValueError("Unknown entity filter {}".format(key))
+        return PreparedFilter(steps)
+
+    @staticmethod
+    def _make_or(branches: list):
+        def apply(eq):
+            items = list(eq.items)
+            matched = set()
+            for branch in branches:
+                branch_eq = branch.apply(EntityQuery(eq.context, eq.name, list(items), ordered=eq.ordered))
+                matched.update(id(item) for item in branch_eq.items)
+            # keep the original order of values
+            eq.items = [item for item in items if id(item) in matched]
+            return eq
+        return apply
+
+    @staticmethod
+    def _parse_age(value) -> dict:
+        """Returns keyword arguments of EntityQuery.newer_than() and the like."""
+        if isinstance(value, int):
+            return {'messages': value}
+        if isinstance(value, dict):
+            if 'messages' in value:
+                return {'messages': value['messages']}
+            try:
+                return {'delta': timedelta(**value)}
+            except TypeError as e:
+                raise ValueError("Invalid entity age {}".format(value)) from e
+        raise ValueError("Entity age must be a number of messages or a dict, got {}".format(value))
+
+    def apply(self, eq: EntityQuery) -> EntityQuery:
+        for step in self.steps:
+            step(eq)
         return eq
 
+    def query(self, context, name: str) -> EntityQuery:
+        """Returns a query of values of an entity in context, filtered by this filter."""
+        return self.apply(EntityQuery(context, name, context.entities.get(name, []), ordered=True))
+
 
 class MockQuery(EntityQuery):
     pass  # TODO for testing
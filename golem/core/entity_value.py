@@ -1,30 +1,97 @@
+import sys
 import time
 
+# Raw data of most entity values is just {'value': value}, so it is stored only when it differs.
+# _raw holds either the raw dict, RAW_VALUE for {'value': value} or RAW_EMPTY for {}.
+RAW_VALUE = None
+RAW_EMPTY = False
+
+
+def intern_name(name):
+    """Interns entity and state names, so that all values share a single copy of each."""
+    return sys.intern(name) if type(name) is str else name
+
+
+def compact_raw(raw, value):
+    """Returns the compact form of raw data of an entity value, see EntityValue._raw."""
+    if not raw:
+        return RAW_EMPTY
+    if len(raw) == 1 and 'value' in raw and raw['value'] is value:
+        return RAW_VALUE
+    return raw
+
 
 class EntityValue:
     """
     This class holds the value of a single entity in context.
     """
 
+    __slots__ = ('name', 'value', 'timestamp', 'counter', 'state_set', '_raw')
+
     def __init__(self, context, name, value=None, raw=None):
-        self.name = name
-        self.raw = raw or dict()  # type: dict
-        self.value = value or self.raw.get("value")
+        self.name = intern_name(name)
+        self.value = value or (raw.get("value") if raw else None)
+        self._raw = compact_raw(raw, self.value)
         self.timestamp = time.time()
         self.counter = context.counter
-        self.state_set = context.get_state_name() or ""
+        self.state_set = intern_name(context.get_state_name() or "")
+
+    @property
+    def raw(self) -> dict:
+        """Raw data returned by the parser, created on first access if it wasn't stored."""
+        if self._raw is RAW_VALUE:
+            self._raw = {'value': self.value}
+        elif self._raw is RAW_EMPTY:
+            self._raw = {}
+        return self._raw
+
+    @raw.setter
+    def raw(self, raw):
+        self._raw = compact_raw(raw, self.value)
 
     # Methods to access the raw data returned by parsers
 
     def get(self, key, default=None):
-        return self.raw.get(key, default)
+        if self._raw is RAW_VALUE:
+            return self.value if key == 'value' else default
+        elif self._raw is RAW_EMPTY:
+            return default
+        return self._raw.get(key, default)
 
     def __contains__(self, item):
-        return self.raw.__contains__(item)
+        if self._raw is RAW_VALUE:
+            return item == 'value'
+        elif self._raw is RAW_EMPTY:
+            return False
+        return self._raw.__contains__(item)
 
     def __getitem__(self, item):
+        if self._raw is RAW_VALUE and item == 'value':
+            return self.value
         return self.raw.__getitem__(item)
 
+    # Pickling, used by the legacy JSON context format
+
+    def __getstate__(self):
+        raw = self._raw
+        if raw is RAW_VALUE:
+            raw = {'value': self.value}
+        elif raw is RAW_EMPTY:
+            raw = {}
+        return {'name': self.name, 'raw': raw, 'value': self.value, 'timestamp': self.timestamp,
+                'counter': self.counter, 'state_set': self.state_set}
+
+    def __setstate__(self, state):
+        # values pickled before __slots__ were added have the same dict of attributes
+        if isinstance(state, tuple):
+            state = dict(state[0] or {}, **state[1])
+        self.name = intern_name(state['name'])
+        self.value = state['value']
+        self._raw = compact_raw(state.get('raw', state.get('_raw')), self.value)
+        self.timestamp = state['timestamp']
+        self.counter = state['counter']
+        self.state_set = intern_name(state['state_set'])
+
     # Common methods to access values
 
     def __str__(self):
@@ -4,6 +4,8 @@ import importlib
 import re
 from abc import abstractmethod, ABC
 
+from golem.core.entity_query import PreparedFilter
+from golem.core.intent_router import IntentRouter
 from golem.core.responses import AttachmentMessage
 
 
@@ -27,7 +29,7 @@ class State:
         self.intent = intent
         self.requires = requires
         self.is_temporary = is_temporary
-        self.supported = supported or set()
+        self.supported = frozenset(supported or ())
         self.unsupported = unsupported
 
     @staticmethod
@@ -179,6 +181,7 @@ class State:
         return True
 
     def is_supported(self, msg_entities: list) -> bool:
+        # isdisjoint iterates over the message entities, so it's O(#message entities)
         return not self.supported.isdisjoint(msg_entities)
 
     def __str__(self):
@@ -197,8 +200,9 @@ class Flow:
         self.name = str(name)
         self.states = states or {}
         self.intent = intent or self.name
-        self.accepted = set()
+        self.accepted = frozenset()
         self.unsupported = unsupported
+        self._intent_router = None
 
     @staticmethod
     def load(name, data: dict):
@@ -209,7 +213,7 @@ class Flow:
         if 'unsupported' in data:
             unsupported = State.make_action(data['unsupported'], relpath)
         flow = Flow(name=name, states=states, intent=intent, unsupported=unsupported)
-        flow.accepted = set(data.get('accepts', {}))
+        flow.accepted = frozenset(data.get('accepts', ()))
         return flow
 
     def __getitem__(self, state_name: str):
@@ -222,15 +226,17 @@ class Flow:
         """Adds a state to this flow."""
         if isinstance(state, State):
             self.states[state.name] = state
+            self._intent_router = None
             return self
         raise ValueError("Argument must be an instance of State")
 
     def get_state_for_intent(self, intent) -> str or None:
         """Returns name of the first state that receives an intent."""
-        for name, state in self.states.items():
-            if state.intent and re.match(state.intent, intent):
-                return self.name + "." + name
-        return None
+        if self._intent_router is None:
+            self._intent_router = IntentRouter(
+                (state.intent, self.name + "." + name) for name, state in self.states.items()
+            )
+        return self._intent_router.route(intent)
 
     def matches_intent(self, intent) -> bool:
         """Checks whether this flow accepts an intent."""
@@ -238,7 +244,7 @@ class Flow:
 
     def set_accepts(self, entity_name):
         """Add accepted entity."""
-        self.accepted.add(entity_name)
+        self.accepted = self.accepted.union([entity_name])
         return self
 
     def accepts_message(self, entities: list) -> bool:
@@ -263,6 +269,7 @@ class EntityRequirement(Requirement):
         self.slot = slot
         self.entity = entity
         self.filter = filter
+        self.prepared_filter = PreparedFilter.from_yaml(filter) if filter is not None else None
         self.action = action or dynamic_response_fn(message)
         if not self.action:
             raise ValueError("Requirement has no message nor action")
@@ -270,11 +277,8 @@ class EntityRequirement(Requirement):
     def matches(self, context) -> bool:
         if self.entity not in context:
             return False
-        if self.filter is not None:
-            from golem.core.entity_query import EntityQuery
-            # TODO move to new class PreparedFilter
-            eq = EntityQuery.from_yaml(context, self.entity, self.filter)
-            return eq.count() > 0
+        if self.prepared_filter is not None:
+            return bool(self.prepared_filter.query(context, self.entity))
         return True
 
 
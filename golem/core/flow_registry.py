@@ -0,0 +1,249 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from django.conf import settings
+
+from .flow import load_flows_from_definitions
+from .intent_router import FlowIntentRouter
+
+# state resolved from its name, run_action is True if the name ends with ':'
+ResolvedState = namedtuple('ResolvedState', ['name', 'flow', 'state', 'run_action'])
+
+
+class FlowRegistry:
+    """
+    Immutable snapshot of all flows compiled from the BOTS definition files.
+    It is built once per worker process and shared by all DialogManager instances.
+    """
+
+    def __init__(self, flows: dict, sources: dict, version: str, build_time: float, build_duration: float):
+        """
+        :param flows:           dict of flow name -> Flow
+        :param sources:         dict of definition file path -> mtime at build time
+        :param version:         content hash of the definition files
+        :param build_time:      unix timestamp of when the flows were compiled
+        :param build_duration:  how many seconds it took to compile the flows
+        """
+        self.flows = MappingProxyType(flows)
+        self.sources = MappingProxyType(sources)
+        self.version = version
+        self.build_time = build_time
+        self.build_duration = build_duration
+        self.intent_router = FlowIntentRouter((flow.intent, flow.name + '.root') for flow in flows.values())
+        self.entity_index_flows = tuple(flows.values())
+        self.entity_index = _build_entity_index(self.entity_index_flows)
+        self.resolved_states = _build_state_index(flows)
+
+    def get_flow(self, flow_name):
+        return self.flows.get(flow_name)
+
+    def resolve_state(self, name, flow_name=None) -> ResolvedState or None:
+        """
+        Resolves a state name as accepted by DialogManager.move_to().
+        :param name:        'flow.state' or 'flow.state:', or just 'state' or 'state:' if flow_name is given
+        :param flow_name:   flow of relative names, usually the current one
+        :return: ResolvedState or None if there is no such state
+        """
+        resolved = self.resolved_states.get(name)
+        if resolved is None and flow_name is not None:
+            resolved = self.resolved_states.get((flow_name, name))
+        return resolved
+
+    def get_state_for_intent(self, intent) -> str or None:
+        """Returns name of the root state of the first flow that accepts an intent."""
+        return self.intent_router.route(intent)
+
+    def get_state_for_entities(self, entity_names) -> str or None:
+        """Returns name of the root state of the first flow that accepts any of the entities."""
+        first = None
+        for entity_name in entity_names:
+            accepting = self.entity_index.get(entity_name)
+            if accepting and (first is None or accepting[0] < first):
+                first = accepting[0]
+        return self.entity_index_flows[first].name + '.root' if first is not None else None
+
+    def has_changed_files(self) -> bool:
+        """Checks whether any of the definition files was modified since the registry was built."""
+        return _get_mtimes(self.sources.keys()) != dict(self.sources)
+
+    def with_sources(self, sources: dict):
+        """Returns a registry sharing the compiled flows, but with updated file modification times."""
+        return FlowRegistry(
+            flows=dict(self.flows),
+            sources=sources,
+            version=self.version,
+            build_time=self.build_time,
+            build_duration=self.build_duration
+        )
+
+    def info(self) -> dict:
+        return {
+            'version': self.version,
+            'build_time': self.build_time,
+            'build_duration': self.build_duration,
+            'flows': len(self.flows),
+            'sources': dict(self.sources),
+        }
+
+    def __str__(self):
+        return "flow_registry:" + self.version
+
+
+def _build_entity_index(flows) -> dict:
+    """
+    Builds an index of entity name -> positions of flows that accept it, in order of the flows.
+    :param flows:   sequence of flows in order of priority
+    """
+    index = {}
+    for position, flow in enumerate(flows):
+        for entity_name in flow.accepted:
+            index.setdefault(entity_name, []).append(position)
+    return {entity_name: tuple(positions) for entity_name, positions in index.items()}
+
+
+def _build_state_index(flows: dict) -> dict:
+    """
+    Builds a map of every spelling of a state name to its ResolvedState.
+    Full names are the keys as they are, relative names are keyed by (flow name, name).
+    """
+    index = {}
+    for flow in flows.values():
+        for state_name, state in flow.states.items():
+            full_name = sys.intern(flow.name + '.' + state_name)
+            resolved = ResolvedState(full_name, flow, state, False)
+            with_action = ResolvedState(full_name, flow, state, True)
+            index[full_name] = resolved
+            index[full_name + ':'] = with_action
+            index[(flow.name, state_name)] = resolved
+            index[(flow.name, state_name + ':')] = with_action
+    return index
+
+
+def _get_mtimes(paths) -> dict:
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+def _get_bot_paths(filenames=None, base_dir=None) -> list:
+    if filenames is None:
+        filenames = settings.GOLEM_CONFIG.get('BOTS', [])
+    if base_dir is None and filenames:
+        base_dir = settings.BASE_DIR
+    return [(filename, os.path.join(base_dir, filename)) for filename in filenames]
+
+
+def _read_sources(bot_paths) -> dict:
+    contents = {}
+    for filename, path in bot_paths:
+        try:
+            with open(path, 'rb') as f:
+                contents[filename] = f.read()
+        except OSError as e:
+            raise ValueError("Unable to open definition {}".format(filename)) from e
+    return contents
+
+
+def _hash_sources(contents: dict) -> str:
+    digest = hashlib.sha1()
+    # BOTS might be a set, sort the files to get the same version in every process
+    for filename in sorted(contents):
+        digest.update(filename.encode('utf-8'))
+        digest.update(contents[filename])
+    return digest.hexdigest()[:12]
+
+
+def load_flow_definitions(contents: dict) -> dict:
+    """
+    Parses flow definitions from YAML.
+    :param contents:    dict of filename -> YAML file content
+    :return: dict of flow name -> flow definition
+    """
+    import yaml
+    flows = {}  # a dict with all the flows loaded from YAML
+    for filename, content in contents.items():
+        file_flows = yaml.safe_load(content)
+        for flow in file_flows:
+            if flow in flows:
+                raise Exception("Error: duplicate flow {}".format(flow))
+            flows[flow] = file_flows[flow]
+            flows[flow]['relpath'] = os.path.dirname(filename)  # directory of relative imports
+    return flows
+
+
+def read_flow_definitions(filenames=None, base_dir=None) -> dict:
+    """Reads and parses flow definitions from the definition files, without compiling them."""
+    return load_flow_definitions(_read_sources(_get_bot_paths(filenames, base_dir)))
+
+
+def build_flow_registry(filenames=None, base_dir=None) -> FlowRegistry:
+    """
+    Compiles all flows from the definition files.
+    :param filenames:   list of definition files, defaults to GOLEM_CONFIG['BOTS']
+    :param base_dir:    base directory of the definition files, defaults to BASE_DIR
+    :return: a new FlowRegistry
+    """
+    start_time = time.time()
+    bot_paths = _get_bot_paths(filenames, base_dir)
+    mtimes = _get_mtimes(path for _, path in bot_paths)
+    contents = _read_sources(bot_paths)
+    flows = load_flows_from_definitions(load_flow_definitions(contents))
+    build_time = time.time()
+    registry = FlowRegistry(
+        flows=flows,
+        sources=mtimes,
+        version=_hash_sources(contents),
+        build_time=build_time,
+        build_duration=build_time - start_time
+    )
+    logging.info('Built flow registry %s with %d flows in %.3f s', registry.version, len(flows),
+                 registry.build_duration)
+    return registry
+
+
+_registry = None  # type: FlowRegistry
+_registry_lock = threading.Lock()
+
+
+def get_flow_registry() -> FlowRegistry:
+    """
+    Returns the flow registry of this process.
+    The flows are recompiled only if content of some of the definition files has changed.
+    """
+    global _registry
+    registry = _registry
+    if registry is not None and not registry.has_changed_files():
+        return registry
+
+    with _registry_lock:
+        registry = _registry
+        if registry is None:
+            _registry = build_flow_registry()
+        elif registry.has_changed_files():
+            bot_paths = _get_bot_paths()
+            mtimes = _get_mtimes(path for _, path in bot_paths)
+            version = _hash_sources(_read_sources(bot_paths))
+            if version == registry.version:
+                # file was touched, but its content is the same
+                _registry = registry.with_sources(mtimes)
+            else:
+                logging.warning('Flow definitions changed, reloading flows (was version %s)', registry.version)
+                _registry = build_flow_registry()
+        return _registry
+
+
+def clear_flow_registry():
+    """Drops the flow registry of this process, it will be rebuilt on next access."""
+    global _registry
+    with _registry_lock:
+        _registry = None
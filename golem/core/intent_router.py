@@ -0,0 +1,150 @@
+import logging
+import re
+
+_REGEX_CHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+def is_literal(pattern: str) -> bool:
+    """Checks whether an intent pattern contains no regex syntax, so it can be looked up directly."""
+    return _REGEX_CHARS.isdisjoint(pattern)
+
+
+class BaseIntentRouter:
+    """Memoizes routes of intents, subclasses find them in _route(intent)."""
+
+    MAX_CACHED = 4096
+
+    def __init__(self):
+        self.size = 0
+        self.cache = {}
+
+    def _route(self, intent):
+        """:return: target of the first route matching an intent, or None"""
+        raise NotImplementedError()
+
+    def route(self, intent):
+        """
+        Returns the target of the first route matching an intent.
+        :param intent:  intent name
+        :return: target of the route or None
+        """
+        if intent is None:
+            return None
+        intent = str(intent)
+        try:
+            return self.cache[intent]
+        except KeyError:
+            pass
+        target = self._route(intent)
+        if len(self.cache) >= self.MAX_CACHED:
+            self.cache.clear()
+        self.cache[intent] = target
+        return target
+
+    def __len__(self):
+        return self.size
+
+
+class IntentRouter(BaseIntentRouter):
+    """
+    Finds the first route whose intent pattern matches an intent, the same way as trying
+    re.match(pattern, intent) for each route in order, but without scanning all the routes.
+
+    Literal patterns are looked up in a dict by each prefix of the intent (re.match only anchors at the start),
+    the other patterns are joined into a single compiled alternation, which tries them in order.
+    Results are memoized, as there is just a handful of distinct intents.
+    """
+
+    def __init__(self, routes):
+        """
+        :param routes:  iterable of (intent pattern, target) in order of priority
+        """
+        super().__init__()
+        self.literals = {}  # pattern -> (index, target)
+        self.regexes = []  # (index, pattern, target)
+        for index, (pattern, target) in enumerate(routes):
+            self.size += 1
+            if not pattern:
+                continue
+            pattern = str(pattern)
+            if is_literal(pattern):
+                # keep the first route if there are duplicates
+                self.literals.setdefault(pattern, (index, target))
+            else:
+                self.regexes.append((index, pattern, target))
+        self.max_literal = max((len(pattern) for pattern in self.literals), default=0)
+        self.combined, self.compiled = self._compile(self.regexes)
+
+    @staticmethod
+    def _compile(regexes):
+        if not regexes:
+            return None, []
+        try:
+            # each pattern is wrapped in a named group to tell which one has matched
+            combined = re.compile('|'.join('(?P<r{}>{})'.format(i, pattern)
+                                           for i, (_, pattern, _) in enumerate(regexes)))
+            if combined.groups == len(regexes):
+                return combined, []
+        except re.error:
+            pass
+        # patterns with own groups, backreferences or global flags can't be joined safely
+        logging.debug('Intent patterns cannot be combined, matching them one by one')
+        return None, [re.compile(pattern) for _, pattern, _ in regexes]
+
+    def _match_regex(self, intent):
+        """:return: (index, target) of the first matching regex route, or None"""
+        if self.combined is not None:
+            match = self.combined.match(intent)
+            if match:
+                # lastindex is the outermost group that matched, i.e. the alternative
+                index, _, target = self.regexes[match.lastindex - 1]
+                return index, target
+            return None
+        for (index, _, target), compiled in zip(self.regexes, self.compiled):
+            if compiled.match(intent):
+                return index, target
+        return None
+
+    def _route(self, intent):
+        best = self._match_regex(intent)
+        for length in range(1, min(len(intent), self.max_literal) + 1):
+            found = self.literals.get(intent[:length])
+            if found and (best is None or found[0] < best[0]):
+                best = found
+        return best[1] if best else None
+
+
+class FlowIntentRouter(BaseIntentRouter):
+    """
+    Finds the first route whose intent is matched by an intent used as a pattern, the same way as trying
+    re.match(intent, route intent) for each route in order. This is how intents of flows are matched,
+    whereas intents of states are patterns matched against the intent, see IntentRouter.
+
+    Literal intents match routes whose intents start with them, so the first route of each prefix is looked up
+    in a dict, other intents are compiled and tried against the routes in order. Results are memoized.
+    """
+
+    def __init__(self, routes):
+        """
+        :param routes:  iterable of (intent, target) in order of priority
+        """
+        super().__init__()
+        self.routes = []  # (intent, target)
+        self.prefixes = {}  # prefix of a route intent -> target of the first route with that prefix
+        for intent, target in routes:
+            if intent is None:
+                continue
+            intent = str(intent)
+            self.routes.append((intent, target))
+            for length in range(len(intent) + 1):
+                self.prefixes.setdefault(intent[:length], target)
+        self.size = len(self.routes)
+
+    def _route(self, intent):
+        if is_literal(intent):
+            return self.prefixes.get(intent)
+        compiled = re.compile(intent)
+        for route_intent, target in self.routes:
+            if compiled.match(route_intent):
+                return target
+        return None
@@ -7,6 +7,8 @@ from golem.core.responses.quick_reply import QuickReply, LocationQuickReply
 from golem.core.responses.responses import *
 from golem.core.responses.templates import ListTemplate
 
+logger = logging.getLogger(__name__)
+
 
 class TelegramAdapter():
     def __init__(self, chat_id):
@@ -75,7 +77,7 @@ class TelegramAdapter():
         row = []
         for reply in replies:
             if isinstance(reply, LocationQuickReply):
-                logging.warning('Skipping location quick reply, not supported')
+                logger.warning('Skipping location quick reply, not supported')
                 continue  # TODO support telegram location, keyboard <> inline keyboard
             key_button = {
                 'text': reply.title
@@ -108,7 +110,7 @@ class TelegramAdapter():
                     'callback_data': callback_data
                 }
             else:
-                logging.warning('Button class {} is not supported'.format(button.__class__.__name__))
+                logger.warning('Button class %s is not supported', button.__class__.__name__)
             if key:
                 row.append(key)
         if not len(row):
@@ -6,7 +6,7 @@ from django.conf import settings
 
 from golem.core.chat_session import ChatSession
 from golem.core.message_parser import parse_text_message
-from golem.core.persistence import get_redis
+from golem.core.persistence import get_session_store
 from golem.core.responses.buttons import *
 from golem.core.responses.quick_reply import QuickReply
 from golem.core.responses.responses import *
@@ -15,6 +15,8 @@ from golem.core.responses.templates import ListTemplate
 from golem.core.serialize import json_deserialize
 from golem.tasks import accept_user_message
 
+logger = logging.getLogger(__name__)
+
 
 class FacebookInterface():
     name = 'facebook'
@@ -33,7 +35,7 @@ class FacebookInterface():
                 diff = crr_datetime - ts_datetime
                 if diff.total_seconds() < settings.GOLEM_CONFIG.get('MSG_LIMIT_SECONDS', 15):
                     # get and persist user and page ids
-                    logging.debug('Incoming raw FB message: {}'.format(raw_message))
+                    logger.debug('Incoming raw FB message: %s', raw_message)
                     user_id = raw_message['sender']['id']
                     page_id = entry['id']
                     chat_id = FacebookInterface.create_chat_id(page_id, user_id)
@@ -45,7 +47,7 @@ class FacebookInterface():
                     # Add it to the message queue
                     accept_user_message.delay(session.to_json(), raw_message)
                 elif raw_message.get('timestamp'):
-                    logging.warning("Delay {} too big, ignoring message!".format(diff))
+                    logger.warning("Delay %s too big, ignoring message!", diff)
 
     @staticmethod
     def chat_id_to_page_id(chat_id):
@@ -69,11 +71,11 @@ class FacebookInterface():
     @staticmethod
     def load_profile(user_id, page_id, cache=True):
 
-        db = get_redis()
+        db = get_session_store()
         key = 'fb_profile_' + user_id
 
         if not cache or not db.exists(key):
-            logging.debug('Loading fb profile...')
+            logger.debug('Loading fb profile...')
 
             url = "https://graph.facebook.com/v2.6/" + user_id
             params = {
@@ -82,7 +84,7 @@ class FacebookInterface():
             }
             res = requests.get(url, params=params)
             if not res.status_code == requests.codes.ok:
-                logging.error("ERROR loading FB profile! Response: {}".format(res.text))
+                logger.error("ERROR loading FB profile! Response: %s", res.text)
                 return {}
 
             db.set(key, json.dumps(res.json()), ex=3600 * 24 * 14)  # save value, expire in 14 days
@@ -130,7 +132,7 @@ class FacebookInterface():
         if isinstance(response, ThreadSetting):
             request_mode = "thread_settings"
             response_dict = FacebookInterface.to_setting(response)
-            logging.debug('Sending FB setting: {}'.format(response_dict))
+            logger.debug('Sending FB setting: %s', response_dict)
             FacebookInterface._do_post(request_mode, response_dict, page_id)
         else:
             raise ValueError('Error: Invalid message type: {}: {}'.format(type(response), response))
@@ -145,9 +147,9 @@ class FacebookInterface():
                           headers={"Content-Type": "application/json"},
                           data=json.dumps(response_dict, default=json_serialize))
         if r.status_code != 200:
-            logging.error('ERROR: MESSAGE REFUSED: {}'.format(response_dict))
-            logging.error('ERROR: {}'.format(r.text))
-            logging.exception(r.json()['error']['message'])
+            logger.error('ERROR: MESSAGE REFUSED: %s', response_dict)
+            logger.error('ERROR: %s', r.text)
+            logger.exception(r.json()['error']['message'])
 
     @staticmethod
     def to_setting(response):
@@ -1,6 +1,6 @@
 from golem.core.chat_session import ChatSession, Profile
 from golem.core.message_parser import parse_text_message
-from golem.core.persistence import get_redis
+from golem.core.persistence import get_session_store
 from golem.core.responses import TextMessage
 from golem.tasks import accept_user_message
 
@@ -28,7 +28,7 @@ class GoogleActionsInterface():
     @staticmethod
     def post_message(session, response):
         GoogleActionsInterface.messages.append(response)
-        get_redis().set("response_for_{id}".format(id=session.chat_id), str(response))  # TODO
+        get_session_store().set("response_for_{id}".format(id=session.chat_id), str(response))  # TODO
 
     @staticmethod
     def convert_responses(session, responses):
@@ -101,7 +101,7 @@ class GoogleActionsInterface():
         session = ChatSession(GoogleActionsInterface, chat_id, meta, profile)
         accept_user_message.delay(session.to_json(), body).get()
         # responses = GoogleActionsInterface.response_cache.get(session.chat_id)
-        responses = get_redis().get("response_for_{id}".format(id=session.chat_id))  # TODO
+        responses = get_session_store().get("response_for_{id}".format(id=session.chat_id))  # TODO
         return GoogleActionsInterface.convert_responses(session, responses.decode('utf8'))
 
     @staticmethod
@@ -8,9 +8,11 @@ from django.conf import settings
 
 from golem.core.interfaces.adapter.microsoft import MicrosoftAdapter
 from golem.core.message_parser import parse_text_message
-from golem.core.persistence import get_redis
+from golem.core.persistence import get_session_store
 from golem.tasks import accept_user_message
 
+logger = logging.getLogger(__name__)
+
 
 # FIXME needs to be updated
 
@@ -27,8 +29,8 @@ class MicrosoftInterface():
         """
         if not chat_id:
             raise Exception('Chat id must not be null')
-        redis = get_redis()
-        url = redis.get('ms_service_url_' + str(chat_id))
+        store = get_session_store()
+        url = store.get('ms_service_url_' + str(chat_id))
         if url is None:
             raise Exception('Service url not found for chat id ' + str(chat_id))
 
@@ -42,8 +44,8 @@ class MicrosoftInterface():
     def set_base_url(chat_id, url):
         if not chat_id or not url:
             raise Exception('Chat id and url must not be null')
-        redis = get_redis()
-        redis.set('ms_service_url_' + str(chat_id), str(url))
+        store = get_session_store()
+        store.set('ms_service_url_' + str(chat_id), str(url))
 
     @staticmethod
     def set_bot_id(chat_id, bot_id):
@@ -57,15 +59,15 @@ class MicrosoftInterface():
         """
         if chat_id is None or bot_id is None:
             raise Exception('Chat id and bot id must not be null')
-        redis = get_redis()
-        redis.set('ms_reply_botid_' + str(chat_id), str(bot_id))
+        store = get_session_store()
+        store.set('ms_reply_botid_' + str(chat_id), str(bot_id))
 
     @staticmethod
     def get_bot_id(chat_id):
         if chat_id is None:
             raise Exception('Chat id must not be null')
-        redis = get_redis()
-        bot_id = redis.get('ms_reply_botid_' + str(chat_id))
+        store = get_session_store()
+        bot_id = store.get('ms_reply_botid_' + str(chat_id))
         if bot_id is None:
             raise Exception('Bot ID not found for chat {}'.format(str(chat_id)))
         return bot_id.decode()
@@ -83,9 +85,9 @@ class MicrosoftInterface():
         """
         :returns: Auth token for Microsoft Bot API.
         """
-        redis = get_redis()
-        if redis.exists('ms_token'):
-            return redis.get('ms_token').decode()
+        store = get_session_store()
+        if store.exists('ms_token'):
+            return store.get('ms_token').decode()
         else:
             url = 'https://login.microsoftonline.com/botframework.com/oauth2/v2.0/token'
             headers = {
@@ -99,12 +101,12 @@ class MicrosoftInterface():
             )
             response = requests.post(url, data=payload, headers=headers)
             if response.status_code != 200:
-                logging.error(response.text)
+                logger.error(response.text)
                 response.raise_for_status()
             auth_data = response.json()
             token = auth_data['access_token']
             ex = auth_data['expires_in']
-            redis.set('ms_token', str(token), ex=ex)
+            store.set('ms_token', str(token), ex=ex)
             return token
 
     @staticmethod
@@ -113,7 +115,7 @@ class MicrosoftInterface():
             # TODO initiate conversation
             return
 
-        message_id = get_redis().get('chat_message_id:{}'.format(chat_id))
+        message_id = get_session_store().get('chat_message_id:{}'.format(chat_id))
         if message_id:
             message_id = message_id.decode()
 
@@ -141,13 +143,12 @@ class MicrosoftInterface():
             "Authorization": "Bearer " + MicrosoftInterface.get_auth_token(),
             "Content-Type": "application/json"
         }
-        logging.warning(url)
-        logging.warning(payload)
+        logger.debug('Posting to %s: %s', url, payload)
         response = requests.post(url, data=json.dumps(payload), headers=headers)
         if response.status_code != 200:
-            logging.warning(str(payload))
-            logging.warning(response)
-            logging.warning(response.text)
+            logger.warning(str(payload))
+            logger.warning(response)
+            logger.warning(response.text)
         response.raise_for_status()
 
     @staticmethod
@@ -173,7 +174,7 @@ class MicrosoftInterface():
         headers = {"Authorization": "Bearer " + MicrosoftInterface.get_auth_token()}
         response = requests.post(url, data=json.dumps(payload), headers=headers)
         if response.status_code != 200:
-            logging.error(response.text)
+            logger.error(response.text)
             response.raise_for_status()
 
     @staticmethod
@@ -187,13 +188,13 @@ class MicrosoftInterface():
     @staticmethod
     def has_message_expired(message: dict) -> bool:
         if not (message and 'date' in message):
-            logging.warning('Invalid date in message')
+            logger.warning('Invalid date in message')
             return True
         received = datetime.strptime(message['timestamp'], '%Y-%m-%dT%H:%M:%s.%fZ')
         now = datetime.utcnow()
 
         if abs(now - received) > timedelta(seconds=settings.GOLEM_CONFIG.get('MSG_LIMIT_SECONDS')):
-            logging.warning('Ignoring message, too old')
+            logger.warning('Ignoring message, too old')
             return True
         return False
 
@@ -202,7 +203,7 @@ class MicrosoftInterface():
         if body['type'] == 'message':
             uid = body['from']['id']
             chat_id = body['conversation']['id']
-            get_redis().set('chat_message_id:{}'.format(chat_id), body['id'])  # TODO
+            get_session_store().set('chat_message_id:{}'.format(chat_id), body['id'])  # TODO
             MicrosoftInterface.set_base_url(chat_id, body['serviceUrl'])
             MicrosoftInterface.set_bot_id(chat_id, body['recipient']['id'])
             accept_user_message.delay(MicrosoftInterface.name, uid, body, chat_id=chat_id)
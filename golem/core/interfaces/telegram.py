@@ -9,9 +9,11 @@ import requests
 from django.conf import settings
 
 from golem.core.message_parser import parse_text_message
-from golem.core.persistence import get_redis
+from golem.core.persistence import get_session_store
 from golem.tasks import accept_user_message
 
+logger = logging.getLogger(__name__)
+
 
 # FIXME needs to be updated
 
@@ -23,7 +25,7 @@ class TelegramInterface:
     def get_base_url() -> Optional[str]:
         token = settings.GOLEM_CONFIG.get('TELEGRAM_TOKEN')
         if not token:
-            logging.warning('Telegram token not provided. Telegram will not work.')
+            logger.warning('Telegram token not provided. Telegram will not work.')
             return None
         return 'https://api.telegram.org/bot{}/'.format(token)
 
@@ -36,13 +38,13 @@ class TelegramInterface:
             return
         url = base_url + 'setWebhook'
 
-        logging.debug('Reverse telegram is: {}'.format(reverse('telegram')))
+        logger.debug('Reverse telegram is: %s', reverse('telegram'))
         callback_url = settings.GOLEM_CONFIG.get('DEPLOY_URL') + reverse('telegram')
 
         payload = {'url': callback_url}
         response = requests.post(url, data=payload)
         if not response.json()['ok']:
-            logging.warning(response.json())
+            logger.warning(response.json())
 
 
     @staticmethod
@@ -65,11 +67,11 @@ class TelegramInterface:
             url = base_url + method
             response = requests.post(url, data=payload)
             if not response.json()['ok']:
-                logging.error('Telegram request failed!')
-                logging.error(response.json())
-                logging.error('for method {}'.format(method))
-                logging.error('message is:')
-                logging.error(payload)
+                logger.error('Telegram request failed!')
+                logger.error(response.json())
+                logger.error('for method %s', method)
+                logger.error('message is:')
+                logger.error(payload)
                 return
 
     @staticmethod
@@ -83,15 +85,15 @@ class TelegramInterface:
         }
         response = requests.post(url, data=payload)
         if not response.json()['ok']:
-            logging.error('Unable to answer callback query')
-            logging.error(response.json())
+            logger.error('Unable to answer callback query')
+            logger.error(response.json())
         # hide reply keyboard after clicking
         url = base_url + 'editMessageReplyMarkup'
         payload = {'chat_id': chat_id, 'message_id': message_id, 'reply_markup': ''}
         response = requests.post(url, data=payload)
         if not response.json()['ok']:
-            logging.error('Unable to remove quick replies')
-            logging.error(response.json())
+            logger.error('Unable to remove quick replies')
+            logger.error(response.json())
 
     @staticmethod
     def send_settings(settings):
@@ -109,7 +111,7 @@ class TelegramInterface:
         }
         response = requests.post(url, data=payload)
         if not response.json()['ok']:
-            logging.warning(response.json())
+            logger.warning(response.json())
 
     @staticmethod
     def processing_end(uid, chat_id):
@@ -122,20 +124,20 @@ class TelegramInterface:
     @staticmethod
     def has_message_expired(message: dict) -> bool:
         if not (message and 'date' in message):
-            logging.warning('Invalid date in message')
+            logger.warning('Invalid date in message')
             return True
         received = datetime.fromtimestamp(int(message['date']))
         now = datetime.utcnow()
 
         if abs(now - received) > timedelta(seconds=settings.GOLEM_CONFIG['MSG_LIMIT_SECONDS']):
-            logging.warning('Ignoring message, too old')
+            logger.warning('Ignoring message, too old')
             return True
         return False
 
     @staticmethod
     def accept_request(body, num_tries=1) -> bool:
         if not body or 'update_id' not in body:
-            logging.warning('Invalid message received: {}'.format(body))
+            logger.warning('Invalid message received: %s', body)
             return False
 
         if 'message' in body:
@@ -144,11 +146,11 @@ class TelegramInterface:
             chat_id = message['chat']['id']
             uid = message['from']['id'] if 'from' in message else None  # null for group chats
             if uid and not TelegramInterface.has_message_expired(message):
-                logging.debug('Adding message to queue')
+                logger.debug('Adding message to queue')
                 accept_user_message.delay(TelegramInterface.name, uid, body, chat_id=chat_id)
                 return True
             else:
-                logging.warning('No sender specified, ignoring message')
+                logger.warning('No sender specified, ignoring message')
                 return False
         elif 'callback_query' in body:
             callback_query = body['callback_query']
@@ -159,7 +161,7 @@ class TelegramInterface:
                 message_id = message['message_id']
                 TelegramInterface.answer_callback_query(query_id, chat_id, message_id)
             else:
-                logging.error('No message in callback query, probably too old, ignoring.')
+                logger.error('No message in callback query, probably too old, ignoring.')
             if 'message' in callback_query:
                 # unfortunately, there is no way to check the age of callback itself
                 chat_id = callback_query['message']['chat']['id']
@@ -167,7 +169,7 @@ class TelegramInterface:
                 accept_user_message.delay(TelegramInterface.name, uid, body, chat_id=chat_id)
                 return True
         else:
-            logging.warning('Unknown message type')
+            logger.warning('Unknown message type')
             return False
 
     @staticmethod
@@ -192,16 +194,13 @@ class TelegramInterface:
         :param  payload     Payload to be persisted in Redis.
         :return             Unique string associated with the payload, which can be sent to Telegram.
         """
-        redis = get_redis()
+        store = get_session_store()
         key = ''.join(random.choice(string.hexdigits) for i in range(63))
-        while redis.exists(key):
+        while store.exists(key):
             key = ''.join(random.choice(string.hexdigits) for i in range(63))
-        redis.set(key, payload, ex=3600 * 24 * 7)
+        store.set(key, payload, ex=3600 * 24 * 7)
         return key
 
     @staticmethod
     def retrieve_callback(key) -> Optional[str]:
-        redis = get_redis()
-        if redis.exists(key):
-            return redis.get(key)
-        return None
+        return get_session_store().get(key)
@@ -0,0 +1,50 @@
+"""
+Logging of the framework itself, as opposed to message loggers in this package.
+
+Records logged through a ChatLogger carry the chat_id, state and stage of the dialog as attributes,
+so that handlers can filter or format them, e.g. with a format like
+'%(asctime)s %(levelname)s %(name)s [%(chat_id)s %(state)s %(stage)s] %(message)s'.
+Add ChatContextFilter to such handlers, so that records of other loggers can be formatted as well.
+
+Log levels of modules can be set in GOLEM_CONFIG['LOG_LEVELS'], e.g. {'golem.core.dialog_manager': 'WARNING'}.
+"""
+import logging
+
+CHAT_FIELDS = ('chat_id', 'state', 'stage')
+
+
+class ChatLogger(logging.LoggerAdapter):
+    """
+    Logger adapter adding fields of a chat to records. The fields can be changed as the dialog proceeds,
+    e.g. log.extra['state'] = ..., and are read only when a record is actually logged.
+    """
+
+    def __init__(self, logger, chat_id, state=None, stage=None):
+        super().__init__(logger, {'chat_id': chat_id, 'state': state, 'stage': stage})
+
+    def process(self, msg, kwargs):
+        extra = kwargs.get('extra')
+        kwargs['extra'] = dict(self.extra, **extra) if extra else dict(self.extra)
+        return msg, kwargs
+
+
+class ChatContextFilter(logging.Filter):
+    """Adds empty chat fields to records that don't have them, so that the same format can be used for all records."""
+
+    def filter(self, record):
+        for field in CHAT_FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, '-')
+        return True
+
+
+def configure_logging(levels: dict = None):
+    """
+    Sets log levels of modules.
+    :param levels:  dict of logger name -> level name or number, GOLEM_CONFIG['LOG_LEVELS'] by default
+    """
+    if levels is None:
+        from django.conf import settings
+        levels = settings.GOLEM_CONFIG.get('LOG_LEVELS', {})
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level.upper() if isinstance(level, str) else level)
@@ -1,9 +1,12 @@
 import json
+import logging
 import time
 
 from golem.core.chat_session import ChatSession
 from golem.core.logging.abs_logger import MessageLogger
 
+logger = logging.getLogger(__name__)
+
 
 def get_elastic():
     from elasticsearch import Elasticsearch
@@ -76,11 +79,10 @@ class ElasticsearchLogger(MessageLogger):
         if not es:
             return
         try:
-            print('Logging', message)
+            logger.debug('Logging %s', message)
             es.index(index="message-log", doc_type='message', body=message)
-        except Exception as e:
-            print('Unable to log message to Elasticsearch.')
-            print(e)
+        except Exception:
+            logger.exception('Unable to log message to Elasticsearch.')
 
     def log_user(self, dialog, session: ChatSession):
         user = {
@@ -92,6 +94,5 @@ class ElasticsearchLogger(MessageLogger):
             return
         try:
             es.create(index="message-log", id=user['uid'], doc_type='user', body=user)
-        except Exception as e:
-            print('Unable to log user profile to Elasticsearch.')
-            print(e)
+        except Exception:
+            logger.exception('Unable to log user profile to Elasticsearch.')
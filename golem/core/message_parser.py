@@ -1,11 +1,25 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 import emoji
 import re
 from django.conf import settings
 
+from golem.core import metrics
+from golem.core.parsing.entity_extractor import time_limit
+
 ENTITY_EXTRACTORS = settings.GOLEM_CONFIG.get("ENTITY_EXTRACTORS", [])
 
+SMILEYS = {':)': ':slightly_smiling_face:', '(y)': ':thumbs_up_sign:', ':(': ':disappointed_face:',
+           ':*': ':kissing_face:', ':O': ':face_with_open_mouth:', ':D': ':grinning_face:',
+           '<3': ':heavy_black_heart:️', ':P': ':face_with_stuck-out_tongue:'}
+_SMILEY_PATTERN = re.compile('|'.join(re.escape(smiley) for smiley in SMILEYS))
+_EMOJI_NAME_PATTERN = re.compile(r':([a-zA-Z_0-9]+):')
+_NON_ASCII_PATTERN = re.compile(r'[^\x00-\x7f]')
+_COMMAND_PATTERN = re.compile(r'/([^/]+)/([^/]+)/')  # /entity/value/
+
 
 def add_default_extractors():
     # compatibility for old chatbots
@@ -18,22 +32,99 @@ def add_default_extractors():
 add_default_extractors()
 
 
+_executor = None
+_executor_lock = threading.Lock()
+_extractor_locks = {}  # id of extractor -> lock serializing calls of extractors that aren't thread safe
+
+
+def get_extractor_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool running entity extractors, its size is GOLEM_CONFIG['NLU_MAX_WORKERS']."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = settings.GOLEM_CONFIG.get('NLU_MAX_WORKERS', 8)
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='golem-nlu')
+    return _executor
+
+
+def _get_extractor_lock(extractor):
+    with _executor_lock:
+        return _extractor_locks.setdefault(id(extractor), threading.Lock())
+
+
+def _run_extractor(extractor, text, deadline):
+    if time.monotonic() >= deadline:
+        # waited in the queue for too long, the result would be thrown away
+        return None
+    start = time.perf_counter()
+    lock = None
+    if not getattr(extractor, 'thread_safe', True):
+        lock = _get_extractor_lock(extractor)
+        if not lock.acquire(timeout=max(0, deadline - time.monotonic())):
+            return None
+    try:
+        with time_limit(deadline):
+            return extractor.extract_entities(text)
+    finally:
+        if lock is not None:
+            lock.release()
+        metrics.observe('nlu.extractor_ms.' + type(extractor).__name__, (time.perf_counter() - start) * 1000)
+
+
+def extract_entities(text, extractors=None) -> dict:
+    """
+    Runs entity extractors concurrently and merges their entities in order of the extractors.
+    Extractors that fail or don't finish in time are skipped, so that the message is processed with the rest.
+    Each extractor has GOLEM_CONFIG['NLU_EXTRACTOR_TIMEOUT'] seconds, or its own timeout attribute,
+    and all of them GOLEM_CONFIG['NLU_DEADLINE'] seconds.
+    The timeouts only bound waiting for the results: a running extractor can't be stopped,
+    it's up to the extractor to finish within the time it has left, see EntityExtractor.
+    :param extractors:  list of EntityExtractor, ENTITY_EXTRACTORS by default
+    :return: dict of entity name -> list of values
+    """
+    if extractors is None:
+        extractors = ENTITY_EXTRACTORS
+    default_timeout = settings.GOLEM_CONFIG.get('NLU_EXTRACTOR_TIMEOUT', 5)
+    deadline = settings.GOLEM_CONFIG.get('NLU_DEADLINE', 10)
+
+    start = time.monotonic()
+    executor = get_extractor_executor()
+    futures = []
+    for extractor in extractors:
+        timeout = min(getattr(extractor, 'timeout', None) or default_timeout, deadline)
+        futures.append((extractor, timeout, executor.submit(_run_extractor, extractor, text, start + timeout)))
+
+    entities = {}
+    for extractor, timeout, future in futures:
+        try:
+            append = future.result(timeout=max(0, start + timeout - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            metrics.incr('nlu.extractor_timeouts')
+            logging.warning('Entity extractor %s timed out after %s s', type(extractor).__name__, timeout)
+            continue
+        except Exception:
+            metrics.incr('nlu.extractor_errors')
+            logging.exception('Entity extractor %s failed', type(extractor).__name__)
+            continue
+        for entity, values in (append or {}).items():
+            entities.setdefault(entity, []).extend(values)
+    metrics.observe('nlu.extract_ms', (time.monotonic() - start) * 1000)
+    return entities
+
+
 def parse_text_message(text, num_tries=1):
     if len(ENTITY_EXTRACTORS) <= 0:
         logging.warning('No entity extractors configured!')
         return {'type': 'message', 'entities': {'_message_text': [{'value': text}]}}
 
-    entities = {}
-
-    for extractor in ENTITY_EXTRACTORS:
-        append = extractor.extract_entities(text)
-        for entity, values in append.items():
-            entities.setdefault(entity, []).extend(values)
+    entities = extract_entities(text)
 
-    logging.debug('Extracted entities:', entities)
+    logging.debug('Extracted entities: %s', entities)
     append = parse_additional_entities(text)
 
-    for (entity, value) in re.findall(re.compile(r'/([^/]+)/([^/]+)/'), text):
+    for (entity, value) in _COMMAND_PATTERN.findall(text):
         if not entity in append:
             append[entity] = []
         append[entity].append({'value': value})
@@ -51,22 +142,56 @@ def parse_text_message(text, num_tries=1):
     return parsed
 
 
+def merge_messages(messages: list) -> list:
+    """
+    Merges consecutive text messages into one, their entity values are concatenated and texts joined.
+    Messages of other types, such as postbacks, are kept as they are.
+    :param messages:    list of parsed messages, oldest first
+    :return: list of parsed messages to process, oldest first
+    """
+    merged = []
+    for parsed in messages:
+        if merged and merged[-1]['type'] == parsed['type'] == 'message':
+            previous = merged[-1]
+            previous['entities'] = _merge_entities(previous.get('entities') or {}, parsed.get('entities') or {})
+        else:
+            merged.append(parsed)
+    return merged
+
+
+def _merge_entities(entities, append):
+    merged = {entity: _as_list(values) for entity, values in entities.items()}
+    for entity, values in append.items():
+        merged[entity] = merged.get(entity, []) + _as_list(values)
+    texts = [value.get('value') for value in merged.get('_message_text', [])]
+    texts = [text for text in texts if isinstance(text, str)]
+    if texts:
+        merged['_message_text'] = [{'value': ' '.join(texts)}]
+    return merged
+
+
+def _as_list(values):
+    if values is None:
+        return []
+    if isinstance(values, list):
+        return values
+    if isinstance(values, dict):
+        return [values]
+    return [{'value': values}]
+
+
 def parse_additional_entities(text):
+    """Extracts emoji in the text, including text smileys such as :), as entities."""
     # TODO custom nlp might receive them preprocessed (or not)
-    entities = {}
-    chars = {':)': ':slightly_smiling_face:', '(y)': ':thumbs_up_sign:', ':(': ':disappointed_face:',
-             ':*': ':kissing_face:', ':O': ':face_with_open_mouth:', ':D': ':grinning_face:',
-             '<3': ':heavy_black_heart:️', ':P': ':face_with_stuck-out_tongue:'}
-    demojized = emoji.demojize(text)
-    char_emojis = re.compile(
-        r'(' + '|'.join(chars.keys()).replace('(', '\(').replace(')', '\)').replace('*', '\*') + r')')
-    demojized = char_emojis.sub(lambda x: chars[x.group()], demojized)
-    if demojized != text:
-        match = re.compile(r':([a-zA-Z_0-9]+):')
-        for emoji_name in re.findall(match, demojized):
-            if 'emoji' not in entities:
-                entities['emoji'] = []
-            entities['emoji'].append({'value': emoji_name})
-        # if re.match(match, demojized):
-        #    entities['intent'].append({'value':'emoji'})
-    return entities
+    if _NON_ASCII_PATTERN.search(text) is None:
+        # emoji are never ASCII, so only smileys can be found
+        if _SMILEY_PATTERN.search(text) is None:
+            return {}
+        demojized = text
+    else:
+        demojized = emoji.demojize(text)
+    demojized = _SMILEY_PATTERN.sub(lambda x: SMILEYS[x.group()], demojized)
+    if demojized == text:
+        return {}
+    names = _EMOJI_NAME_PATTERN.findall(demojized)
+    return {'emoji': [{'value': name} for name in names]} if names else {}
@@ -0,0 +1,70 @@
+"""
+Process-local metrics of the dialog manager, such as Redis round trips or lock wait times.
+Values are kept in memory of each worker and can be read with snapshot().
+Gauges that are costly to keep up to date are set by collectors, which are called only when metrics are read.
+"""
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_observations = {}
+_collectors = []
+
+
+def incr(name, value=1):
+    """Increments a counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def gauge(name, value):
+    """Sets a gauge to its current value."""
+    _gauges[name] = value
+
+
+def observe(name, value):
+    """Records a single observation of a value, such as a duration or a count per message."""
+    with _lock:
+        stats = _observations.get(name)
+        if stats is None:
+            _observations[name] = {'count': 1, 'total': value, 'max': value, 'last': value}
+        else:
+            stats['count'] += 1
+            stats['total'] += value
+            stats['last'] = value
+            if value > stats['max']:
+                stats['max'] = value
+
+
+def register_collector(collector):
+    """Registers a function without arguments that sets gauges, it's called by each snapshot()."""
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+def unregister_collector(collector):
+    if collector in _collectors:
+        _collectors.remove(collector)
+
+
+def snapshot() -> dict:
+    """Returns a copy of all metrics, averages of observed values are included."""
+    for collector in _collectors:
+        collector()
+    with _lock:
+        observations = {}
+        for name, stats in _observations.items():
+            observations[name] = dict(stats, avg=stats['total'] / stats['count'])
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'observations': observations,
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _observations.clear()
@@ -1,10 +1,11 @@
 import json
 import logging
 
-import requests
-
 from golem.core.parsing import date_utils
 from golem.core.parsing.entity_extractor import EntityExtractor
+from golem.core.parsing.http import get_http_session, get_http_timeout
+
+logger = logging.getLogger(__name__)
 
 
 class DucklingExtractor(EntityExtractor):
@@ -19,6 +20,7 @@ class DucklingExtractor(EntityExtractor):
     def extract_entities(self, text: str, max_retries=1):
         """
         Makes a duckling request for text entities.
+        Failed requests are retried with backoff by the HTTP session, see golem.core.parsing.http.
         :param text: Text to be parsed by Duckling.
         :return: Json returned by Duckling. Empty on error.
         """
@@ -27,19 +29,14 @@ class DucklingExtractor(EntityExtractor):
             'text': text
         }
         try:
-            resp = requests.post(self.duckling_url + "/parse", data=payload)
-            if resp.status_code == 200:
-                jsn = resp.json()
-                logging.debug('Duckling:', jsn)
-                if jsn is not None:
-                    return self.to_entities(jsn)
-            else:
-                resp.raise_for_status()
+            resp = get_http_session().post(self.duckling_url + "/parse", data=payload, timeout=get_http_timeout())
+            resp.raise_for_status()
+            jsn = resp.json()
+            logger.debug('Duckling: %s', jsn)
+            if jsn is not None:
+                return self.to_entities(jsn)
         except Exception:
-            if max_retries > 0:
-                return self.extract_entities(text, max_retries - 1)
-            else:
-                logging.exception('Exception @ Duckling')
+            logger.exception('Exception @ Duckling')
         return {}
 
     def to_entities(self, jsn):
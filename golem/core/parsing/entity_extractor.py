@@ -1,12 +1,48 @@
+import threading
+import time
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+@contextmanager
+def time_limit(deadline):
+    """
+    Sets the time the extractors running in this thread have to finish, see get_time_left().
+    :param deadline:    time.monotonic() value, or None if not limited
+    """
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = deadline
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def get_time_left():
+    """:return: seconds the extractor running in this thread has left, or None if not limited"""
+    deadline = getattr(_local, 'deadline', None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
 
 
 class EntityExtractor(ABC):
     """
     Abstract class for entity extractors.
     Responsible for processing text and extracting entities such as names, dates, places etc.
+
+    Extractors run in a shared thread pool, see message_parser.extract_entities(), so the same instance
+    may extract entities of several messages at once. Extractors that aren't safe to use so
+    must set thread_safe to False, and their calls are serialized.
+
+    An extractor that doesn't finish in time is skipped, but its thread keeps running and occupying the pool,
+    so long running extractors should finish within get_time_left() seconds, as get_http_timeout() does.
     """
 
+    thread_safe = True
+
     def __init__(self):
         pass
 
@@ -3,6 +3,9 @@ from golem.core.parsing.entity_extractor import EntityExtractor
 
 class GolemExtractor(EntityExtractor):
 
+    # the model is loaded lazily and its predictions aren't guaranteed to be thread safe
+    thread_safe = False
+
     def __init__(self):
         super().__init__()
         self.nlu = None
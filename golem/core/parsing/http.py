@@ -0,0 +1,123 @@
+"""
+Shared HTTP session of entity extractors calling NLU services such as Wit or Duckling.
+Connections are kept alive and pooled, failed requests are retried with exponential backoff.
+
+Configured in GOLEM_CONFIG['NLU_HTTP'], a dict with any of:
+POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT (seconds), RETRIES and BACKOFF_FACTOR.
+
+Extractors are abandoned after GOLEM_CONFIG['NLU_EXTRACTOR_TIMEOUT'] seconds (or NLU_DEADLINE, if lower),
+but their threads keep running, and occupy the extractor pool, until the request with all its retries is over.
+So the timeouts and retries are limited to fit in the time the extractor has left, see get_http_limits():
+retries are dropped until each attempt can have at least MIN_ATTEMPT_TIMEOUT seconds,
+and CONNECT_TIMEOUT and READ_TIMEOUT are lowered to a third and the rest of each attempt's share.
+No retry is started once the extractor is out of time.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from golem.core.parsing.entity_extractor import get_time_left
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+RETRY_METHODS = frozenset(['GET', 'POST'])  # NLU requests don't change anything, so they are safe to retry
+MIN_ATTEMPT_TIMEOUT = 2
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_config() -> dict:
+    from django.conf import settings
+    return settings.GOLEM_CONFIG.get('NLU_HTTP', {})
+
+
+def _get_budget():
+    """:return: seconds an extractor has to finish, or None if not limited"""
+    from django.conf import settings
+    timeouts = [settings.GOLEM_CONFIG.get('NLU_EXTRACTOR_TIMEOUT', 5), settings.GOLEM_CONFIG.get('NLU_DEADLINE', 10)]
+    timeouts = [timeout for timeout in timeouts if timeout]
+    return min(timeouts) if timeouts else None
+
+
+def get_http_limits(budget=None) -> tuple:
+    """
+    Returns timeouts and number of retries of NLU requests, limited so that a request with all its retries
+    takes about budget seconds at most. Read timeout limits each wait for data, so it's approximate.
+    :param budget:  seconds, the extractor timeout by default
+    :return: (connect timeout, read timeout, retries)
+    """
+    config = _get_config()
+    connect, read = config.get('CONNECT_TIMEOUT', 3.05), config.get('READ_TIMEOUT', 10)
+    retries, backoff_factor = config.get('RETRIES', 3), config.get('BACKOFF_FACTOR', 0.3)
+    budget = budget or _get_budget()
+    if not budget:
+        return connect, read, retries
+    while True:
+        # retries wait backoff_factor * (1 + 2 + ... + 2 ** (retries - 1)) in total
+        attempt = (budget - backoff_factor * (2 ** retries - 1)) / (retries + 1)
+        if attempt >= MIN_ATTEMPT_TIMEOUT or retries == 0:
+            break
+        retries -= 1
+    attempt = max(attempt, 0.1)
+    connect = min(connect, attempt / 3)
+    return connect, min(read, attempt - connect), retries
+
+
+class _TimeLimitedRetry(Retry):
+    """Gives up retrying when the extractor making the request is out of time, see get_time_left()."""
+
+    def increment(self, *args, **kwargs):
+        time_left = get_time_left()
+        if time_left is not None and time_left <= 0:
+            # an exhausted copy raises MaxRetryError, or returns the response, the same way as after the last retry
+            return Retry.increment(self.new(total=0), *args, **kwargs)
+        return super().increment(*args, **kwargs)
+
+
+def _create_retry(retries, backoff_factor) -> Retry:
+    kwargs = dict(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff_factor,
+                  status_forcelist=RETRY_STATUSES, raise_on_status=False)
+    try:
+        return _TimeLimitedRetry(allowed_methods=RETRY_METHODS, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return _TimeLimitedRetry(method_whitelist=RETRY_METHODS, **kwargs)
+
+
+def create_http_session(pool_size=10, retries=3, backoff_factor=0.3) -> requests.Session:
+    """
+    Creates a session with a pool of keep-alive connections.
+    :param pool_size:       max number of connections kept per host
+    :param retries:         max number of retries of failed connections, reads and responses with RETRY_STATUSES
+    :param backoff_factor:  retries wait backoff_factor * 2 ** (retry number - 1) seconds
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=_create_retry(retries, backoff_factor))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """Returns the HTTP session of this process."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                config = _get_config()
+                _session = create_http_session(
+                    pool_size=config.get('POOL_SIZE', 10),
+                    retries=get_http_limits()[2],
+                    backoff_factor=config.get('BACKOFF_FACTOR', 0.3),
+                )
+    return _session
+
+
+def get_http_timeout() -> tuple:
+    """:return: (connect timeout, read timeout) in seconds, limited by the time the extractor has left"""
+    time_left = get_time_left()
+    connect, read, _ = get_http_limits(None if time_left is None else max(time_left, 0.1))
+    return connect, read
@@ -0,0 +1,227 @@
+"""
+In-process extractor of the most common dates, times, numbers and ordinals,
+such as "tomorrow", "next week", "on friday at 5pm", "42" or "third".
+
+It outputs the same structure as Duckling, so that the values are post-processed by date_utils the same way.
+Texts it can't parse with confidence, e.g. containing month names, durations or ambiguous times,
+are passed to a fallback extractor, so it can be used as a fast first pass in front of Duckling:
+
+    ENTITY_EXTRACTORS = [LocalExtractor(fallback=DucklingExtractor(DUCKLING_URL))]
+"""
+import datetime
+import logging
+import re
+from datetime import timedelta
+
+from django.utils import timezone
+
+from golem.core import metrics
+from golem.core.parsing import date_utils
+from golem.core.parsing.entity_extractor import EntityExtractor
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+UNITS = ('zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+         'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen', 'nineteen')
+TENS = ('twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety')
+ORDINALS = ('first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth')
+NUMBER_WORDS = dict(
+    [(word, i) for i, word in enumerate(UNITS)] + [(word, (i + 2) * 10) for i, word in enumerate(TENS)]
+)
+
+_DAY_PATTERN = re.compile(
+    r'\b(?:(now)|(today)|(day after tomorrow)|(tomorrow)|(yesterday)|(tonight|this evening)'
+    r'|(this|next) (week|month)|(?:(this|next) )?(weekend)'
+    r'|(?:(?:on|this) )?(next )?(' + '|'.join(WEEKDAYS) + r'))\b'
+)
+_RELATIVE_PATTERN = re.compile(r'\bin (\d+|an?|' + '|'.join(UNITS[1:]) + r') (minute|hour|day|week)s?\b')
+_TIME_PATTERN = re.compile(
+    r'\b(?:at )?(?:(\d{1,2})(?::(\d{2}))? ?([ap])\.?m\b\.?|(\d{1,2}):(\d{2})\b|(noon|midnight)\b|at (\d{1,2})\b)'
+)
+_ORDINAL_PATTERN = re.compile(r'\b(?:(\d+)(?:st|nd|rd|th)|(' + '|'.join(ORDINALS) + r'))\b')
+_NUMBER_PATTERN = re.compile(
+    r'(?<![\w.,])(-?\d+(?:\.\d+)?)(?![\w.,]\d)|\b(?:(' + '|'.join(TENS) + r')[ -](' + '|'.join(UNITS[1:10]) + r')'
+    r'|(' + '|'.join(NUMBER_WORDS) + r'))\b'
+)
+_DATE_LIKE_PATTERN = re.compile(r'\d{1,2}[/.]\d{1,2}[/.]|\d{1,4}[/-]\d{1,2}')
+# parts of texts this extractor doesn't understand, but Duckling might
+_LOW_CONFIDENCE_PATTERN = re.compile(
+    r'\d[,.]\d{3}|[$€£%]|\b(?:o\'?clock|half|quarter|past|ago|last|before|after|until|till'
+    r'|since|from|between|morning|afternoon|evening|night|second|minute|hour|day|week|month|year|decade|century'
+    r'|hundred|thousand|million|billion|dozen|jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec|january|february'
+    r'|march|april|june|july|august|september|october|november|december|christmas|easter|holidays?'
+    r'|[a-z]+s? (?:long|away|old)|km|kg|mi|miles?|meters?|kilometers?|eur|usd|czk|dollars?|euros?|crowns?)s?\b'
+)
+
+
+class LocalExtractor(EntityExtractor):
+
+    def __init__(self, fallback: EntityExtractor = None, tz=None):
+        """
+        :param fallback:    extractor of texts that can't be parsed locally with confidence, e.g. a DucklingExtractor
+        :param tz:          time zone of the user, the current Django time zone by default
+        """
+        super().__init__()
+        self.fallback = fallback
+        self.tz = tz
+
+    def extract_entities(self, text: str, max_retries=1):
+        entities = self.parse(text)
+        if entities is not None:
+            return entities
+        if self.fallback is None:
+            return {}
+        metrics.incr('nlu.local_extractor.fallbacks')
+        logger.debug('Falling back to %s: %s', type(self.fallback).__name__, text)
+        return self.fallback.extract_entities(text)
+
+    def parse(self, text: str, now: datetime.datetime = None):
+        """
+        Extracts dates, times, numbers and ordinals from text.
+        :param now:     current time, timezone.now() by default
+        :return: dict of entities like those of DucklingExtractor, or None if the text can't be parsed with confidence
+        """
+        tz = self.tz or timezone.get_current_timezone()
+        now = (now or timezone.now()).astimezone(tz)
+        text = text.lower()
+        if _DATE_LIKE_PATTERN.search(text):
+            return None
+        taken = []
+
+        days = [self._parse_day(match, now) for match in self._find(_DAY_PATTERN, text, taken)]
+        days += [self._parse_relative(match, now) for match in self._find(_RELATIVE_PATTERN, text, taken)]
+        times = [self._parse_time(match) for match in self._find(_TIME_PATTERN, text, taken)]
+        ordinals = [self._parse_ordinal(match) for match in self._find(_ORDINAL_PATTERN, text, taken)]
+        numbers = [self._parse_number(match) for match in self._find(_NUMBER_PATTERN, text, taken)]
+
+        rest = ''.join(text[start:end] for start, end in self._gaps(taken, len(text)))
+        if _LOW_CONFIDENCE_PATTERN.search(rest) or None in times:
+            return None
+
+        if times:
+            if len(days) > 1 or len(times) > 1 or (days and (isinstance(days[0], dict) or days[0][1] != 'day')):
+                return None
+            hour, minute = times[0]
+            date = days[0][0].date() if days else now.date()
+            value = self._make_aware(date, hour, minute)
+            if not days and value < now:
+                value = self._make_aware(date + timedelta(days=1), hour, minute)
+            days = [(value, 'hour' if minute is None else 'minute')]
+
+        entities = {}
+        if days:
+            entities['datetime'] = [day if isinstance(day, dict) else self._value(*day) for day in days]
+            entities.update(date_utils.process_datetime(entities['datetime']))
+        if numbers:
+            entities['number'] = [{'type': 'value', 'value': number} for number in numbers]
+        if ordinals:
+            entities['ordinal'] = [{'type': 'value', 'value': ordinal} for ordinal in ordinals]
+        return entities
+
+    @staticmethod
+    def _find(pattern, text, taken):
+        """Yields matches of pattern that don't overlap with spans already taken, and takes their spans."""
+        for match in pattern.finditer(text):
+            start, end = match.span()
+            if any(start < taken_end and taken_start < end for taken_start, taken_end in taken):
+                continue
+            taken.append((start, end))
+            yield match
+
+    @staticmethod
+    def _gaps(taken, length):
+        position = 0
+        for start, end in sorted(taken):
+            yield position, start
+            position = end
+        yield position, length
+
+    def _make_aware(self, date, hour=0, minute=None):
+        naive = datetime.datetime.combine(date, datetime.time(hour, minute or 0))
+        return timezone.make_aware(naive, self.tz or timezone.get_current_timezone())
+
+    @staticmethod
+    def _value(value, grain):
+        return {'type': 'value', 'value': value.isoformat(), 'grain': grain}
+
+    @staticmethod
+    def _interval(date_from, date_to, grain):
+        return {
+            'type': 'interval',
+            'from': {'value': date_from.isoformat(), 'grain': grain},
+            'to': {'value': date_to.isoformat(), 'grain': grain},
+        }
+
+    def _parse_day(self, match, now):
+        """:return: (datetime, grain) of a day, week or month, or an interval dict"""
+        now_, today, day_after, tomorrow, yesterday, tonight, which, period, weekend_which, weekend, \
+            next_weekday, weekday = match.groups()
+        date = now.date()
+        if now_:
+            return now.replace(microsecond=0), 'second'
+        if tonight:
+            return self._interval(self._make_aware(date, 18), self._make_aware(date + timedelta(days=1)), 'hour')
+        if weekend:
+            friday = date + timedelta(days=4 - date.weekday() + (7 if weekend_which == 'next' else 0))
+            return self._interval(self._make_aware(friday, 18), self._make_aware(friday + timedelta(days=3)), 'hour')
+        if period == 'week':
+            monday = date - timedelta(days=date.weekday())
+            return self._make_aware(monday + timedelta(days=7 if which == 'next' else 0)), 'week'
+        if period == 'month':
+            first = date.replace(day=1)
+            if which == 'next':
+                first = (first + timedelta(days=31)).replace(day=1)
+            return self._make_aware(first), 'month'
+        if weekday:
+            if next_weekday:
+                # the weekday of the next week, as Duckling does
+                date += timedelta(days=7 - date.weekday() + WEEKDAYS.index(weekday))
+            else:
+                date += timedelta(days=(WEEKDAYS.index(weekday) - date.weekday() - 1) % 7 + 1)
+            return self._make_aware(date), 'day'
+        offset = 2 if day_after else 1 if tomorrow else -1 if yesterday else 0
+        return self._make_aware(date + timedelta(days=offset)), 'day'
+
+    def _parse_relative(self, match, now):
+        count, unit = match.groups()
+        count = int(count) if count.isdigit() else NUMBER_WORDS.get(count, 1)
+        if unit in ('minute', 'hour'):
+            value = now + timedelta(**{unit + 's': count})
+            return value.replace(second=0, microsecond=0), 'minute'
+        value = now.date() + timedelta(days=count * (7 if unit == 'week' else 1))
+        return self._make_aware(value), 'day'
+
+    @staticmethod
+    def _parse_time(match):
+        """:return: (hour, minute or None), or None if it is not a valid time"""
+        hour, minute, meridiem, hour24, minute24, word, ambiguous = match.groups()
+        if ambiguous:
+            # "at 5" may be in the morning or in the afternoon
+            return None
+        if word:
+            return (12 if word == 'noon' else 0), None
+        if meridiem:
+            hour = int(hour)
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if meridiem == 'p' else 0)
+        else:
+            hour, minute = int(hour24), minute24
+        if hour > 23 or (minute is not None and int(minute) > 59):
+            return None
+        return hour, int(minute) if minute is not None else None
+
+    @staticmethod
+    def _parse_ordinal(match):
+        digits, word = match.groups()
+        return int(digits) if digits else ORDINALS.index(word) + 1
+
+    @staticmethod
+    def _parse_number(match):
+        digits, tens, units, word = match.groups()
+        if digits:
+            return float(digits) if '.' in digits else int(digits)
+        if tens:
+            return NUMBER_WORDS[tens] + NUMBER_WORDS[units]
+        return NUMBER_WORDS[word]
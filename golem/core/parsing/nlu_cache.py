@@ -0,0 +1,182 @@
+"""
+Cache of entities extracted from message texts, shared by entity extractors.
+
+Entries are looked up in a bounded in-process LRU first, then in the session store (Redis),
+where each entry is a separate key with a TTL. Results containing volatile entities,
+such as date intervals relative to the current time, expire sooner.
+
+The in-process tier is capped at LOCAL_SIZE entries, the shared tier at SHARED_SIZE entries per cache:
+keys of the entries are kept in a sorted set by time of setting, and the oldest ones are deleted
+when a new entry would exceed the cap.
+"""
+import hashlib
+import logging
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from golem.core import metrics
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """Returns text with case and whitespace normalized, so that e.g. "Hi", "hi" and "hi " share a cache entry."""
+    return _WHITESPACE.sub(' ', text).strip().casefold()
+
+
+class NLUCache:
+
+    KEY_PREFIX = 'nlu_cache'
+
+    def __init__(self, name, store=None, local_size=1024, shared_size=100000, ttl=7 * 24 * 3600, volatile_ttl=600,
+                 volatile_entities=('date_interval',), normalize=normalize_text):
+        """
+        :param name:                namespace of the entries, usually name of the extractor
+        :param store:               SessionStore of the shared tier, get_session_store() by default, False to disable it
+        :param local_size:          max number of entries in the in-process LRU, 0 to disable it
+        :param shared_size:         max number of entries in the store, the oldest ones are deleted first
+        :param ttl:                 seconds until an entry expires
+        :param volatile_ttl:        seconds until an entry containing any of volatile_entities expires
+        :param volatile_entities:   entities whose values depend on when the text was sent
+        :param normalize:           function normalizing texts to keys, or None to use texts as they are
+        """
+        self.name = name
+        self._store = store
+        self.local_size = local_size
+        self.shared_size = shared_size
+        self.ttl = ttl
+        self.volatile_ttl = volatile_ttl
+        self.volatile_entities = frozenset(volatile_entities)
+        self.normalize = normalize
+        self.local = OrderedDict()  # key -> (expiry timestamp, pickled entities)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_config(name, config: dict = None) -> 'NLUCache':
+        """
+        Creates a cache configured in GOLEM_CONFIG['NLU_CACHE'],
+        a dict with any of LOCAL_SIZE, SHARED_SIZE, TTL, VOLATILE_TTL and NORMALIZE (True or False).
+        """
+        if config is None:
+            from django.conf import settings
+            config = settings.GOLEM_CONFIG.get('NLU_CACHE', {})
+        return NLUCache(
+            name,
+            local_size=config.get('LOCAL_SIZE', 1024),
+            shared_size=config.get('SHARED_SIZE', 100000),
+            ttl=config.get('TTL', 7 * 24 * 3600),
+            volatile_ttl=config.get('VOLATILE_TTL', 600),
+            normalize=normalize_text if config.get('NORMALIZE', True) else None,
+        )
+
+    @property
+    def store(self):
+        if self._store is None:
+            from golem.core.persistence import get_session_store
+            self._store = get_session_store()
+        return self._store
+
+    @property
+    def index_key(self) -> str:
+        """Key of the sorted set of keys in the store, the name is a hash tag, so that they share a cluster slot."""
+        return '{}:{{{}}}'.format(self.KEY_PREFIX, self.name)
+
+    def key(self, text: str) -> str:
+        if self.normalize is not None:
+            text = self.normalize(text)
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return '{}:{}'.format(self.index_key, digest)
+
+    def get(self, text: str):
+        """:return: cached entities of a text, or None"""
+        key = self.key(text)
+        data = self._get_local(key)
+        if data is not None:
+            self._count_hit('local')
+            return pickle.loads(data)
+        if self.store:
+            data = self.store.get(key)
+            if data is not None:
+                self._count_hit('store')
+                # the remaining TTL is not known, so keep it locally for the shorter one at most
+                self._set_local(key, data, self.volatile_ttl)
+                return pickle.loads(data)
+        with self.lock:
+            self.misses += 1
+        metrics.incr('nlu_cache.misses')
+        return None
+
+    def set(self, text: str, entities: dict):
+        ttl = self.volatile_ttl if self.volatile_entities.intersection(entities) else self.ttl
+        if not ttl:
+            return
+        key = self.key(text)
+        data = pickle.dumps(entities, protocol=pickle.HIGHEST_PROTOCOL)
+        self._set_local(key, data, ttl)
+        if self.store:
+            evicted = self.store.set_indexed(key, data, int(ttl), self.index_key, self.shared_size)
+            if evicted:
+                metrics.incr('nlu_cache.evictions', evicted)
+
+    def get_or_extract(self, text: str, extract) -> dict:
+        """
+        Returns cached entities of a text, or extracts and caches them.
+        :param extract:     function extracting entities from the text
+        """
+        entities = self.get(text)
+        if entities is None:
+            entities = extract(text)
+            if entities is not None:
+                self.set(text, entities)
+        return entities
+
+    def clear_local(self):
+        with self.lock:
+            self.local.clear()
+
+    def clear(self):
+        """Deletes all entries of this cache, in this process and in the store."""
+        self.clear_local()
+        if self.store:
+            self.store.delete(self.index_key)
+            for key in self.store.scan_iter(match=self.index_key + ':*'):
+                self.store.delete(key)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'local_size': len(self.local)}
+
+    def _count_hit(self, tier):
+        with self.lock:
+            self.hits += 1
+        metrics.incr('nlu_cache.hits.' + tier)
+
+    def _get_local(self, key):
+        if not self.local_size:
+            return None
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires <= time.time():
+                del self.local[key]
+                return None
+            self.local.move_to_end(key)
+            return data
+
+    def _set_local(self, key, data, ttl):
+        if not self.local_size:
+            return
+        with self.lock:
+            self.local[key] = (time.time() + ttl, data)
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
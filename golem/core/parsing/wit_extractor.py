@@ -1,41 +1,60 @@
 import json
 import logging
-import pickle
-
-from wit import Wit
 
 from golem.core.parsing import date_utils
 from golem.core.parsing.entity_extractor import EntityExtractor
-from golem.core.persistence import get_redis
+from golem.core.parsing.http import get_http_session, get_http_timeout
+from golem.core.parsing.nlu_cache import NLUCache
+from golem.core.persistence import get_session_store
+
+logger = logging.getLogger(__name__)
+
+WIT_API_URL = 'https://api.wit.ai/message'
+WIT_API_VERSION = '20160516'  # same as the wit 4.3.0 client
 
 
 class WitExtractor(EntityExtractor):
 
+    LEGACY_CACHE_KEY = 'wit_cache'  # hash of the cache before NLUCache was used
+    _legacy_cache_deleted = False
+
     def __init__(self, wit_token, enable_cache=True):
         super().__init__()
         self.log = logging.getLogger()
         self.wit_token = wit_token
         if not self.wit_token:
             raise ValueError("Wit token not found!")
-        self.cache_key = 'wit_cache'
-        self.cache = enable_cache
-        # self.clear_wit_cache()
+        self.cache = NLUCache.from_config('wit') if enable_cache else None
+        self._delete_legacy_cache()
 
     def extract_entities(self, text: str, max_retries=5):
-        if max_retries <= 0:
-            self.log.error("Maximal number of Wit retries reached")
-            return {}
+        """Failed requests are retried with backoff by the HTTP session, see golem.core.parsing.http."""
         cached = self._load_from_cache(text)
         if cached: return cached
         try:
-            wit_client = Wit(access_token=self.wit_token, actions={})
-            entities = wit_client.message(text).get('entities', {})
-            entities = self._process_wit_entities(entities)
-            self.save_to_cache(text, entities)
-            return entities
-        except Exception as e:
-            self.log.exception('Wit error:', e)
-            return self.extract_entities(text, max_retries - 1)
+            entities = self._request(text).get('entities', {})
+        except Exception:
+            self.log.exception('Wit error')
+            return {}
+        entities = self._process_wit_entities(entities)
+        self.save_to_cache(text, entities)
+        return entities
+
+    def _request(self, text) -> dict:
+        response = get_http_session().get(
+            WIT_API_URL,
+            params={'q': text},
+            headers={
+                'authorization': 'Bearer ' + self.wit_token,
+                'accept': 'application/vnd.wit.{}+json'.format(WIT_API_VERSION),
+            },
+            timeout=get_http_timeout()
+        )
+        response.raise_for_status()
+        data = response.json()
+        if 'error' in data:
+            raise ValueError('Wit responded with an error: ' + data['error'])
+        return data
 
     def _process_wit_entities(self, entities: dict):
 
@@ -66,31 +85,37 @@ class WitExtractor(EntityExtractor):
 
     def _load_from_cache(self, text):
         if self.cache:
-            db = get_redis()
-            if db.hexists('wit_cache', text):
-                parsed = pickle.loads(db.hget('wit_cache', text))
-                self.log.debug('Got cached wit key: "{}" = {}'.format(self.cache_key, parsed))
-                return parsed
+            return self.cache.get(text)
         return None
 
     def save_to_cache(self, text, entities):
-        if self.cache and 'date_interval' not in entities:
-            db = get_redis()
-            self.log.debug('Caching wit key: {} = {}'.format(text, entities))
-            db.hset('wit_cache', text, pickle.dumps(entities))
+        # date intervals are relative to the time of the message, NLUCache expires them sooner
+        if self.cache:
+            self.cache.set(text, entities)
 
     def clear_wit_cache(self):
         if self.cache:
             self.log.debug('Clearing Wit cache...')
-            db = get_redis()
-            db.delete('wit_cache')
+            self.cache.clear()
+
+    @classmethod
+    def _delete_legacy_cache(cls):
+        """Deletes the hash of the old cache, which grew without bound, once per process."""
+        if cls._legacy_cache_deleted:
+            return
+        try:
+            get_session_store().delete(cls.LEGACY_CACHE_KEY)
+        except Exception:
+            logger.exception('Failed to delete the legacy Wit cache')
+            return
+        cls._legacy_cache_deleted = True
 
 
 def teach_wit(wit_token, entity, values, doc=""):
     import requests
-    logging.warning('*** TEACHING WIT ***')
+    logger.warning('*** TEACHING WIT ***')
     params = {'v':'20160526'}
-    logging.warning('Inserting values of {}'.format(entity))
+    logger.warning('Inserting values of %s', entity)
     rsp = requests.request(
         'PUT',
         'https://api.wit.ai/entities/'+entity,
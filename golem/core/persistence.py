@@ -1,22 +1,793 @@
+import fnmatch
+import importlib
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
 import redis
 from django.conf import settings
 
+from . import metrics
+
 _connection_pool = None
 _redis = None
+_redis_lock = threading.Lock()
+_round_trips = threading.local()
+
+
+def _count_round_trip():
+    _round_trips.count = getattr(_round_trips, 'count', 0) + 1
+
+
+def get_round_trips() -> int:
+    """Returns the number of Redis round trips made by this thread since the last reset."""
+    return getattr(_round_trips, 'count', 0)
+
+
+def reset_round_trips():
+    _round_trips.count = 0
+
+
+class CountingPipeline(redis.client.StrictPipeline):
+    """Pipeline that counts each execution as a single round trip."""
+
+    def execute(self, raise_on_error=True):
+        if self.command_stack:
+            _count_round_trip()
+        return super().execute(raise_on_error=raise_on_error)
+
+
+class CountingRedis(redis.StrictRedis):
+    """Redis client that counts round trips to the server."""
+
+    def execute_command(self, *args, **options):
+        _count_round_trip()
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPoolMixin:
+    """
+    Keeps track of connections in use and callers waiting for a connection, and pings
+    connections that have been idle for longer than health_check_interval seconds before reuse.
+    """
+    health_check_interval = 0
+
+    def reset(self):
+        super().reset()
+        self._stats_lock = threading.Lock()
+        self.in_use = 0
+        self.waiting = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        self._checkpid()  # resets the stats after a fork, before they are updated
+        with self._stats_lock:
+            self.waiting += 1
+        start = time.time()
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except redis.ConnectionError:
+            metrics.incr('redis.pool.exhausted')
+            raise
+        finally:
+            with self._stats_lock:
+                self.waiting -= 1
+        if self.blocking:
+            metrics.observe('redis.pool.wait_ms', (time.time() - start) * 1000)
+        with self._stats_lock:
+            self.in_use += 1
+        self._check_health(connection)
+        return connection
+
+    def release(self, connection):
+        connection.last_used = time.time()
+        with self._stats_lock:
+            self.in_use -= 1
+        super().release(connection)
+
+    def _check_health(self, connection):
+        last_used = getattr(connection, 'last_used', None)
+        if not self.health_check_interval or last_used is None or connection._sock is None:
+            return
+        if time.time() - last_used > self.health_check_interval:
+            try:
+                connection.send_command('PING')
+                connection.read_response()
+            except (redis.ConnectionError, redis.TimeoutError):
+                # the connection is re-established by the next command
+                connection.disconnect()
+
+    def get_stats(self) -> dict:
+        return {
+            'max_connections': self.max_connections,
+            'in_use': self.in_use,
+            'available': self.max_connections - self.in_use,
+            'waiting': self.waiting,
+            'blocking': self.blocking,
+        }
+
+
+class InstrumentedConnectionPool(InstrumentedPoolMixin, redis.ConnectionPool):
+    """Connection pool that raises ConnectionError when all connections are in use."""
+    blocking = False
+
+
+class InstrumentedBlockingConnectionPool(InstrumentedPoolMixin, redis.BlockingConnectionPool):
+    """Connection pool that waits up to timeout seconds for a connection to be released."""
+    blocking = True
+
+
+def build_connection_pool(config: dict):
+    """
+    Creates a connection pool from the REDIS section of GOLEM_CONFIG.
+    :param config:  dict with keys HOST, PORT, PASSWORD, DB, MAX_CONNECTIONS, SOCKET_TIMEOUT,
+                    SOCKET_CONNECT_TIMEOUT, HEALTH_CHECK_INTERVAL, UNIX_SOCKET_PATH, SSL, SSL_CA_CERTS,
+                    BLOCKING and POOL_TIMEOUT, all of them optional
+    """
+    kwargs = {
+        'db': config.get('DB', 0),
+        'password': config.get('PASSWORD'),
+        'socket_timeout': config.get('SOCKET_TIMEOUT'),
+        'max_connections': config.get('MAX_CONNECTIONS', 50),
+    }
+    if config.get('UNIX_SOCKET_PATH'):
+        kwargs['connection_class'] = redis.UnixDomainSocketConnection
+        kwargs['path'] = config['UNIX_SOCKET_PATH']
+    else:
+        kwargs['host'] = config.get('HOST', 'localhost')
+        kwargs['port'] = config.get('PORT', 6379)
+        kwargs['socket_connect_timeout'] = config.get('SOCKET_CONNECT_TIMEOUT')
+        if config.get('SSL'):
+            kwargs['connection_class'] = redis.SSLConnection
+            kwargs['ssl_ca_certs'] = config.get('SSL_CA_CERTS')
+    if config.get('BLOCKING'):
+        pool = InstrumentedBlockingConnectionPool(timeout=config.get('POOL_TIMEOUT', 20), **kwargs)
+    else:
+        pool = InstrumentedConnectionPool(**kwargs)
+    pool.health_check_interval = config.get('HEALTH_CHECK_INTERVAL', 0)
+    return pool
 
 
 def get_redis():
     global _connection_pool
     global _redis
-    if not _connection_pool:
-        config = settings.GOLEM_CONFIG.get('REDIS')
-        _connection_pool = redis.ConnectionPool(
-            host=config['HOST'],
-            port=config['PORT'],
-            password=config['PASSWORD'],
-            db=0,
-            max_connections=2
-        )
     if not _redis:
-        _redis = redis.StrictRedis(connection_pool=_connection_pool)
+        with _redis_lock:
+            if not _redis:
+                _connection_pool = build_connection_pool(settings.GOLEM_CONFIG.get('REDIS'))
+                _redis = CountingRedis(connection_pool=_connection_pool)
     return _redis
+
+
+def get_pool_stats() -> dict:
+    """
+    Returns saturation of the Redis connection pool of this process.
+    :return: dict with keys max_connections, in_use, available, waiting and blocking, or None if not connected
+    """
+    if not _connection_pool:
+        return None
+    return _connection_pool.get_stats()
+
+
+def report_pool_gauges(pool=None):
+    """
+    Records saturation of a connection pool as the gauges redis.pool.in_use, available and waiting.
+    It's registered as a metrics collector, so the gauges are up to date whenever metrics are read.
+    :param pool:    connection pool, the one of this process by default
+    """
+    pool = pool or _connection_pool
+    if not pool:
+        return
+    stats = pool.get_stats()
+    for key in ('in_use', 'available', 'waiting'):
+        metrics.gauge('redis.pool.' + key, stats[key])
+
+
+metrics.register_collector(report_pool_gauges)
+
+
+def session_log_key(chat_id) -> str:
+    """Returns key of the list of context deltas of a chat, it's shared by all layouts."""
+    return 'session_log:{%s}' % chat_id
+
+
+def _save_session_log(pipe, chat_id, fields: dict, log_entry):
+    key = session_log_key(chat_id)
+    if 'context' in fields:
+        # full context replaces all the deltas
+        pipe.delete(key)
+    if log_entry is not None:
+        pipe.rpush(key, log_entry)
+
+
+class GlobalHashLayout:
+    """
+    Legacy storage layout, each session field is kept in a global hash keyed by chat id.
+    """
+    name = 'global'
+
+    HASHES = {
+        'state': 'session_state',
+        'context': 'session_context',
+        'interface': 'session_interface',
+        'session': 'chat_session',
+        'active': 'session_active',
+    }
+
+    def load(self, db, chat_id) -> dict:
+        pipe = db.pipeline()
+        pipe.get('dialog_version')
+        pipe.hget('session_state', chat_id)
+        pipe.hget('session_context', chat_id)
+        pipe.lrange(session_log_key(chat_id), 0, -1)
+        version, state, context, log = pipe.execute()
+        return {'version': version, 'state': state, 'context': context, 'log': log}
+
+    def save(self, db, chat_id, fields: dict, log_entry=None):
+        pipe = db.pipeline()
+        for field, value in fields.items():
+            if field == 'version':
+                pipe.set('dialog_version', value)
+            else:
+                pipe.hset(self.HASHES[field], chat_id, value)
+        _save_session_log(pipe, chat_id, fields, log_entry)
+        pipe.execute()
+
+    def delete(self, db, chat_id):
+        pipe = db.pipeline()
+        for hash_name in self.HASHES.values():
+            pipe.hdel(hash_name, chat_id)
+        pipe.delete(session_log_key(chat_id))
+        pipe.execute()
+
+    def get_field(self, db, chat_id, field):
+        return db.hget(self.HASHES[field], chat_id)
+
+    def iter_sessions(self, db, batch_size=500):
+        """Yields (chat_id, interface name) of all sessions, without blocking Redis."""
+        for chat_id, interface in db.hscan_iter('session_interface', count=batch_size):
+            yield chat_id.decode('utf-8'), interface.decode('utf-8')
+
+
+class PerChatLayout:
+    """
+    Storage layout with a single hash per chat that expires after a period of inactivity.
+    All keys of a chat share the same hash tag, so that they live in the same Redis Cluster slot.
+    """
+    name = 'per_chat'
+    KEY_PREFIX = 'session:'
+
+    def __init__(self, ttl=None, legacy_fallback=True):
+        """
+        :param ttl:             seconds of inactivity after which the session expires, None to keep forever
+        :param legacy_fallback: whether to load sessions that were not migrated yet from the global hashes
+        """
+        self.ttl = ttl
+        self.legacy_fallback = legacy_fallback
+
+    @staticmethod
+    def chat_key(prefix, chat_id) -> str:
+        """Returns key of a chat-specific item, in the same cluster slot as the chat's session."""
+        return '%s{%s}' % (prefix, chat_id)
+
+    def session_key(self, chat_id) -> str:
+        return self.chat_key(self.KEY_PREFIX, chat_id)
+
+    def load(self, db, chat_id) -> dict:
+        pipe = db.pipeline()
+        pipe.hmget(self.session_key(chat_id), ['version', 'state', 'context'])
+        pipe.lrange(session_log_key(chat_id), 0, -1)
+        (version, state, context), log = pipe.execute()
+        if context is None and self.legacy_fallback:
+            stored = GlobalHashLayout().load(db, chat_id)
+            # the next save has to write the whole context, otherwise the session would still be loaded from here
+            stored['legacy'] = stored['context'] is not None
+            return stored
+        return {'version': version, 'state': state, 'context': context, 'log': log}
+
+    def save(self, db, chat_id, fields: dict, log_entry=None):
+        key = self.session_key(chat_id)
+        pipe = db.pipeline()
+        pipe.hmset(key, fields)
+        _save_session_log(pipe, chat_id, fields, log_entry)
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+            pipe.expire(session_log_key(chat_id), self.ttl)
+        pipe.execute()
+
+    def delete(self, db, chat_id):
+        db.delete(self.session_key(chat_id), session_log_key(chat_id))
+        if self.legacy_fallback:
+            # otherwise the session would be loaded from the global hashes again
+            GlobalHashLayout().delete(db, chat_id)
+
+    def get_field(self, db, chat_id, field):
+        value = db.hget(self.session_key(chat_id), field)
+        if value is None and self.legacy_fallback:
+            return GlobalHashLayout().get_field(db, chat_id, field)
+        return value
+
+    def iter_sessions(self, db, batch_size=500):
+        """
+        Yields (chat_id, interface name) of all sessions, without blocking Redis.
+        With legacy fallback, sessions that were not migrated yet are yielded from the global hashes.
+        """
+        match = self.KEY_PREFIX + '{*}'
+        keys = []
+        for key in db.scan_iter(match=match, count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                yield from self._get_interfaces(db, keys)
+                keys = []
+        yield from self._get_interfaces(db, keys)
+        if self.legacy_fallback:
+            sessions = []
+            for session in GlobalHashLayout().iter_sessions(db, batch_size=batch_size):
+                sessions.append(session)
+                if len(sessions) >= batch_size:
+                    yield from self._get_unmigrated(db, sessions)
+                    sessions = []
+            yield from self._get_unmigrated(db, sessions)
+
+    def _get_unmigrated(self, db, sessions):
+        """Yields sessions of the global hashes that don't have a per-chat hash, those were yielded already."""
+        pipe = db.pipeline(transaction=False)
+        for chat_id, _ in sessions:
+            pipe.exists(self.session_key(chat_id))
+        for session, migrated in zip(sessions, pipe.execute()):
+            if not migrated:
+                yield session
+
+    def _get_interfaces(self, db, keys):
+        pipe = db.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(key, 'interface')
+        for key, interface in zip(keys, pipe.execute()):
+            if interface is not None:
+                chat_id = key.decode('utf-8')[len(self.KEY_PREFIX) + 1:-1]
+                yield chat_id, interface.decode('utf-8')
+
+
+def get_session_layout():
+    """Returns the session storage layout set in GOLEM_CONFIG['REDIS']['SESSION_LAYOUT']."""
+    config = settings.GOLEM_CONFIG.get('REDIS', {})
+    name = config.get('SESSION_LAYOUT', GlobalHashLayout.name)
+    if name == PerChatLayout.name:
+        return PerChatLayout(
+            ttl=config.get('SESSION_TTL'),
+            legacy_fallback=config.get('SESSION_LEGACY_FALLBACK', True)
+        )
+    elif name == GlobalHashLayout.name:
+        return GlobalHashLayout()
+    raise ValueError("Unknown session layout {}, use either {} or {}".format(
+        name, GlobalHashLayout.name, PerChatLayout.name
+    ))
+
+
+class SessionStore(ABC):
+    """
+    Storage of chat sessions and other data shared by workers.
+    Besides sessions, it offers a small subset of Redis commands for key-value data, hashes and lists.
+    Values are returned as bytes, the same way as Redis does.
+    """
+
+    @abstractmethod
+    def load_session(self, chat_id) -> dict:
+        """
+        Loads persisted session of a chat.
+        :return: dict with keys version (str), state (str), context (bytes), values are None if not present,
+                 log (list of context deltas saved since the context, oldest first)
+                 and legacy (True if the session has to be saved with the whole context to be migrated)
+        """
+        pass
+
+    @abstractmethod
+    def save_session(self, chat_id, fields: dict, log_entry=None):
+        """
+        Saves session of a chat.
+        :param fields:      dict with session fields to save, any of
+                            version, state, context, interface, session (serialized ChatSession), active (timestamp)
+        :param log_entry:   optional context delta to append to the log, saving a context clears the log
+        """
+        pass
+
+    @abstractmethod
+    def delete_session(self, chat_id):
+        pass
+
+    @abstractmethod
+    def get_session_field(self, chat_id, field):
+        """Loads a single field of a persisted session, see save_session() for field names."""
+        pass
+
+    @abstractmethod
+    def iter_sessions(self):
+        """Yields (chat_id, interface name) of all persisted sessions."""
+        pass
+
+    @abstractmethod
+    def lock(self, chat_id, timeout=None):
+        """
+        Returns a lock of a chat, to be held while processing its messages.
+        :param timeout: seconds after which the lock expires, in case its holder dies
+        :return: object with methods acquire(blocking=True, blocking_timeout=None) and release()
+        """
+        pass
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value, ex=None):
+        """Sets a value, optionally expiring after ex seconds."""
+        pass
+
+    @abstractmethod
+    def set_indexed(self, key, value, ex, index, max_size):
+        """
+        Sets a value expiring after ex seconds and adds its key to index, a sorted set of keys by time of setting,
+        which expires with the last of them. Keys beyond the max_size newest ones are removed from the index
+        and deleted, all at once.
+        :return: number of deleted keys
+        """
+        pass
+
+    @abstractmethod
+    def exists(self, key) -> bool:
+        pass
+
+    @abstractmethod
+    def expire(self, key, seconds):
+        """Sets a key of any type to expire after a number of seconds."""
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    @abstractmethod
+    def scan_iter(self, match=None):
+        """Yields keys matching a glob-style pattern, without blocking other clients for long, to be deleted etc."""
+        pass
+
+    @abstractmethod
+    def hget(self, name, key):
+        pass
+
+    @abstractmethod
+    def hset(self, name, key, value):
+        pass
+
+    @abstractmethod
+    def hdel(self, name, key):
+        pass
+
+    @abstractmethod
+    def hgetall(self, name) -> dict:
+        pass
+
+    @abstractmethod
+    def lpush(self, key, value):
+        pass
+
+    @abstractmethod
+    def lrange(self, key, start, end) -> list:
+        pass
+
+    @abstractmethod
+    def llen(self, key) -> int:
+        pass
+
+    @abstractmethod
+    def pop_list(self, key) -> list:
+        """Atomically returns all values of a list and deletes it."""
+        pass
+
+
+# KEYS: key, index; ARGV: value, ex, score, max_size
+_SET_INDEXED_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+if redis.call('TTL', KEYS[2]) < tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+local evicted = redis.call('ZRANGE', KEYS[2], 0, -tonumber(ARGV[4]) - 1)
+if #evicted > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, #evicted - 1)
+    redis.call('DEL', unpack(evicted))
+end
+return #evicted
+"""
+
+
+class RedisSessionStore(SessionStore):
+    """Session store backed by Redis, sessions are stored using the configured layout."""
+
+    def __init__(self, db=None, layout=None):
+        self.db = db or get_redis()
+        self.layout = layout or get_session_layout()
+        self._set_indexed_script = None
+
+    def load_session(self, chat_id) -> dict:
+        stored = self.layout.load(self.db, chat_id)
+        version, state = stored['version'], stored['state']
+        return {
+            'version': version.decode('utf-8') if version else None,
+            'state': state.decode('utf-8') if state is not None else None,
+            'context': stored['context'],
+            'log': stored['log'],
+            'legacy': stored.get('legacy', False),
+        }
+
+    def save_session(self, chat_id, fields: dict, log_entry=None):
+        self.layout.save(self.db, chat_id, fields, log_entry=log_entry)
+
+    def delete_session(self, chat_id):
+        self.layout.delete(self.db, chat_id)
+
+    def get_session_field(self, chat_id, field):
+        return self.layout.get_field(self.db, chat_id, field)
+
+    def iter_sessions(self):
+        return self.layout.iter_sessions(self.db)
+
+    def lock(self, chat_id, timeout=None):
+        return self.db.lock('lock:{%s}' % chat_id, timeout=timeout, sleep=0.05)
+
+    def get(self, key):
+        return self.db.get(key)
+
+    def set(self, key, value, ex=None):
+        return self.db.set(key, value, ex=ex)
+
+    def set_indexed(self, key, value, ex, index, max_size):
+        # a script, so that eviction is atomic and takes a single round trip;
+        # in Redis Cluster, the keys and the index have to share a hash tag
+        if self._set_indexed_script is None:
+            self._set_indexed_script = self.db.register_script(_SET_INDEXED_SCRIPT)
+        return self._set_indexed_script(keys=[key, index], args=[value, int(ex), time.time(), int(max_size)])
+
+    def exists(self, key) -> bool:
+        return bool(self.db.exists(key))
+
+    def expire(self, key, seconds):
+        return self.db.expire(key, seconds)
+
+    def delete(self, key):
+        return self.db.delete(key)
+
+    def scan_iter(self, match=None):
+        return self.db.scan_iter(match=match, count=500)
+
+    def hget(self, name, key):
+        return self.db.hget(name, key)
+
+    def hset(self, name, key, value):
+        return self.db.hset(name, key, value)
+
+    def hdel(self, name, key):
+        return self.db.hdel(name, key)
+
+    def hgetall(self, name) -> dict:
+        return self.db.hgetall(name)
+
+    def lpush(self, key, value):
+        return self.db.lpush(key, value)
+
+    def lrange(self, key, start, end) -> list:
+        return self.db.lrange(key, start, end)
+
+    def llen(self, key) -> int:
+        return self.db.llen(key)
+
+    def pop_list(self, key) -> list:
+        pipe = self.db.pipeline(transaction=True)
+        pipe.lrange(key, 0, -1)
+        pipe.delete(key)
+        values, _ = pipe.execute()
+        return values
+
+
+def _to_bytes(value) -> bytes:
+    """Encodes a value the same way as Redis does."""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return str(value).encode('utf-8')
+
+
+class _LocalLock:
+    """Wraps threading.Lock to match the interface of Redis locks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, blocking_timeout=None):
+        return self._lock.acquire(blocking, -1 if blocking_timeout is None or not blocking else blocking_timeout)
+
+    def release(self):
+        self._lock.release()
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Session store keeping all data in memory of the current process.
+    Meant for single-node deployments (with Celery tasks running in the same process) and test runs.
+    Its data relies on atomicity of single dict operations, chats are locked with a threading.Lock per chat.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.data = {}
+        self.expires = {}
+        self.locks = {}
+
+    def load_session(self, chat_id) -> dict:
+        session = self.sessions.get(chat_id, {})
+        version, state = session.get('version'), session.get('state')
+        return {
+            'version': version.decode('utf-8') if version else None,
+            'state': state.decode('utf-8') if state is not None else None,
+            'context': session.get('context'),
+            'log': list(session.get('log', ())),
+            'legacy': False,
+        }
+
+    def save_session(self, chat_id, fields: dict, log_entry=None):
+        session = dict(self.sessions.get(chat_id, {}))
+        session.update((field, _to_bytes(value)) for field, value in fields.items())
+        log = () if 'context' in fields else session.get('log', ())
+        session['log'] = tuple(log) + ((_to_bytes(log_entry),) if log_entry is not None else ())
+        self.sessions[chat_id] = session
+
+    def delete_session(self, chat_id):
+        self.sessions.pop(chat_id, None)
+
+    def get_session_field(self, chat_id, field):
+        return self.sessions.get(chat_id, {}).get(field)
+
+    def iter_sessions(self):
+        for chat_id, session in list(self.sessions.items()):
+            interface = session.get('interface')
+            if interface is not None:
+                yield chat_id, interface.decode('utf-8')
+
+    def lock(self, chat_id, timeout=None):
+        # setdefault is atomic, so concurrent callers always get the same lock
+        return self.locks.setdefault(chat_id, _LocalLock())
+
+    def _get(self, key, default=None):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.time():
+            self.delete(key)
+        return self.data.get(key, default)
+
+    def get(self, key):
+        return self._get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = _to_bytes(value)
+        if ex:
+            self.expires[key] = time.time() + ex
+        else:
+            self.expires.pop(key, None)
+        return True
+
+    def set_indexed(self, key, value, ex, index, max_size):
+        self.set(key, value, ex=ex)
+        scores = self._get(index)
+        if scores is None:
+            scores = self.data[index] = {}
+        scores.pop(key, None)
+        scores[key] = time.time()  # dicts keep insertion order, so the oldest keys come first
+        self.expires[index] = max(self.expires.get(index, 0), time.time() + ex)
+        evicted = list(scores)[:max(len(scores) - max_size, 0)]
+        for evicted_key in evicted:
+            del scores[evicted_key]
+            self.delete(evicted_key)
+        return len(evicted)
+
+    def exists(self, key) -> bool:
+        return self._get(key) is not None
+
+    def expire(self, key, seconds):
+        if not self.exists(key):
+            return False
+        self.expires[key] = time.time() + seconds
+        return True
+
+    def delete(self, key):
+        self.expires.pop(key, None)
+        return 1 if self.data.pop(key, None) is not None else 0
+
+    def scan_iter(self, match=None):
+        for key in list(self.data):
+            if (match is None or fnmatch.fnmatchcase(key, match)) and self.exists(key):
+                yield key
+
+    def hget(self, name, key):
+        return self._get(name, {}).get(key)
+
+    def hset(self, name, key, value):
+        self.data.setdefault(name, {})[key] = _to_bytes(value)
+
+    def hdel(self, name, key):
+        return 1 if self._get(name, {}).pop(key, None) is not None else 0
+
+    def hgetall(self, name) -> dict:
+        return {_to_bytes(k): v for k, v in self._get(name, {}).items()}
+
+    def lpush(self, key, value):
+        values = self.data.setdefault(key, [])
+        values.insert(0, _to_bytes(value))
+        return len(values)
+
+    def lrange(self, key, start, end) -> list:
+        values = self._get(key, [])
+        end = len(values) if end == -1 else end + 1
+        return values[start:end]
+
+    def llen(self, key) -> int:
+        return len(self._get(key, []))
+
+    def pop_list(self, key) -> list:
+        self._get(key)  # drop the list if it has expired
+        self.expires.pop(key, None)
+        return self.data.pop(key, [])
+
+
+_session_store = None
+
+
+def get_session_store() -> SessionStore:
+    """
+    Returns the session store set in GOLEM_CONFIG['SESSION_STORE'].
+    It is either 'redis' (default), 'memory' or a dotted path of a SessionStore subclass.
+    """
+    global _session_store
+    if not _session_store:
+        name = settings.GOLEM_CONFIG.get('SESSION_STORE', 'redis')
+        if name == 'redis':
+            _session_store = RedisSessionStore()
+        elif name == 'memory':
+            _session_store = InMemorySessionStore()
+        else:
+            module_name, class_name = name.rsplit('.', maxsplit=1)
+            _session_store = getattr(importlib.import_module(module_name), class_name)()
+    return _session_store
+
+
+class ChatLockTimeout(Exception):
+    pass
+
+
+@contextmanager
+def chat_lock(chat_id, store: SessionStore = None):
+    """
+    Holds the lock of a chat, so that its messages are processed one at a time.
+    The lock expires after GOLEM_CONFIG['CHAT_LOCK_TIMEOUT'] seconds (default 60),
+    waiting for it is limited by GOLEM_CONFIG['CHAT_LOCK_WAIT'] seconds (default 30).
+    :raises ChatLockTimeout: if the lock could not be acquired in time
+    """
+    store = store or get_session_store()
+    lock = store.lock(chat_id, timeout=settings.GOLEM_CONFIG.get('CHAT_LOCK_TIMEOUT', 60))
+    start = time.time()
+    acquired = lock.acquire(blocking=True, blocking_timeout=settings.GOLEM_CONFIG.get('CHAT_LOCK_WAIT', 30))
+    metrics.observe('chat_lock.wait_ms', (time.time() - start) * 1000)
+    if not acquired:
+        metrics.incr('chat_lock.timeouts')
+        raise ChatLockTimeout('Could not acquire lock of chat {}'.format(chat_id))
+    try:
+        yield
+    finally:
+        try:
+            lock.release()
+        except redis.exceptions.LockError:
+            # the lock has expired and may be held by someone else now
+            logging.warning('Lock of chat %s expired before it was released', chat_id)
@@ -1,9 +1,16 @@
+import json
+import struct
+from collections import deque
+from collections.abc import MutableMapping
 from base64 import b64encode, b64decode
+from datetime import datetime, timedelta, timezone
 
 import dateutil.parser
+import msgpack
 import pickle
+import pytz
 
-from golem.core.entity_value import EntityValue
+from golem.core.entity_value import EntityValue, RAW_EMPTY, RAW_VALUE, intern_name
 
 
 # FIXME just pickle the whole thing instead of serializing
@@ -27,4 +34,341 @@ def json_serialize(obj):
     elif isinstance(obj, EntityValue):
         data = b64encode(pickle.dumps(obj))
         return {"__data__": data.decode('utf8'), '__type__': 'entity'}
+    elif isinstance(obj, deque):
+        return list(obj)
     raise TypeError ("Error saving entity value. Type %s not serializable: %s" % (type(obj), obj))
+
+
+# Binary context serialization
+#
+# Contexts are encoded with MessagePack, prefixed with a header holding the schema version.
+# Entity values, tuples and datetimes are stored as MessagePack extension types, so that they are
+# loaded with the same types, other objects are pickled. Blobs without the header are loaded as the legacy JSON format.
+#
+# Since schema version 2, values of each entity are encoded as a separate blob, along with
+# the counter of the newest value. This allows decoding them lazily, see LazyEntities.
+
+CONTEXT_MAGIC = b'\xc1GC'  # 0xc1 is never used by MessagePack nor JSON
+CONTEXT_SCHEMA_VERSION = 2
+
+EXT_ENTITY_VALUE = 1
+EXT_DATETIME = 2
+EXT_PICKLE = 3
+EXT_TUPLE = 4
+EXT_ZONED_DATETIME = 5
+
+
+_EMPTY_RAW = {}
+
+
+def _entity_to_list(entity: EntityValue) -> list:
+    raw = entity._raw
+    if raw is RAW_VALUE:
+        raw, raw_has_value = _EMPTY_RAW, True
+    elif raw is RAW_EMPTY:
+        raw, raw_has_value = _EMPTY_RAW, False
+    else:
+        raw_has_value = 'value' in raw and raw['value'] is entity.value
+        if raw_has_value:
+            raw = {k: v for k, v in raw.items() if k != 'value'}
+    return [entity.value, raw, raw_has_value, entity.timestamp, entity.counter, entity.state_set]
+
+
+def _entity_from_list(name, fields: list) -> EntityValue:
+    value, raw, raw_has_value, timestamp, counter, state_set = fields
+    if not raw:
+        raw = RAW_VALUE if raw_has_value else RAW_EMPTY
+    elif raw_has_value:
+        raw['value'] = value
+    entity = EntityValue.__new__(EntityValue)
+    entity.name = intern_name(name)
+    entity._raw = raw
+    entity.value = value
+    entity.timestamp = timestamp
+    entity.counter = counter
+    entity.state_set = intern_name(state_set)
+    return entity
+
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _datetime_to_bytes(obj: datetime) -> bytes or None:
+    """Encodes a naive datetime or one with a fixed offset, returns None if it has another time zone."""
+    tzinfo = obj.tzinfo
+    if tzinfo is None:
+        return struct.pack('>q', (obj - _EPOCH) // _MICROSECOND)
+    offset = obj.utcoffset()
+    if type(tzinfo) is timezone and tzinfo == timezone(offset) and tzinfo.tzname(None) == timezone(offset).tzname(None):
+        return struct.pack('>qi', (obj - _EPOCH_UTC) // _MICROSECOND, offset // timedelta(seconds=1))
+    return None
+
+
+def _datetime_from_bytes(data: bytes) -> datetime:
+    if len(data) == 8:
+        micros, = struct.unpack('>q', data)
+        return _EPOCH + timedelta(microseconds=micros)
+    micros, offset = struct.unpack('>qi', data)
+    return (_EPOCH_UTC + timedelta(microseconds=micros)).astimezone(timezone(timedelta(seconds=offset)))
+
+
+def _zoned_datetime_to_list(obj: datetime) -> list or None:
+    """Encodes a datetime with a pytz time zone as [UTC microseconds, zone name], or returns None."""
+    zone = getattr(obj.tzinfo, 'zone', None)
+    if not isinstance(zone, str):
+        return None
+    fields = [(obj - _EPOCH_UTC) // _MICROSECOND, zone]
+    try:
+        # e.g. tzinfo=pytz.timezone(...) without localize() has an offset that wouldn't be restored
+        if _zoned_datetime_from_list(fields).tzinfo is not obj.tzinfo:
+            return None
+    except pytz.UnknownTimeZoneError:
+        return None
+    return fields
+
+
+def _zoned_datetime_from_list(fields: list) -> datetime:
+    micros, zone = fields
+    return (_EPOCH_UTC + timedelta(microseconds=micros)).astimezone(pytz.timezone(zone))
+
+
+def _encode_ext(obj, pack):
+    """Returns (ext type code, payload) of an object that has no MessagePack representation."""
+    if isinstance(obj, EntityValue):
+        return EXT_ENTITY_VALUE, pack([obj.name] + _entity_to_list(obj))
+    elif type(obj) is tuple:
+        return EXT_TUPLE, pack(list(obj))
+    elif type(obj) is datetime:
+        data = _datetime_to_bytes(obj)
+        if data is not None:
+            return EXT_DATETIME, data
+        fields = _zoned_datetime_to_list(obj)
+        if fields is not None:
+            return EXT_ZONED_DATETIME, pack(fields)
+    return EXT_PICKLE, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_ext(code, data, unpack):
+    if code == EXT_ENTITY_VALUE:
+        fields = unpack(data)
+        return _entity_from_list(fields[0], fields[1:])
+    elif code == EXT_TUPLE:
+        return tuple(unpack(data))
+    elif code == EXT_DATETIME:
+        return _datetime_from_bytes(data)
+    elif code == EXT_ZONED_DATETIME:
+        return _zoned_datetime_from_list(unpack(data))
+    elif code == EXT_PICKLE:
+        return pickle.loads(data)
+    raise ValueError("Unknown extension type {} in serialized context".format(code))
+
+
+def _default(obj):
+    code, data = _encode_ext(obj, _msgpack_dumps)
+    return msgpack.ExtType(code, data)
+
+
+def _ext_hook(code, data):
+    return _decode_ext(code, data, _msgpack_loads)
+
+
+def _msgpack_dumps(obj) -> bytes:
+    # with strict types, tuples and subclasses of basic types are encoded by _default, so that they keep their type
+    return msgpack.packb(obj, default=_default, use_bin_type=True, strict_types=True)
+
+
+def _msgpack_loads(data: bytes):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+def _encode_entity_values(values: list) -> list:
+    """Encodes values of an entity as [counter of the newest value, blob]."""
+    return [values[0].counter if values else None, _msgpack_dumps([_entity_to_list(value) for value in values])]
+
+
+def _decode_entity_values(name, blob: bytes) -> list:
+    return [_entity_from_list(name, fields) for fields in _msgpack_loads(blob)]
+
+
+class LazyEntities(MutableMapping):
+    """
+    Dict of entity name -> list of EntityValue, which decodes values of an entity on first access.
+    Values that were never accessed are saved again as they were loaded, without re-encoding.
+    """
+
+    def __init__(self, encoded: dict):
+        """
+        :param encoded:     dict of entity name -> [counter of the newest value, blob]
+        """
+        self.encoded = encoded
+        self.decoded = {}
+
+    def __getitem__(self, name):
+        try:
+            return self.decoded[name]
+        except KeyError:
+            pass
+        _, blob = self.encoded.pop(name)
+        values = self.decoded[name] = _decode_entity_values(name, blob)
+        return values
+
+    def __setitem__(self, name, values):
+        self.encoded.pop(name, None)
+        self.decoded[name] = values
+
+    def __delitem__(self, name):
+        if self.encoded.pop(name, None) is None:
+            del self.decoded[name]
+
+    def __contains__(self, name):
+        return name in self.decoded or name in self.encoded
+
+    def __iter__(self):
+        yield from list(self.decoded)
+        yield from list(self.encoded)
+
+    def __len__(self):
+        return len(self.decoded) + len(self.encoded)
+
+    def latest_counter(self, name):
+        """Returns counter of the newest value of an entity without decoding it, or None if it has no values."""
+        if name in self.decoded:
+            values = self.decoded[name]
+            return values[0].counter if values else None
+        return self.encoded[name][0] if name in self.encoded else None
+
+    def encode(self) -> dict:
+        """Returns all entities encoded, only the decoded ones are encoded again."""
+        encoded = dict(self.encoded)
+        for name, values in self.decoded.items():
+            encoded[name] = _encode_entity_values(values)
+        return encoded
+
+
+def binary_dumps(data: dict) -> bytes:
+    """Serializes a context dict to the binary format."""
+    entities = data['entities']
+    if isinstance(entities, LazyEntities):
+        entities = entities.encode()
+    else:
+        entities = {name: _encode_entity_values(values) for name, values in entities.items()}
+    payload = {
+        'counter': data['counter'],
+        'history': data['history'],
+        'entities': entities,
+    }
+    return CONTEXT_MAGIC + bytes((CONTEXT_SCHEMA_VERSION,)) + _msgpack_dumps(payload)
+
+
+def binary_loads(blob: bytes, lazy=False) -> dict:
+    """
+    Deserializes a context dict from the binary format.
+    :param lazy:    if True, values of each entity are decoded on first access
+    """
+    if blob[:len(CONTEXT_MAGIC)] != CONTEXT_MAGIC:
+        raise ValueError("Not a binary serialized context")
+    version = blob[len(CONTEXT_MAGIC)]
+    if version not in (1, CONTEXT_SCHEMA_VERSION):
+        raise ValueError("Unsupported context schema version {}".format(version))
+    payload = _msgpack_loads(blob[len(CONTEXT_MAGIC) + 1:])
+    if version == 1:
+        payload['entities'] = {name: [_entity_from_list(name, fields) for fields in values]
+                               for name, values in payload['entities'].items()}
+    elif lazy:
+        payload['entities'] = LazyEntities(payload['entities'])
+    else:
+        payload['entities'] = {name: _decode_entity_values(name, blob)
+                               for name, (_, blob) in payload['entities'].items()}
+    return payload
+
+
+# Context deltas
+#
+# In incremental persistence mode, each save appends a delta with values added since the previous save
+# to a log, instead of saving the whole context. The log is replayed on top of the last full context.
+
+DELTA_MAGIC = b'\xc1GD'
+DELTA_SCHEMA_VERSION = 1
+
+
+def dumps_context_delta(counter, history, changes) -> bytes:
+    """
+    Serializes changes of a context since the last save.
+    :param changes:     list of (entity name, added EntityValue or None if the entity was cleared)
+    """
+    payload = {
+        'counter': counter,
+        'history': history,
+        'changes': [[name, _entity_to_list(entity) if entity is not None else None] for name, entity in changes],
+    }
+    return DELTA_MAGIC + bytes((DELTA_SCHEMA_VERSION,)) + _msgpack_dumps(payload)
+
+
+def apply_context_deltas(data: dict, deltas, get_max_depth=None) -> dict:
+    """
+    Replays context deltas in order on top of a context dict.
+    :param data:            output of loads_context()
+    :param deltas:          serialized deltas, oldest first
+    :param get_max_depth:   function returning the max number of values kept of an entity, see Context.get_max_depth()
+    """
+    entities = data['entities']
+    for delta in deltas:
+        if delta[:len(DELTA_MAGIC)] != DELTA_MAGIC or delta[len(DELTA_MAGIC)] != DELTA_SCHEMA_VERSION:
+            raise ValueError("Not a supported context delta")
+        payload = _msgpack_loads(delta[len(DELTA_MAGIC) + 1:])
+        data['counter'] = payload['counter']
+        data['history'] = payload['history']
+        for name, fields in payload['changes']:
+            if fields is None:
+                entities.pop(name, None)
+            else:
+                values = entities.setdefault(name, [])
+                values.insert(0, _entity_from_list(name, fields))
+                if get_max_depth is not None:
+                    del values[get_max_depth(name):]
+    return data
+
+
+def json_dumps(data: dict) -> str:
+    """Serializes a context dict to the legacy JSON format."""
+    if isinstance(data['entities'], LazyEntities):
+        data = dict(data, entities=dict(data['entities']))
+    return json.dumps(data, default=json_serialize)
+
+
+def json_loads(blob) -> dict:
+    """Deserializes a context dict from the legacy JSON format."""
+    if isinstance(blob, bytes):
+        blob = blob.decode('utf-8')
+    return json.loads(blob, object_hook=json_deserialize)
+
+
+CONTEXT_SERIALIZERS = {
+    'json': json_dumps,
+    'binary': binary_dumps,
+}
+
+
+def dumps_context(data: dict):
+    """
+    Serializes a context dict using the format set in GOLEM_CONFIG['CONTEXT_SERIALIZER'].
+    :param data:    output of Context.to_dict()
+    :return: str or bytes to be persisted
+    """
+    from django.conf import settings
+    name = settings.GOLEM_CONFIG.get('CONTEXT_SERIALIZER', 'json')
+    if name not in CONTEXT_SERIALIZERS:
+        raise ValueError("Unknown context serializer {}, use one of {}".format(name, list(CONTEXT_SERIALIZERS)))
+    return CONTEXT_SERIALIZERS[name](data)
+
+
+def loads_context(blob, lazy=False) -> dict:
+    """
+    Deserializes a context dict persisted in any of the supported formats.
+    :param lazy:    if True, values of each entity are decoded on first access (binary format only)
+    """
+    if isinstance(blob, bytes) and blob.startswith(CONTEXT_MAGIC):
+        return binary_loads(blob, lazy=lazy)
+    return json_loads(blob)
@@ -3,7 +3,7 @@ import logging
 import time
 import random
 
-from golem.core.persistence import get_redis
+from golem.core.persistence import InMemorySessionStore, get_session_store
 from golem.core.responses.responses import *
 from golem.core.responses.buttons import *
 from django.conf import settings
@@ -122,6 +122,8 @@ class ConversationTest:
         self.name = name
         self.actions = actions
         self.session = ChatSession(unique_id=self.chat_id, interface=TestInterface, is_logged=not self.benchmark, is_test=True)
+        # benchmarks measure the bot itself, so sessions are kept in memory
+        self.store = InMemorySessionStore() if benchmark else get_session_store()
 
     def run(self):
         self.init()
@@ -144,7 +146,7 @@ class ConversationTest:
     def init(self):
         self.buttons = {}
         from .dialog_manager import DialogManager
-        DialogManager.clear_chat(self.session.chat_id)
+        DialogManager.clear_chat(self.session.chat_id, store=self.store)
         TestLog.clear()
         TestInterface.clear()
         
@@ -160,7 +162,7 @@ class ConversationTest:
         if isinstance(action, UserMessage):
             from .dialog_manager import DialogManager
             start_time = time.time() # test_id=self.name, use_logging=not self.benchmark
-            dialog = DialogManager(session=self.session)
+            dialog = DialogManager(session=self.session, store=self.store)
             time_init = time.time() - start_time
             start_time = time.time()
             parsed = action.get_parsed()
@@ -208,7 +210,7 @@ class ConversationTestRecorder:
     @staticmethod
     def record_user_message(message_type, message):
         logging.warning('Recording user {}: {}'.format(message_type, message))
-        db = get_redis()
+        db = get_session_store()
         db.lpush('test_actions', json.dumps({'type':'user', 'body':{'type':message_type,'entities':message}}, default=json_serialize))
 
     @staticmethod
@@ -217,19 +219,19 @@ class ConversationTestRecorder:
         if isinstance(message, TextMessage):
             record['text'] = message.text
         logging.warning('Recording bot message: {}'.format(record))
-        db = get_redis()
+        db = get_session_store()
         db.lpush('test_actions', json.dumps({'type':'bot', 'body':record}))
 
     @staticmethod
     def record_state_change(state):
         logging.warning('Recording state change: {}'.format(state))
-        db = get_redis()
+        db = get_session_store()
         db.lpush('test_actions', json.dumps({'type':'state', 'body':state}))
 
     @staticmethod
     def record_start():
         logging.warning('Starting recording')
-        db = get_redis()
+        db = get_session_store()
         db.delete('test_actions')
         message = TextMessage(text="Starting to record ;)")\
             .add_button(PayloadButton(title="Stop recording", payload={"test_record": "stop"}))
@@ -246,7 +248,7 @@ class ConversationTestRecorder:
 
     @staticmethod
     def get_result():
-        db = get_redis()
+        db = get_session_store()
         actions = db.lrange('test_actions', 0, -1)
         response = """from golem.core.responses import *
 from golem.core.tests import *
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Runs a micro benchmark of the dialog manager'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', nargs=1, type=str)
+        parser.add_argument('--repeat', type=int, default=None)
+
+    def handle(self, *args, **options):
+        from golem import benchmarks
+        from pprint import pprint
+        kwargs = {}
+        if options.get('repeat'):
+            kwargs['repeat'] = options['repeat']
+        report = benchmarks.run(options['name'][0], **kwargs)
+        pprint(report)
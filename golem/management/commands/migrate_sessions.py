@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Incrementally moves sessions from the global Redis hashes to the per-chat layout'
+
+    CURSOR_KEY = 'session_migration_cursor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Number of chats moved at once')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to wait between batches')
+        parser.add_argument('--delete', action='store_true', help='Delete moved sessions from the global hashes')
+        parser.add_argument('--restart', action='store_true', help='Start over instead of resuming')
+
+    def handle(self, *args, **options):
+        from golem.core.persistence import get_redis, GlobalHashLayout, PerChatLayout, get_session_layout
+
+        db = get_redis()
+        layout = get_session_layout()
+        if not isinstance(layout, PerChatLayout):
+            layout = PerChatLayout()
+            self.stdout.write('Warning: SESSION_LAYOUT is not {}, sessions will not expire'.format(layout.name))
+
+        cursor = 0 if options['restart'] else int(db.get(self.CURSOR_KEY) or 0)
+        moved = 0
+        while True:
+            # the global hash of interfaces contains every chat that has a session
+            cursor, interfaces = db.hscan('session_interface', cursor=cursor, count=options['batch_size'])
+            chat_ids = [chat_id.decode('utf-8') for chat_id in interfaces]
+            if chat_ids:
+                self._move(db, layout, chat_ids, GlobalHashLayout.HASHES, options['delete'])
+                moved += len(chat_ids)
+                self.stdout.write('Moved {} sessions'.format(moved))
+            # remember position, so that the migration can be interrupted and resumed
+            db.set(self.CURSOR_KEY, cursor)
+            if cursor == 0:
+                break
+            time.sleep(options['sleep'])
+
+        db.delete(self.CURSOR_KEY)
+        self.stdout.write('Done, moved {} sessions'.format(moved))
+
+    def _move(self, db, layout, chat_ids, hashes: dict, delete: bool):
+        pipe = db.pipeline(transaction=False)
+        version = db.get('dialog_version')
+        for chat_id in chat_ids:
+            for hash_name in hashes.values():
+                pipe.hget(hash_name, chat_id)
+        values = pipe.execute()
+
+        pipe = db.pipeline(transaction=False)
+        fields = list(hashes)
+        for i, chat_id in enumerate(chat_ids):
+            key = layout.session_key(chat_id)
+            session = dict(zip(fields, values[i * len(fields):(i + 1) * len(fields)]))
+            if version is not None:
+                session['version'] = version
+            for field, value in session.items():
+                # never overwrite data already saved by workers using the new layout
+                if value is not None:
+                    pipe.hsetnx(key, field, value)
+            if layout.ttl:
+                pipe.expire(key, layout.ttl)
+            if delete:
+                for hash_name in hashes.values():
+                    pipe.hdel(hash_name, chat_id)
+        pipe.execute()
@@ -1,6 +1,6 @@
-import logging
+import json
 import time
-import traceback
+from contextlib import contextmanager
 
 from celery import shared_task
 from celery.task.schedules import crontab
@@ -10,27 +10,78 @@ from django.conf import settings
 from golem.core import message_logger  # this should register the celery log task
 from golem.core.chat_session import ChatSession
 from golem.core.interfaces.all import create_from_name
-from golem.core.persistence import get_redis
+from golem.core.logging.chat_log import ChatLogger
+from golem.core.message_parser import merge_messages
+from golem.core.persistence import ChatLockTimeout, chat_lock, get_session_store
+from golem.core.serialize import json_deserialize, json_serialize
 
 logger = get_task_logger(__name__)
 
 
-@shared_task
-def accept_user_message(session: dict, raw_message):
+@shared_task(bind=True)
+def accept_user_message(self, session: dict, raw_message):
     from golem.core.dialog_manager import DialogManager
     session = ChatSession.from_json(session)
-    print("Accepting message - chat id {}, message: {}".format(session.chat_id, raw_message))
+    ChatLogger(logger, session.chat_id, stage='accept').debug('Accepting message %s', raw_message)
 
-    dialog = DialogManager(session)
     parsed = session.interface.parse_message(raw_message)
-    _process_message(dialog, parsed)
 
-    should_log_messages = settings.GOLEM_CONFIG.get('SHOULD_LOG_MESSAGES', False)
+    debounce_ms = settings.GOLEM_CONFIG.get('MESSAGE_DEBOUNCE_MS', 0)
+    if debounce_ms:
+        # wait for more messages, the flush scheduled by the last one of them processes them all in order,
+        # including postbacks, so that they are not processed before text messages sent earlier
+        store = get_session_store()
+        key = _pending_messages_key(session.chat_id)
+        count = store.lpush(key, json.dumps(parsed, default=json_serialize))
+        # in case the flush is lost, e.g. when the worker dies
+        store.expire(key, settings.GOLEM_CONFIG.get('MESSAGE_DEBOUNCE_TTL', 3600))
+        accept_pending_messages.apply_async((session.to_json(), count), countdown=debounce_ms / 1000)
+        return True
+
+    with _chat_lock(self, session.chat_id):
+        dialog = DialogManager(session)
+        _process_message(dialog, parsed)
+
+    if 'text' in raw_message:
+        _log_user_message(session, raw_message['text'], dialog)
+    return True  # FIXME
+
+
+@shared_task(bind=True)
+def accept_pending_messages(self, session: dict, count):
+    """
+    Processes messages of a chat received within the debounce window as a single message.
+    :param count:   number of pending messages when this flush was scheduled
+    """
+    from golem.core.dialog_manager import DialogManager
+    session = ChatSession.from_json(session)
+    store = get_session_store()
+    key = _pending_messages_key(session.chat_id)
+    if store.llen(key) != count:
+        # either a newer message has arrived and will flush all of them, or they were already processed
+        return
+
+    with _chat_lock(self, session.chat_id):
+        pending = store.pop_list(key)
+        messages = [json.loads(message.decode('utf-8'), object_hook=json_deserialize) for message in pending[::-1]]
+        if len(messages) > 1:
+            ChatLogger(logger, session.chat_id, stage='accept').info('Merging %d messages', len(messages))
+        for parsed in merge_messages(messages):
+            dialog = DialogManager(session)
+            _process_message(dialog, parsed)
+            text = parsed['entities'].get('_message_text')
+            if text:
+                _log_user_message(session, text[0].get('value'), dialog)
+
 
-    if should_log_messages and 'text' in raw_message:
-        text = raw_message['text']
+def _pending_messages_key(chat_id):
+    return 'pending_messages:{%s}' % chat_id
+
+
+def _log_user_message(session, text, dialog):
+    should_log_messages = settings.GOLEM_CONFIG.get('SHOULD_LOG_MESSAGES', False)
+    if should_log_messages and text:
         message_logger.on_message.delay(session, text, dialog, from_user=True)
-    return True  # FIXME
 
 
 def setup_schedule_callbacks(sender, callback):
@@ -40,7 +91,7 @@ def setup_schedule_callbacks(sender, callback):
 
     for name in callbacks:
         params = callbacks[name]
-        print('Scheduling task {}: {}'.format(name, params))
+        logger.info('Scheduling task %s: %s', name, params)
         if isinstance(params, dict):
             cron = crontab(**params)
         elif isinstance(params, int):
@@ -52,80 +103,101 @@ def setup_schedule_callbacks(sender, callback):
             cron,
             callback.s(name),
         )
-        print(' Scheduled for {}'.format(cron))
+        logger.debug('Scheduled %s for %s', name, cron)
 
 
 def accept_schedule_all_users(callback_name):
-    print('Accepting scheduled callback {}'.format(callback_name))
-    db = get_redis()
-    interface_names = db.hgetall('session_interface')
-    for uid in interface_names:
-        interface_name = interface_names[uid].decode('utf-8')
+    logger.info('Accepting scheduled callback %s', callback_name)
+    for chat_id, interface_name in get_session_store().iter_sessions():
         # TODO revise this
         interface = create_from_name(interface_name)
-        session = ChatSession(interface, uid.decode('utf-8'))
-        accept_schedule_callback(session.to_json(), callback_name)
+        session = ChatSession(interface, chat_id)
+        # a task for each chat, so that a locked chat doesn't hold up the others
+        accept_schedule_callback.delay(session.to_json(), callback_name)
 
 
-@shared_task
-def accept_schedule_callback(session: dict, callback_name):
+@shared_task(bind=True)
+def accept_schedule_callback(self, session: dict, callback_name):
     session = ChatSession.from_json(session)
     from golem.core.dialog_manager import DialogManager
-    db = get_redis()
-    active_time = float(db.hget('session_active', session.chat_id).decode('utf-8'))
-    inactive_seconds = time.time() - active_time
-    print('{} from {} was active {}'.format(session.chat_id, session.interface, active_time))
-    parsed = {
-        'type': 'schedule',
-        'entities': {
-            'intent': '_schedule',
-            '_inactive_seconds': inactive_seconds,
-            '_callback_name': callback_name
+    with _chat_lock(self, session.chat_id):
+        active_time = float(get_session_store().get_session_field(session.chat_id, 'active').decode('utf-8'))
+        inactive_seconds = time.time() - active_time
+        ChatLogger(logger, session.chat_id, stage='schedule').debug('Chat from %s was active %s',
+                                                                    session.interface, active_time)
+        parsed = {
+            'type': 'schedule',
+            'entities': {
+                'intent': '_schedule',
+                '_inactive_seconds': inactive_seconds,
+                '_callback_name': callback_name
+            }
         }
-    }
-    dialog = DialogManager(session)
-    _process_message(dialog, parsed)
+        dialog = DialogManager(session)
+        _process_message(dialog, parsed)
 
 
-@shared_task
-def accept_inactivity_callback(session: dict, context_counter, callback_name, inactive_seconds):
+@shared_task(bind=True)
+def accept_inactivity_callback(self, session: dict, context_counter, callback_name, inactive_seconds):
     session = ChatSession.from_json(session)
     from golem.core.dialog_manager import DialogManager
-    dialog = DialogManager(session)
+    with _chat_lock(self, session.chat_id):
+        dialog = DialogManager(session)
+
+        # User has sent a message, cancel inactivity callback
+        if dialog.context.counter != context_counter:
+            dialog.log.debug('Canceling inactivity callback after user message')
+            return
+
+        parsed = {
+            'type': 'schedule',
+            'entities': {
+                'intent': '_inactive',
+                '_inactive_seconds': inactive_seconds,
+                '_callback_name': callback_name
+            }
+        }
 
-    # User has sent a message, cancel inactivity callback
-    if dialog.context.counter != context_counter:
-        print('Canceling inactivity callback after user message.')
-        return
+        _process_message(dialog, parsed)
 
-    parsed = {
-        'type': 'schedule',
-        'entities': {
-            'intent': '_inactive',
-            '_inactive_seconds': inactive_seconds,
-            '_callback_name': callback_name
-        }
-    }
 
-    _process_message(dialog, parsed)
+@contextmanager
+def _chat_lock(task, chat_id):
+    """
+    Processes messages of a chat one at a time, so that concurrent workers don't overwrite each other's state.
+    If the lock is not acquired in time, the task is retried with exponential backoff (1, 2, 4, ... 30 seconds),
+    at most GOLEM_CONFIG['CHAT_LOCK_MAX_RETRIES'] times (default 5), then the message is dropped.
+    Note that a retried message may be processed after messages of the chat that were received later.
+    """
+    try:
+        with chat_lock(chat_id):
+            yield
+    except ChatLockTimeout as e:
+        retries = task.request.retries
+        max_retries = settings.GOLEM_CONFIG.get('CHAT_LOCK_MAX_RETRIES', 5)
+        log = ChatLogger(logger, chat_id, stage='lock')
+        if retries >= max_retries:
+            log.error('Chat is locked, dropping %s after %d retries', task.name, retries)
+        else:
+            log.warning('Chat is locked, retrying %s', task.name)
+        raise task.retry(exc=e, countdown=min(2 ** retries, 30), max_retries=max_retries)
 
 
 def _process_message(dialog, parsed):
     try:
         dialog.process(parsed['type'], parsed['entities'])
     except Exception as e:
-        print("!!!!!!!!!!!!!!!! EXCEPTION AT MESSAGE QUEUE !!!!!!!!!!!!!!!", e)
-        traceback.print_exc()
+        dialog.log.exception('Exception at message queue')
         dialog.logger.log_error(exception=e, state=dialog.current_state_name)
 
 
-@shared_task
-def fake_move_to_state(chat_id, state: str, entities=()):
+@shared_task(bind=True)
+def fake_move_to_state(self, chat_id, state: str, entities=()):
     # TODO solve chat session saving and restoring
-    session = get_redis().hget("chat_session", chat_id)
+    session = get_session_store().get_session_field(chat_id, 'session')
 
     if not (session and state):
-        logging.warning("ChatSession or State is null")
+        logger.warning("ChatSession or State is null")
         return
 
     import json
@@ -133,9 +205,10 @@ def fake_move_to_state(chat_id, state: str, entities=()):
     session = ChatSession.from_json(session)
     state = str(state)
     from golem.core.dialog_manager import DialogManager
-    logger.debug("Moving chat id {} to state {}".format(session.chat_id, state))
-    dialog = DialogManager(session)
+    logger.debug("Moving chat id %s to state %s", session.chat_id, state)
     msg_data = {'_state': state}
     for k, v in entities:
         msg_data[k] = [{"value": v}]
-    dialog.process('schedule', msg_data)
+    with _chat_lock(self, session.chat_id):
+        dialog = DialogManager(session)
+        dialog.process('schedule', msg_data)
@@ -0,0 +1,27 @@
+import logging
+from unittest import TestCase
+
+from golem.core.logging.chat_log import ChatContextFilter, ChatLogger, configure_logging
+
+
+class TestChatLogger(TestCase):
+
+    def test_fields(self):
+        log = ChatLogger(logging.getLogger('golem.tests.chat'), 'test_1', stage='process')
+        log.extra['state'] = 'default.root'
+        with self.assertLogs('golem.tests.chat', level='INFO') as logs:
+            log.info('Moving to %s', 'help.root', extra={'stage': 'move'})
+        record = logs.records[0]
+        self.assertEqual(record.getMessage(), 'Moving to help.root')
+        self.assertEqual((record.chat_id, record.state, record.stage), ('test_1', 'default.root', 'move'))
+        self.assertEqual(log.extra['stage'], 'process')
+
+        record = logging.makeLogRecord({'msg': 'other'})
+        ChatContextFilter().filter(record)
+        self.assertEqual(record.chat_id, '-')
+
+    def test_levels(self):
+        configure_logging({'golem.tests.quiet': 'warning'})
+        log = ChatLogger(logging.getLogger('golem.tests.quiet'), 'test_1')
+        self.assertFalse(log.isEnabledFor(logging.INFO))
+        self.assertTrue(log.isEnabledFor(logging.WARNING))
@@ -3,6 +3,7 @@ from unittest import TestCase
 from golem.core.chat_session import ChatSession
 from golem.core.context import Context
 from golem.core.dialog_manager import DialogManager
+from golem.core.entity_query import PreparedFilter
 from golem.core.entity_value import EntityValue
 from golem.core.interfaces.test import TestInterface
 
@@ -58,3 +59,75 @@ class TestContext(TestCase):
         context.foo = EntityValue(context, "foo", raw={"value": "foo"})
         self.assertEqual(context.myent.current_v(), "foo")
         self.assertEqual(context.foo.current_v(), "foo")
+
+    def test_set_with(self):
+        context = Context(dialog=self.dialog, entities={}, history=[], counter=0)
+        for i in range(5):
+            context.counter += 1
+            context.product = 'product_{}'.format(i)
+            context.action = 'buy' if i % 2 else 'sell'
+        self.assertEqual(context.product.set_with('action', 'buy').all_v(), ['product_3', 'product_1'])
+        self.assertEqual(context.product.not_set_with('action', 'buy').count(), 3)
+        self.assertEqual(context.product.newer_than(messages=2).set_with('action', 'sell').all_v(), ['product_4'])
+
+    def test_prepared_filter(self):
+        context = Context(dialog=self.dialog, entities={}, history=[], counter=0)
+        for i in range(5):
+            context.counter += 1
+            context.product = 'product_{}'.format(i)
+            context.action = 'buy' if i % 2 else 'sell'
+        prepared = PreparedFilter.from_yaml([
+            {'newer': 3},
+            {'or': [{'set-with': 'action, buy'}, [{'exactly': {'messages': 0}}, {'include-flow': '^def'}]]},
+        ])
+        self.assertEqual(prepared.query(context, 'product').all_v(), ['product_4', 'product_3'])
+        self.assertEqual(prepared.query(context, 'missing').count(), 0)
+        with self.assertRaises(ValueError):
+            PreparedFilter.from_yaml([{'newest': 1}])
+
+    def test_lazy_query(self):
+        context = Context(dialog=self.dialog, entities={}, history=[], counter=0)
+        self.assertFalse(context.product)
+        self.assertIsNone(context.product.include_flow('.*').latest())
+        for i in range(3):
+            context.counter += 1
+            context.product = 'product_{}'.format(i)
+        query = context.product.include_flow('.*').older_than(messages=0)
+        self.assertTrue(query)
+        self.assertEqual(query.latest_v(), 'product_1')
+        self.assertEqual(query.all_v(), ['product_1', 'product_0'])
+        self.assertEqual(context.product.include_flow('.*').current_v(), 'product_2')
+        self.assertEqual(context.product.get_age(), ('product_2', 0))
+        # operands of | and & are still usable afterwards
+        query, other = context.product.include_flow('.*'), context.product.older_than(messages=1)
+        self.assertEqual((query | other).count(), 3)
+        self.assertEqual((query & other).count(), 1)
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(other.count(), 1)
+
+    def test_bounded_history(self):
+        context = Context(dialog=self.dialog, entities={}, history=[], counter=0, max_depth=3,
+                          entity_depths={'intent': 5})
+        # values loaded from storage are plain lists
+        context.entities['old'] = [EntityValue(context, 'old', value=i) for i in range(1, 6)]
+        for i in range(10):
+            context.counter += 1
+            context.add_entities({'intent': 'intent_{}'.format(i), 'product': 'product_{}'.format(i)})
+            self.assertEqual(context.product.newer_than(messages=2).count(), min(i + 1, 2))
+        self.assertEqual(context.intent.count(), 5)
+        self.assertEqual(context.product.all_v(), ['product_9', 'product_8', 'product_7'])
+        context.old = 'new'
+        self.assertEqual(context.old.all_v(), ['new', 1, 2])
+
+    def test_snapshot(self):
+        context = Context(dialog=self.dialog, entities={}, history=[], counter=0)
+        context.intent = 'greeting'
+        context.counter += 1
+        context.add_entities({'intent': 'order', 'product': [{'value': 'tea'}, {'value': 'coffee'}]})
+        snapshot = context.snapshot(max_age=0, first_only=True)
+        self.assertEqual(snapshot['counter'], 1)
+        self.assertEqual([value['value'] for value in snapshot['entities']['product']], ['tea', 'coffee'])
+        self.assertEqual(len(context.snapshot()['entities']['intent']), 2)
+        with self.assertLogs('golem.core.context', level='DEBUG') as logs:
+            context.debug()
+        self.assertIn("product (age 0): ['tea', 'coffee']", '\n'.join(logs.output))
@@ -0,0 +1,45 @@
+import pickle
+from unittest import TestCase
+
+from golem.benchmarks import BenchmarkDialog
+from golem.core.context import Context
+from golem.core.entity_value import EntityValue
+
+# EntityValue(intent='help', confidence=0.9) pickled before __slots__ were added
+LEGACY_PICKLE = b'\x80\x04\x95\xb2\x00\x00\x00\x00\x00\x00\x00\x8c\x17golem.core.entity_value\x94\x8c\x0bEntityValue' \
+                b'\x94\x93\x94)\x81\x94}\x94(\x8c\x04name\x94\x8c\x06intent\x94\x8c\x03raw\x94}\x94(\x8c\x05value' \
+                b'\x94\x8c\x04help\x94\x8c\nconfidence\x94G?\xec\xcc\xcc\xcc\xcc\xcc\xcduh\th\n\x8c\ttimestamp\x94' \
+                b'GA\xd6\xa6W\x00\x00\x00\x00\x8c\x07counter\x94K\x03\x8c\tstate_set\x94\x8c\x0cdefault.root\x94ub.'
+
+
+class TestEntityValue(TestCase):
+
+    def setUp(self):
+        self.context = Context(dialog=BenchmarkDialog('help.root'), entities={}, history=[], counter=1)
+
+    def test_raw(self):
+        plain = EntityValue(self.context, 'intent', raw={'value': 'help'})
+        self.assertIsNone(plain._raw)
+        self.assertEqual(plain.get('value'), 'help')
+        self.assertIn('value', plain)
+        self.assertNotIn('confidence', plain)
+        self.assertEqual(plain.raw, {'value': 'help'})
+
+        value_only = EntityValue(self.context, 'intent', value='help')
+        self.assertEqual(value_only.raw, {})
+        self.assertNotIn('value', value_only)
+
+        full = EntityValue(self.context, 'intent', raw={'value': 'help', 'confidence': 0.9})
+        self.assertEqual(full['confidence'], 0.9)
+        self.assertIs(full.state_set, plain.state_set)
+        self.assertFalse(hasattr(full, '__dict__'))
+
+    def test_pickle(self):
+        entity = EntityValue(self.context, 'intent', raw={'value': 'help'})
+        loaded = pickle.loads(pickle.dumps(entity))
+        self.assertEqual((loaded.name, loaded.value, loaded.raw), ('intent', 'help', {'value': 'help'}))
+
+        legacy = pickle.loads(LEGACY_PICKLE)
+        self.assertEqual(legacy.value, 'help')
+        self.assertEqual(legacy['confidence'], 0.9)
+        self.assertEqual((legacy.counter, legacy.state_set), (3, 'default.root'))
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from golem.core.flow_registry import build_flow_registry
+
+FLOWS_YAML = """
+default:
+  states:
+  - name: 'root'
+    action:
+      text: "Hello!"
+
+help:
+  intent: "help"
+  accepts: ["question", "topic"]
+  states:
+  - name: 'root'
+    action:
+      text: "How can I help?"
+"""
+
+
+class TestFlowRegistry(TestCase):
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.base_dir, 'flows.yml'), 'w') as f:
+            f.write(FLOWS_YAML)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_dir)
+
+    def test_build(self):
+        registry = build_flow_registry(['flows.yml'], base_dir=self.base_dir)
+        self.assertEqual(set(registry.flows), {'default', 'help'})
+        self.assertIsNotNone(registry.get_flow('help').get_state('root'))
+        self.assertFalse(registry.has_changed_files())
+        with self.assertRaises(TypeError):
+            registry.flows['foo'] = None
+
+    def test_entity_index(self):
+        registry = build_flow_registry(['flows.yml'], base_dir=self.base_dir)
+        self.assertEqual(registry.get_state_for_entities(['foo', 'topic']), 'help.root')
+        self.assertIsNone(registry.get_state_for_entities(['foo']))
+
+    def test_version(self):
+        first = build_flow_registry(['flows.yml'], base_dir=self.base_dir)
+        second = build_flow_registry(['flows.yml'], base_dir=self.base_dir)
+        self.assertEqual(first.version, second.version)
+
+        path = os.path.join(self.base_dir, 'flows.yml')
+        with open(path, 'a') as f:
+            f.write("\nbye:\n  states:\n  - name: 'root'\n    action:\n      text: 'Bye!'\n")
+        mtime = first.sources[path]
+        os.utime(path, (mtime + 10, mtime + 10))
+        self.assertTrue(first.has_changed_files())
+
+        changed = build_flow_registry(['flows.yml'], base_dir=self.base_dir)
+        self.assertNotEqual(first.version, changed.version)
+        self.assertIn('bye', changed.flows)
+
+    def test_resolve_state(self):
+        registry = build_flow_registry(['flows.yml'], base_dir=self.base_dir)
+        resolved = registry.resolve_state('help.root:')
+        self.assertEqual((resolved.name, resolved.flow.name, resolved.run_action), ('help.root', 'help', True))
+        self.assertIs(resolved.state, registry.get_flow('help').get_state('root'))
+        self.assertEqual(registry.resolve_state('root', 'default').name, 'default.root')
+        self.assertTrue(registry.resolve_state('root:', 'help').run_action)
+        self.assertIsNone(registry.resolve_state('root'))
+        self.assertIsNone(registry.resolve_state('help.missing'))
@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import TestCase
+
+from django.test import override_settings
+
+from golem.core.parsing import http
+from golem.core.parsing.duckling_extractor import DucklingExtractor
+from golem.core.parsing.entity_extractor import time_limit
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class DucklingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    requests = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        DucklingHandler.requests += 1
+        # the first request fails, so that it is retried
+        status, body = (503, b'') if DucklingHandler.requests == 1 else \
+            (200, json.dumps([{'dim': 'number', 'value': {'value': 3}}]).encode('utf-8'))
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHTTPSession(TestCase):
+
+    def setUp(self):
+        http._session = None
+        self.server = ThreadingServer(('127.0.0.1', 0), DucklingHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        if http._session is not None:
+            http._session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        http._session = None
+
+    @override_settings(GOLEM_CONFIG={'NLU_HTTP': {'RETRIES': 2, 'BACKOFF_FACTOR': 0, 'READ_TIMEOUT': 2},
+                                      'NLU_EXTRACTOR_TIMEOUT': 30, 'NLU_DEADLINE': 30})
+    def test_retries(self):
+        DucklingHandler.requests = 0
+        extractor = DucklingExtractor('http://127.0.0.1:{}'.format(self.server.server_port))
+        self.assertEqual(extractor.extract_entities('three'), {'number': [{'value': 3}]})
+        self.assertEqual(extractor.extract_entities('three'), {'number': [{'value': 3}]})
+        self.assertEqual(DucklingHandler.requests, 3)
+        self.assertIs(http.get_http_session(), http.get_http_session())
+        self.assertEqual(http.get_http_timeout(), (3.05, 2))
+
+    @override_settings(GOLEM_CONFIG={'NLU_HTTP': {'RETRIES': 2, 'BACKOFF_FACTOR': 0},
+                                      'NLU_EXTRACTOR_TIMEOUT': 30, 'NLU_DEADLINE': 30})
+    def test_time_limit(self):
+        DucklingHandler.requests = 0
+        extractor = DucklingExtractor('http://127.0.0.1:{}'.format(self.server.server_port))
+        with time_limit(time.monotonic() + 3):
+            connect, read = http.get_http_timeout()
+            self.assertLessEqual(connect + read, 3)
+        # out of time, so the failed request is not retried
+        with time_limit(time.monotonic() - 1):
+            self.assertEqual(extractor.extract_entities('three'), {})
+        self.assertEqual(DucklingHandler.requests, 1)
+
+    @override_settings(GOLEM_CONFIG={'NLU_EXTRACTOR_TIMEOUT': 5})
+    def test_limits(self):
+        connect, read, retries = http.get_http_limits()
+        # defaults of 3 retries with backoff don't fit in 5 seconds
+        self.assertEqual(retries, 1)
+        self.assertLessEqual((connect + read) * (retries + 1) + 0.3, 5)
+        self.assertEqual(http.get_http_limits(budget=3), (1, 2, 0))
+        with override_settings(GOLEM_CONFIG={'NLU_EXTRACTOR_TIMEOUT': None, 'NLU_DEADLINE': None}):
+            self.assertEqual(http.get_http_limits(), (3.05, 10, 3))
@@ -0,0 +1,43 @@
+import re
+from unittest import TestCase
+
+from golem.core.flow import Flow, State
+from golem.core.intent_router import FlowIntentRouter, IntentRouter
+
+
+class TestIntentRouter(TestCase):
+
+    ROUTES = [
+        ('help', 'help.root'),
+        ('greeting|hello', 'greeting.root'),
+        ('order_.*', 'order.root'),
+        ('order_pizza', 'pizza.root'),
+        ('he', 'he.root'),
+        ('(yes)|(no)', 'answer.root'),
+    ]
+
+    def scan(self, intent):
+        for pattern, target in self.ROUTES:
+            if re.match(pattern, intent):
+                return target
+        return None
+
+    def test_first_match(self):
+        router = IntentRouter(self.ROUTES)
+        for intent in ['help', 'helpme', 'hello', 'hey', 'order_pizza', 'pizza', 'no', 'yes', '']:
+            self.assertEqual(router.route(intent), self.scan(intent), intent)
+            self.assertEqual(router.route(intent), self.scan(intent), intent)
+        self.assertIsNone(router.route(None))
+
+    def test_flow_intents(self):
+        # intents of flows are matched the other way round, the intent is the pattern
+        flows = [Flow(name=name, states={'root': State('root', action=None)}, intent=intent)
+                 for name, intent in [('help', None), ('greeting', 'greeting'), ('order', 'order_pizza')]]
+        router = FlowIntentRouter((flow.intent, flow.name + '.root') for flow in flows)
+        for intent in ['help', 'greet', 'greeting_long', 'order_.*', 'pizza', '.*', 'he|gr']:
+            expected = next((flow.name + '.root' for flow in flows if flow.matches_intent(intent)), None)
+            self.assertEqual(router.route(intent), expected, intent)
+        self.assertEqual(router.route('greet'), 'greeting.root')
+        self.assertIsNone(router.route('greeting_long'))
+        self.assertEqual(router.route('order_.*'), 'order.root')
+        self.assertEqual(len(router), 3)
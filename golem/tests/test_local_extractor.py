@@ -0,0 +1,60 @@
+import datetime
+from unittest import TestCase
+
+import pytz
+
+from golem.core.parsing.entity_extractor import EntityExtractor
+from golem.core.parsing.local_extractor import LocalExtractor
+
+TZ = pytz.timezone('Europe/Prague')
+NOW = TZ.localize(datetime.datetime(2018, 3, 7, 14, 30))  # Wednesday
+
+
+class FallbackExtractor(EntityExtractor):
+
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    def extract_entities(self, text: str, max_retries=1):
+        self.texts.append(text)
+        return {'fallback': [{'value': text}]}
+
+
+class TestLocalExtractor(TestCase):
+
+    def setUp(self):
+        self.extractor = LocalExtractor(fallback=FallbackExtractor(), tz=TZ)
+
+    def parse(self, text):
+        return self.extractor.parse(text, now=NOW)
+
+    def interval(self, text):
+        return [value['value'] for value in self.parse(text)['date_interval']]
+
+    def test_dates(self):
+        def day(month, day, hour=0, minute=0):
+            return TZ.localize(datetime.datetime(2018, month, day, hour, minute))
+
+        self.assertEqual(self.parse('tomorrow')['datetime'], [{'value': day(3, 8), 'grain': 'day'}])
+        self.assertEqual(self.interval('next week'), [(day(3, 12), day(3, 19))])
+        self.assertEqual(self.interval('on Friday at 5:30 pm'), [(day(3, 9, 17, 30), day(3, 9, 17, 31))])
+        # the time has passed today
+        self.assertEqual(self.interval('10am'), [(day(3, 8, 10), day(3, 8, 11))])
+        self.assertEqual(self.interval('tonight'), [(day(3, 7, 18), day(3, 8) - datetime.timedelta(seconds=1))])
+        self.assertEqual(self.interval('in 2 hours'), [(day(3, 7, 16, 30), day(3, 7, 16, 31))])
+        self.assertEqual(self.interval('monday or next tuesday'), [(day(3, 12), day(3, 13)), (day(3, 13), day(3, 14))])
+
+    def test_numbers(self):
+        self.assertEqual(self.parse('3 tickets for twenty one'),
+                         {'number': [{'type': 'value', 'value': 3}, {'type': 'value', 'value': 21}]})
+        self.assertEqual(self.parse('the 2nd and the third'),
+                         {'ordinal': [{'type': 'value', 'value': 2}, {'type': 'value', 'value': 3}]})
+        self.assertEqual(self.parse('hello'), {})
+
+    def test_fallback(self):
+        for text in ['12. March', '12/3', 'at 5', 'two days ago', '$5', 'friday morning']:
+            self.assertIsNone(self.parse(text), text)
+        self.assertEqual(self.extractor.extract_entities('at 5'), {'fallback': [{'value': 'at 5'}]})
+        self.assertEqual(self.extractor.extract_entities('5 pm')['datetime'][0]['grain'], 'hour')
+        self.assertEqual(self.extractor.fallback.texts, ['at 5'])
@@ -0,0 +1,115 @@
+import threading
+import time
+from unittest import TestCase
+
+from django.test import override_settings
+
+from golem.core import metrics
+from golem.core import message_parser
+from golem.core.message_parser import extract_entities, merge_messages, parse_additional_entities
+from golem.core.parsing.entity_extractor import EntityExtractor, get_time_left
+
+
+class FakeExtractor(EntityExtractor):
+
+    def __init__(self, entities, delay=0.0, timeout=None):
+        super().__init__()
+        self.entities = entities
+        self.delay = delay
+        self.timeout = timeout
+
+    def extract_entities(self, text: str, max_retries=5):
+        time.sleep(self.delay)
+        if self.entities is None:
+            raise ValueError('NLU is down')
+        return self.entities
+
+
+class HangingExtractor(EntityExtractor):
+    """Waits for a response that never comes, as long as it has time, like a request with get_http_timeout()."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def extract_entities(self, text: str, max_retries=5):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        threading.Event().wait(get_time_left())
+        with self.lock:
+            self.running -= 1
+        raise TimeoutError('No response')
+
+
+class TestMergeMessages(TestCase):
+
+    def test_merge(self):
+        messages = [
+            {'type': 'message', 'entities': {'_message_text': [{'value': 'I want'}], 'intent': [{'value': 'order'}]}},
+            {'type': 'message', 'entities': {'_message_text': [{'value': 'a pizza'}], 'product': [{'value': 'pizza'}]}},
+            {'type': 'message', 'entities': {'emoji': 'thumbs_up_sign', '_message_text': None}},
+            {'type': 'postback', 'entities': {'intent': 'yes', '_message_text': [{'value': None}]}},
+            {'type': 'message', 'entities': {'_message_text': [{'value': 'thanks'}]}},
+        ]
+        merged = merge_messages(messages)
+        self.assertEqual([parsed['type'] for parsed in merged], ['message', 'postback', 'message'])
+        self.assertEqual(merged[0]['entities'], {
+            '_message_text': [{'value': 'I want a pizza'}],
+            'intent': [{'value': 'order'}],
+            'product': [{'value': 'pizza'}],
+            'emoji': [{'value': 'thumbs_up_sign'}],
+        })
+        self.assertEqual(merged[2]['entities'], {'_message_text': [{'value': 'thanks'}]})
+
+
+class TestExtractEntities(TestCase):
+
+    @override_settings(GOLEM_CONFIG={'NLU_EXTRACTOR_TIMEOUT': 1})
+    def test_partial_results(self):
+        metrics.reset()
+        extractors = [
+            FakeExtractor({'intent': [{'value': 'order'}]}, delay=0.05),
+            FakeExtractor({'intent': [{'value': 'slow'}]}, delay=0.5, timeout=0.1),
+            FakeExtractor(None),
+            FakeExtractor({'intent': [{'value': 'buy'}], 'product': [{'value': 'pizza'}]}),
+        ]
+        start = time.monotonic()
+        entities = extract_entities('I want a pizza', extractors)
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(entities, {'intent': [{'value': 'order'}, {'value': 'buy'}], 'product': [{'value': 'pizza'}]})
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters'], {'nlu.extractor_timeouts': 1, 'nlu.extractor_errors': 1})
+        self.assertEqual(snapshot['observations']['nlu.extractor_ms.FakeExtractor']['count'], 3)
+
+    @override_settings(GOLEM_CONFIG={'NLU_EXTRACTOR_TIMEOUT': 0.2, 'NLU_MAX_WORKERS': 2})
+    def test_hanging_extractor(self):
+        message_parser._executor = None
+        hanging = HangingExtractor()
+        extractors = [hanging, FakeExtractor({'intent': [{'value': 'order'}]})]
+        try:
+            # the hanging extractor gives up in time, so it doesn't take the pool from the next messages
+            for text in ['I want a pizza', 'and a beer', 'please']:
+                self.assertEqual(extract_entities(text, extractors), {'intent': [{'value': 'order'}]})
+            self.assertEqual(hanging.calls, 3)
+            # calls of extractors that aren't thread safe are serialized
+            hanging.thread_safe = False
+            extract_entities('thanks', [hanging, hanging])
+        finally:
+            message_parser.get_extractor_executor().shutdown()
+            message_parser._executor = None
+        self.assertEqual(hanging.max_running, 1)
+
+
+class TestAdditionalEntities(TestCase):
+
+    def test_same_as_legacy(self):
+        from golem.benchmarks.message_preprocessing import MESSAGES, legacy_parse_additional_entities
+        for message in MESSAGES + ['at 10:30:00 :)', ':smile: <3', '']:
+            self.assertEqual(parse_additional_entities(message), legacy_parse_additional_entities(message), message)
+        self.assertEqual(parse_additional_entities('ok :)'), {'emoji': [{'value': 'slightly_smiling_face'}]})
+        self.assertEqual(parse_additional_entities('Dobrý den'), {})
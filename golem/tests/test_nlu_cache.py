@@ -0,0 +1,83 @@
+from unittest import TestCase
+
+from golem.core import metrics
+from golem.core.parsing.nlu_cache import NLUCache, normalize_text
+from golem.core.persistence import InMemorySessionStore, RedisSessionStore
+
+
+class TestNLUCache(TestCase):
+
+    def setUp(self):
+        self.store = InMemorySessionStore()
+        self.cache = NLUCache('test', store=self.store, local_size=2)
+
+    def test_normalization(self):
+        self.assertEqual(normalize_text('  Hi\tthere '), 'hi there')
+        self.cache.set('Hi', {'intent': [{'value': 'greeting'}]})
+        self.assertEqual(self.cache.get('hi '), {'intent': [{'value': 'greeting'}]})
+        self.assertIsNone(NLUCache('test', store=self.store, normalize=None).get('hi '))
+
+    def test_tiers(self):
+        metrics.reset()
+        calls = []
+
+        def extract(text):
+            calls.append(text)
+            return {'intent': [{'value': text}]}
+
+        for text in ['a', 'b', 'c', 'a', 'c']:
+            self.cache.get_or_extract(text, extract)
+        self.assertEqual(calls, ['a', 'b', 'c'])
+        # 'a' was evicted from the local LRU, but found in the store
+        self.assertEqual(metrics.snapshot()['counters'],
+                         {'nlu_cache.misses': 3, 'nlu_cache.hits.store': 1, 'nlu_cache.hits.local': 1})
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 3, 'local_size': 2})
+        # cached values are copies
+        self.cache.get('c')['intent'].append('foo')
+        self.assertEqual(self.cache.get('c'), {'intent': [{'value': 'c'}]})
+
+    def test_ttl(self):
+        self.cache.set('tomorrow', {'date_interval': [{'value': 'tomorrow'}]})
+        self.cache.set('hi', {'intent': [{'value': 'greeting'}]})
+        expires = self.store.expires
+        self.assertAlmostEqual(expires[self.cache.key('tomorrow')] - expires[self.cache.key('hi')],
+                               self.cache.volatile_ttl - self.cache.ttl, delta=1)
+        key = self.cache.key('hi')
+        self.cache.local[key] = (0, self.cache.local[key][1])
+        self.store.expires[key] = 0
+        self.assertIsNone(self.cache.get('hi'))
+
+    def test_clear(self):
+        other = NLUCache('other', store=self.store)
+        self.cache.set('hi', {'intent': [{'value': 'greeting'}]})
+        other.set('hi', {'intent': [{'value': 'greeting'}]})
+        self.cache.clear()
+        self.assertEqual(self.cache.stats()['local_size'], 0)
+        self.assertIsNone(self.store.get(self.cache.key('hi')))
+        other.clear_local()
+        self.assertIsNotNone(other.get('hi'))
+
+    def test_shared_size(self):
+        for store in [self.store, RedisSessionStore()]:
+            cache = NLUCache('test_shared_size', store=store, local_size=0, shared_size=2)
+            cache.clear()
+            metrics.reset()
+            for text in ['a', 'b', 'c', 'a']:
+                cache.set(text, {'intent': [{'value': text}]})
+            # 'a' was evicted by 'c', then 'b' by 'a' again
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.get('c'), {'intent': [{'value': 'c'}]})
+            self.assertEqual(cache.get('a'), {'intent': [{'value': 'a'}]})
+            self.assertEqual(metrics.snapshot()['counters']['nlu_cache.evictions'], 2)
+            cache.clear()
+            self.assertFalse(store.exists(cache.index_key))
+            self.assertIsNone(cache.get('c'))
+
+    def test_legacy_wit_cache(self):
+        from golem.core.parsing.wit_extractor import WitExtractor
+        from golem.core.persistence import get_session_store
+        store = get_session_store()
+        store.hset(WitExtractor.LEGACY_CACHE_KEY, 'hi', '{}')
+        WitExtractor._legacy_cache_deleted = False
+        WitExtractor('token', enable_cache=False)
+        self.assertFalse(store.exists(WitExtractor.LEGACY_CACHE_KEY))
@@ -0,0 +1,151 @@
+import threading
+import time
+from unittest import TestCase
+
+import redis
+from django.test import override_settings
+
+from golem.core import metrics
+from golem.core.chat_session import ChatSession
+from golem.core.dialog_manager import DialogManager
+from golem.core.interfaces.test import TestInterface
+from golem.core.persistence import (
+    ChatLockTimeout, GlobalHashLayout, InMemorySessionStore, InstrumentedBlockingConnectionPool,
+    InstrumentedConnectionPool, PerChatLayout, RedisSessionStore, build_connection_pool, chat_lock, get_redis,
+    report_pool_gauges
+)
+
+
+class TestInMemorySessionStore(TestCase):
+
+    def setUp(self):
+        self.store = InMemorySessionStore()
+
+    def test_session(self):
+        self.assertEqual(self.store.load_session('1'), {'version': None, 'state': None, 'context': None, 'log': [], 'legacy': False})
+        self.store.save_session('1', {'version': '1.0', 'state': 'default.root', 'context': b'{}',
+                                      'interface': 'test', 'active': 123.5})
+        self.store.save_session('1', {'state': 'help.root'})
+        self.store.save_session('1', {}, log_entry=b'delta')
+        self.assertEqual(self.store.load_session('1'),
+                         {'version': '1.0', 'state': 'help.root', 'context': b'{}', 'log': [b'delta'], 'legacy': False})
+        self.store.save_session('1', {'context': b'{}'})
+        self.assertEqual(self.store.load_session('1')['log'], [])
+        self.assertEqual(self.store.get_session_field('1', 'active'), b'123.5')
+        self.assertEqual(list(self.store.iter_sessions()), [('1', 'test')])
+        self.store.delete_session('1')
+        self.assertIsNone(self.store.get_session_field('1', 'state'))
+
+    def test_commands(self):
+        self.store.set('key', 'value', ex=60)
+        self.assertTrue(self.store.exists('key'))
+        self.assertEqual(self.store.get('key'), b'value')
+        self.store.set('expired', 'value', ex=1)
+        self.store.expires['expired'] = time.time() - 1
+        self.assertIsNone(self.store.get('expired'))
+
+        self.store.hset('hash', 'a', 1)
+        self.assertEqual(self.store.hgetall('hash'), {b'a': b'1'})
+        self.store.hdel('hash', 'a')
+        self.assertIsNone(self.store.hget('hash', 'a'))
+
+        self.store.lpush('list', 'a')
+        self.store.lpush('list', 'b')
+        self.assertEqual(self.store.lrange('list', 0, -1), [b'b', b'a'])
+        self.assertEqual(self.store.lrange('list', 0, 0), [b'b'])
+        self.assertTrue(self.store.expire('list', 60))
+        self.assertFalse(self.store.expire('missing', 60))
+
+    def test_chat_lock(self):
+        def process():
+            with chat_lock('1', store=self.store):
+                counter = int(self.store.get_session_field('1', 'counter') or 0)
+                time.sleep(0.001)
+                self.store.save_session('1', {'counter': counter + 1})
+
+        threads = [threading.Thread(target=process) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.store.get_session_field('1', 'counter'), b'10')
+
+        with override_settings(GOLEM_CONFIG={'CHAT_LOCK_WAIT': 0.01}):
+            with chat_lock('1', store=self.store):
+                with self.assertRaises(ChatLockTimeout):
+                    with chat_lock('1', store=self.store):
+                        pass
+
+
+class TestConnectionPool(TestCase):
+
+    def test_config(self):
+        pool = build_connection_pool({'HOST': 'localhost', 'PORT': 6379, 'PASSWORD': None})
+        self.assertIsInstance(pool, InstrumentedConnectionPool)
+        self.assertEqual(pool.max_connections, 50)
+
+        pool = build_connection_pool({'UNIX_SOCKET_PATH': '/tmp/redis.sock', 'BLOCKING': True,
+                                      'MAX_CONNECTIONS': 4, 'POOL_TIMEOUT': 0.01, 'HEALTH_CHECK_INTERVAL': 30})
+        self.assertIsInstance(pool, InstrumentedBlockingConnectionPool)
+        self.assertEqual(pool.connection_kwargs['path'], '/tmp/redis.sock')
+        self.assertEqual(pool.health_check_interval, 30)
+
+    def test_stats(self):
+        pool = build_connection_pool({'BLOCKING': True, 'MAX_CONNECTIONS': 2, 'POOL_TIMEOUT': 0.01})
+        connections = [pool.get_connection('GET') for _ in range(2)]
+        self.assertEqual(pool.get_stats()['in_use'], 2)
+        self.assertEqual(pool.get_stats()['available'], 0)
+        self.assertRaises(redis.ConnectionError, pool.get_connection, 'GET')
+        self.assertEqual(pool.get_stats()['waiting'], 0)
+        collector = lambda: report_pool_gauges(pool)
+        metrics.register_collector(collector)
+        try:
+            self.assertEqual(metrics.snapshot()['gauges']['redis.pool.in_use'], 2)
+        finally:
+            metrics.unregister_collector(collector)
+        for connection in connections:
+            pool.release(connection)
+        self.assertEqual(pool.get_stats()['in_use'], 0)
+
+
+class TestPerChatLayout(TestCase):
+
+    def setUp(self):
+        self.db = get_redis()
+        self.legacy_store = RedisSessionStore(self.db, GlobalHashLayout())
+        self.store = RedisSessionStore(self.db, PerChatLayout())
+        self.session = ChatSession(TestInterface, 'test_per_chat')
+        self.chat_ids = [self.session.chat_id, 'test_legacy', 'test_migrated']
+        for chat_id in self.chat_ids:
+            self.store.delete_session(chat_id)
+
+    def tearDown(self):
+        for chat_id in self.chat_ids:
+            self.store.delete_session(chat_id)
+
+    def test_iter_sessions(self):
+        self.legacy_store.save_session('test_legacy', {'interface': 'test'})
+        self.legacy_store.save_session('test_migrated', {'interface': 'test'})
+        self.store.save_session('test_migrated', {'interface': 'test'})
+        sessions = [session for session in self.store.iter_sessions() if session[0] in self.chat_ids]
+        self.assertCountEqual(sessions, [('test_legacy', 'test'), ('test_migrated', 'test')])
+        sessions = RedisSessionStore(self.db, PerChatLayout(legacy_fallback=False)).iter_sessions()
+        self.assertEqual([session for session in sessions if session[0] in self.chat_ids], [('test_migrated', 'test')])
+
+    def test_legacy_migration(self):
+        with override_settings(GOLEM_CONFIG={'CONTEXT_DELTA_PERSISTENCE': True}):
+            dialog = DialogManager(self.session, store=self.legacy_store)
+            dialog.context.counter = 5
+            dialog.save_state()
+
+            dialog = DialogManager(self.session, store=self.store)
+            self.assertEqual(dialog.context.counter, 5)
+            dialog.current_state_name = 'help.root'
+            dialog.save_state()
+
+        # the first save after loading from the global hashes writes the whole context
+        stored = self.store.load_session(self.session.chat_id)
+        self.assertEqual(stored['state'], 'help.root')
+        self.assertFalse(stored['legacy'])
+        self.assertEqual(stored['log'], [])
+        self.assertIsNotNone(self.db.hget(PerChatLayout().session_key(self.session.chat_id), 'context'))
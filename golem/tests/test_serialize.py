@@ -0,0 +1,105 @@
+from datetime import datetime, timezone as dt_timezone
+from unittest import TestCase
+
+import pytz
+from dateutil.tz import tzoffset
+
+from django.test import override_settings
+from django.utils import timezone
+
+from golem.benchmarks import make_context
+from golem.core.context import Context
+from golem.core.serialize import (
+    LazyEntities, apply_context_deltas, binary_dumps, binary_loads, dumps_context, dumps_context_delta, json_dumps,
+    loads_context, _msgpack_dumps, _msgpack_loads
+)
+
+
+class TestContextSerialization(TestCase):
+
+    def setUp(self):
+        self.context = make_context(entities=12, depth=5)
+        self.data = self.context.to_dict()
+
+    def assertSameEntities(self, data):
+        self.assertEqual(data['counter'], self.data['counter'])
+        self.assertEqual(data['history'], self.data['history'])
+        self.assertEqual(set(data['entities']), set(self.data['entities']))
+        for name, values in self.data['entities'].items():
+            loaded = data['entities'][name]
+            self.assertEqual(len(loaded), len(values))
+            for expected, actual in zip(values, loaded):
+                self.assertEqual(actual.name, expected.name)
+                self.assertEqual(actual.counter, expected.counter)
+                self.assertEqual(actual.timestamp, expected.timestamp)
+                self.assertEqual(actual.state_set, expected.state_set)
+                self.assertEqual(set(actual.raw), set(expected.raw))
+                self.assertEqual(actual.value, expected.value)
+                self.assertIs(type(actual.value), type(expected.value))
+
+    def test_binary_round_trip(self):
+        blob = binary_dumps(self.data)
+        self.assertIsInstance(blob, bytes)
+        self.assertSameEntities(loads_context(blob))
+
+    def test_reads_legacy_json(self):
+        blob = json_dumps(self.data).encode('utf-8')
+        self.assertSameEntities(loads_context(blob))
+
+    def test_lazy_loading(self):
+        blob = binary_dumps(self.data)
+        data = loads_context(blob, lazy=True)
+        self.assertIsInstance(data['entities'], LazyEntities)
+        self.assertSameEntities(loads_context(blob, lazy=True))
+
+        context = Context.from_dict(dialog=self.context.dialog, data=data)
+        context.counter += 1
+        self.assertEqual(context.get_value('entity_1'), 'value_1_4')
+        self.assertIsNone(context.get('entity_2', max_age=0))
+        context.set_value('new', 'foo')
+        self.assertEqual(set(data['entities'].decoded), {'entity_1', 'new'})
+
+        saved = binary_loads(binary_dumps(context.to_dict()), lazy=True)['entities']
+        self.assertEqual(saved.encoded['entity_2'], binary_loads(blob, lazy=True)['entities'].encoded['entity_2'])
+        self.assertEqual(saved['new'][0].value, 'foo')
+        self.assertSameEntities(loads_context(json_dumps(binary_loads(blob, lazy=True)).encode('utf-8')))
+
+    def test_deltas(self):
+        snapshot = binary_dumps(self.data)
+        self.context.changes = []
+        self.context.counter += 1
+        self.context.set_value('entity_1', 'foo')
+        self.context.clear(['entity_2'])
+        self.context.add_state('flow_1.state_1')
+        delta = dumps_context_delta(self.context.counter, self.context.history, self.context.changes)
+        self.assertLess(len(delta), len(snapshot) / 10)
+
+        self.data = self.context.to_dict()
+        self.assertSameEntities(apply_context_deltas(loads_context(snapshot, lazy=True), [delta],
+                                                     self.context.get_max_depth))
+
+    def test_binary_is_smaller(self):
+        self.assertLess(len(binary_dumps(self.data)), len(json_dumps(self.data)))
+
+    def test_config(self):
+        with override_settings(GOLEM_CONFIG={'CONTEXT_SERIALIZER': 'binary'}):
+            self.assertIsInstance(dumps_context(self.data), bytes)
+        with override_settings(GOLEM_CONFIG={}):
+            self.assertIsInstance(dumps_context(self.data), str)
+        with override_settings(GOLEM_CONFIG={'CONTEXT_SERIALIZER': 'foo'}):
+            self.assertRaises(ValueError, dumps_context, self.data)
+
+    def test_exact_types(self):
+        now = timezone.now()
+        prague = pytz.timezone('Europe/Prague')
+        values = [None, True, False, 0, 127, -1, -33, 300, -70000, 2 ** 40, -2 ** 40, 1.5, 'foo', 'x' * 300, b'bar',
+                  [1, [2]], (1, (2, [3])), {'a': {1: (2,)}}, {'set'}, now, datetime(2018, 1, 2, 3, 4, 5, 6),
+                  datetime(2018, 1, 2, tzinfo=dt_timezone.utc), prague.localize(datetime(2018, 7, 1, 12)),
+                  datetime(2018, 1, 2, tzinfo=prague), datetime(2018, 1, 2, tzinfo=tzoffset(None, 3600))]
+        for value in values:
+            loaded = _msgpack_loads(_msgpack_dumps(value))
+            self.assertEqual(loaded, value)
+            self.assertIs(type(loaded), type(value))
+            if isinstance(value, datetime):
+                self.assertEqual(loaded.tzinfo, value.tzinfo)
+                self.assertEqual(loaded.utcoffset(), value.utcoffset())
@@ -20,6 +20,7 @@ urlpatterns = [
     url(r'^log_tests/?$', views.log_tests),
     url(r'^test/?$', views.test),
     url(r'^debug/?$', views.debug),
+    url(r'^context/(?P<chat_id>[a-zA-Z0-9_\-]+)/?$', views.context_snapshot),
     url(r'^test_record/?$', views.test_record),
     url(r'^users/?', views.users_view),
     url(r'^log_conversation/(?P<group_id>[a-zA-Z_0-9]*)/(?P<page>[0-9]*)/?$', views.log_conversation)
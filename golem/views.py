@@ -16,7 +16,7 @@ from django.views.decorators.csrf import csrf_exempt
 from golem.core.interfaces.facebook import FacebookInterface
 from golem.core.interfaces.microsoft import MicrosoftInterface
 from golem.core.interfaces.telegram import TelegramInterface
-from golem.core.persistence import get_redis
+from golem.core.persistence import get_session_store
 from golem.core.logging.elastic import get_elastic
 from golem.core.tests import ConversationTest, ConversationTestRecorder, ConversationTestException, TestLog, \
     UserTextMessage
@@ -99,7 +99,7 @@ def run_all_tests(request):
 
     print('Running tests: {}'.format(modules))
     tests = []
-    db = get_redis()
+    db = get_session_store()
     db.delete('test_results')
     for module in modules:
         print('Running tests "{}"'.format(module))
@@ -116,7 +116,7 @@ def _get_test_modules(path):
 
 @login_required
 def test(request):
-    db = get_redis()
+    db = get_session_store()
     results = db.hgetall('test_results')
     results = [json.loads(results[k].decode('utf-8')) for k in sorted(list(results))] if results else []
 
@@ -161,7 +161,7 @@ def _run_test_module(name, benchmark=False):
 
     result = _run_test_actions(name, module.actions, benchmark=benchmark)
     test = {'name':name, 'result':result}
-    db = get_redis()
+    db = get_session_store()
     db.hset('test_results', name, json.dumps(test))
     return test
 
@@ -321,6 +321,28 @@ def log_conversation(request, group_id=None, page=1):
     template = loader.get_template('golem/log_conversation.html')
     return HttpResponse(template.render(context,request))
 
+@login_required
+def context_snapshot(request, chat_id):
+    """Returns the context of a chat as JSON, see Context.snapshot()."""
+    from django.core.serializers.json import DjangoJSONEncoder
+    from golem.core.context import Context
+    from golem.core.serialize import apply_context_deltas, loads_context
+
+    stored = get_session_store().load_session(chat_id)
+    if stored['context'] is None:
+        return JsonResponse({'error': 'Chat {} has no context'.format(chat_id)}, status=404)
+    data = loads_context(stored['context'], lazy=True)
+    if stored['log']:
+        apply_context_deltas(data, stored['log'])
+    max_age = request.GET.get('max_age')
+    snapshot = Context.from_dict(dialog=None, data=data).snapshot(
+        max_age=int(max_age) if max_age else None,
+        first_only=request.GET.get('first_only') == '1'
+    )
+    snapshot['state'] = stored['state']
+    return JsonResponse(snapshot, encoder=DjangoJSONEncoder)
+
+
 def debug(request):
     FacebookInterface.accept_request({'entry':[{'messaging':[{'message': {'seq': 356950, 'mid': 'mid.$cAAPhQrFuNkFibcXMZ1cPICEB8YUn', 'text': 'hi'}, 'recipient': {'id': '1092102107505462'}, 'timestamp': 1595663674471, 'sender': {'id': '1046728978756975'}}]}]})
 
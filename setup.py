@@ -34,12 +34,12 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
         'Topic :: Internet :: WWW/HTTP',
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
     ],
+    python_requires='>=3.6',
     install_requires=['django', 'networkx', 'requests', 'six', 'sqlparse', 'wit==4.3.0', 'wheel', 'redis',
-                      'pytz', 'unidecode', 'emoji', 'elasticsearch', 'celery==4.1.1', 'python-dateutil', 'pyyaml'],
+                      'pytz', 'unidecode', 'emoji', 'elasticsearch', 'celery==4.1.1', 'python-dateutil', 'pyyaml',
+                      'msgpack>=0.6.1'],
 )